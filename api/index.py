@@ -6,10 +6,24 @@ Vercel Functions API for Yahoo Finance data
 from http.server import BaseHTTPRequestHandler
 import json
 import urllib.parse
-import urllib.request
 import urllib.error
 from datetime import datetime
 
+from market_data.fx import FX_CURRENCIES, fx_provider
+from market_data.http_client import YAHOO_QUERY_BASE, http_client
+from market_data.negative_cache import NOT_FOUND, negative_cache, negative_result
+from market_data.quote_cache import cache_key, metadata_cache, quote_cache
+from market_data.securities import securities, security_to_dict
+from market_data.snapshot import defer_warm_start
+from market_data.symbols import classify, normalize_market
+from market_data.yahoo_quotes import fetch_quotes
+
+# 建置階段產生的報價快照延到第一次查詢報價時才載入，不查詢報價的請求不受影響
+defer_warm_start()
+
+# 批次查詢設定
+MAX_BATCH_SYMBOLS = 200  # 單次請求最多股票數
+
 class handler(BaseHTTPRequestHandler):
     def do_GET(self):
         # 解析URL和查詢參數
@@ -27,7 +41,20 @@ class handler(BaseHTTPRequestHandler):
         try:
             # 獲取股票代號
             symbol = query_params.get('symbol', [''])[0]
-            action = query_params.get('action', ['info'])[0]  # info 或 price
+            symbols = query_params.get('symbols', [''])[0]  # 批次查詢：A,B,C
+            action = query_params.get('action', ['info'])[0]  # info、price 或 fx
+            
+            # 匯率查詢：不需要股票代號
+            if action == 'fx':
+                result = self.get_fx_rates(query_params)
+                self.wfile.write(json.dumps(result).encode())
+                return
+            
+            # 批次股價查詢：一次調用取得多個股票
+            if symbols and action == 'price':
+                result = self.get_batch_stock_prices(symbols)
+                self.wfile.write(json.dumps(result).encode())
+                return
             
             if not symbol:
                 self.wfile.write(json.dumps({
@@ -60,51 +87,140 @@ class handler(BaseHTTPRequestHandler):
         self.send_header('Access-Control-Allow-Headers', 'Content-Type')
         self.end_headers()
     
+    def get_batch_stock_prices(self, symbols_param):
+        """
+        批次獲取多個股票價格（multi-quote 分批查詢）
+        每個代號可加上市場前綴（HK:9988,JP:7203），同一代號在不同市場各自查詢；
+        結果以請求中的原始字串為鍵。未加前綴的4位數字沿用日股
+        """
+        # 去除空白與重複，保留原始順序
+        symbol_list = []
+        for raw in symbols_param.split(','):
+            raw = raw.strip()
+            if raw and raw not in symbol_list:
+                symbol_list.append(raw)
+        
+        if not symbol_list:
+            return {'error': '缺少股票代號參數'}
+        if len(symbol_list) > MAX_BATCH_SYMBOLS:
+            return {'error': f'股票數量超過上限 ({MAX_BATCH_SYMBOLS})'}
+        
+        formatted = {}
+        for raw in symbol_list:
+            market, sep, code = raw.partition(':')
+            if sep and normalize_market(market) is not None:
+                formatted[raw] = classify(code, market=market).symbol
+            else:
+                formatted[raw] = classify(raw, default_market='JP').symbol
+        
+        # 先取快取，未命中的股票以 multi-quote 分批查詢；
+        # 過期不久的股價直接回傳（標記 stale），並以一次背景查詢更新
+        quotes = {}
+        missing = []
+        stale = []
+        for formatted_symbol in dict.fromkeys(formatted.values()):
+            key = cache_key('quote', formatted_symbol)
+            cached = quote_cache.get(key)
+            if cached is None:
+                cached = quote_cache.get_stale(key)
+                if cached is not None:
+                    cached, age = cached
+                    cached.update({'stale': True, 'cacheAge': round(age, 1)})
+                    stale.append(formatted_symbol)
+            if cached is not None:
+                quotes[formatted_symbol] = cached
+            else:
+                missing.append(formatted_symbol)
+        
+        if stale:
+            quote_cache.revalidate_many(
+                [cache_key('quote', s) for s in stale],
+                lambda keys: {
+                    cache_key('quote', s): quote
+                    for s, quote in fetch_quotes([key.split(':', 1)[1] for key in keys]).items()
+                }
+            )
+        
+        if missing:
+            for formatted_symbol, quote in fetch_quotes(missing).items():
+                if not quote.get('error'):
+                    quote_cache.set(cache_key('quote', formatted_symbol), quote)
+                quotes[formatted_symbol] = quote
+        
+        results = {}
+        prices = []
+        for raw in symbol_list:
+            price = dict(quotes[formatted[raw]])
+            price['success'] = not price.get('error')
+            results[raw] = price
+            prices.append(price)
+        
+        success_count = sum(1 for price in prices if price['success'])
+        return {
+            'results': results,
+            'total': len(symbol_list),
+            'success_count': success_count,
+            'error_count': len(symbol_list) - success_count,
+            'timestamp': datetime.now().isoformat()
+        }
+    
+    def get_fx_rates(self, query_params):
+        """
+        查詢對台幣匯率
+        currency=USD|HKD|JPY（省略時全部）；date=YYYY-MM-DD 查單日，start/end 查區間
+        """
+        currency = query_params.get('currency', [''])[0].upper()
+        on = query_params.get('date', [''])[0]
+        start = query_params.get('start', [''])[0]
+        end = query_params.get('end', [''])[0]
+        
+        currencies = [currency] if currency else list(FX_CURRENCIES)
+        if any(c not in FX_CURRENCIES for c in currencies):
+            return {'error': f'不支援的幣別: {currency}'}
+        
+        try:
+            if start:
+                return {
+                    'history': {c: fx_provider.history(c, start, end or None) for c in currencies},
+                    'timestamp': datetime.now().isoformat()
+                }
+            return {
+                'rates': {f'{c}_TWD': fx_provider.rate(c, on or None) for c in currencies},
+                'date': on or None,
+                'timestamp': datetime.now().isoformat()
+            }
+        except ValueError as e:
+            return {'error': f'無效的日期格式: {str(e)}'}
+    
     def get_stock_info(self, symbol):
         """獲取股票基本資訊"""
         try:
             # 確保股票代號有正確的後綴
-            if '.' not in symbol:
-                if symbol.startswith('0') and symbol.isdigit():
-                    # 港股：以0開頭的數字 (如 0700, 00700, 000001)
-                    formatted_symbol = f"{symbol}.HK"
-                elif symbol.isdigit():
-                    # 日股：純數字且不以0開頭 (如 7203, 6758)
-                    formatted_symbol = f"{symbol}.T"
-                else:
-                    formatted_symbol = symbol
-            else:
-                formatted_symbol = symbol
+            formatted_symbol = self.format_symbol(symbol)
+            
+            # 證券名錄有收錄的股票直接回傳，不需呼叫 Yahoo
+            listed = securities.lookup(formatted_symbol)
+            if listed is not None:
+                return security_to_dict(listed)
+            
+            # 確認查無資料的代號直接回傳，不再查詢上游
+            negative = negative_cache.get(formatted_symbol)
+            if negative is not None:
+                return negative_result(formatted_symbol, negative)
             
             # 港股特殊處理：使用Chart API獲取基本資訊
             if '.HK' in formatted_symbol:
                 return self.get_hk_stock_info(formatted_symbol)
             
-            # 其他市場使用原有API
-            url = f"https://query1.finance.yahoo.com/v1/finance/quoteType/{formatted_symbol}"
-            
-            req = urllib.request.Request(url)
-            req.add_header('User-Agent', 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36')
-            
-            with urllib.request.urlopen(req, timeout=10) as response:
-                data = json.loads(response.read().decode())
-            
-            if not data.get('quoteType') or not data['quoteType'].get('result'):
-                return {'error': '找不到該股票代號'}
-            
-            stock_info = data['quoteType']['result'][0]
-            
-            return {
-                'symbol': stock_info.get('symbol', formatted_symbol),
-                'name': stock_info.get('longName') or stock_info.get('shortName', ''),
-                'industry': stock_info.get('industry', 'N/A'),
-                'sector': stock_info.get('sector', 'N/A'),
-                'currency': stock_info.get('currency', 'USD'),
-                'exchange': stock_info.get('exchange', ''),
-                'timestamp': datetime.now().isoformat()
-            }
+            # 其他市場使用原有API（基本資料快取）
+            return metadata_cache.get_or_fetch(
+                cache_key('quoteType', formatted_symbol),
+                lambda: self.fetch_quote_type_info(formatted_symbol)
+            )
             
         except urllib.error.HTTPError as e:
+            if e.code == 404:
+                negative_cache.record(formatted_symbol, NOT_FOUND)
             return {'error': f'HTTP錯誤: {e.code} {e.reason}'}
         except urllib.error.URLError as e:
             return {'error': f'網路錯誤: {str(e)}'}
@@ -113,59 +229,42 @@ class handler(BaseHTTPRequestHandler):
         except Exception as e:
             return {'error': f'未知錯誤: {str(e)}'}
     
+    def fetch_quote_type_info(self, formatted_symbol):
+        """調用Yahoo Finance quoteType API"""
+        url = f"{YAHOO_QUERY_BASE}/v1/finance/quoteType/{formatted_symbol}"
+        
+        data = http_client.get_json(url)
+        
+        if not data.get('quoteType') or not data['quoteType'].get('result'):
+            negative_cache.record(formatted_symbol, NOT_FOUND)
+            return {'error': '找不到該股票代號'}
+        
+        stock_info = data['quoteType']['result'][0]
+        
+        return {
+            'symbol': stock_info.get('symbol', formatted_symbol),
+            'name': stock_info.get('longName') or stock_info.get('shortName', ''),
+            'industry': stock_info.get('industry', 'N/A'),
+            'sector': stock_info.get('sector', 'N/A'),
+            'currency': stock_info.get('currency', 'USD'),
+            'exchange': stock_info.get('exchange', ''),
+            'timestamp': datetime.now().isoformat()
+        }
+    
     def get_hk_stock_info(self, symbol):
         """港股專用資訊獲取"""
         try:
-            # 港股代號對照表（常見股票）
-            hk_stock_names = {
-                '00700.HK': '騰訊控股',
-                '00005.HK': '匯豐控股',
-                '00939.HK': '建設銀行',
-                '00941.HK': '中國移動',
-                '01299.HK': '友邦保險',
-                '02318.HK': '中國平安',
-                '01398.HK': '工商銀行',
-                '00388.HK': '香港交易所',
-                '00883.HK': '中國海洋石油',
-                '01810.HK': '小米集團',
-                '09988.HK': '阿里巴巴',
-                '03690.HK': '美團',
-                '00175.HK': '吉利汽車',
-                '02020.HK': '安踏體育',
-                '01024.HK': '快手科技'
-            }
-            
-            # 如果在對照表中，直接返回
-            if symbol in hk_stock_names:
-                return {
-                    'symbol': symbol,
-                    'name': hk_stock_names[symbol],
-                    'industry': 'N/A',
-                    'sector': 'N/A',
-                    'currency': 'HKD',
-                    'exchange': 'HKEX',
-                    'timestamp': datetime.now().isoformat()
-                }
+            listed = securities.lookup(symbol, 'HK')
+            if listed is not None:
+                return security_to_dict(listed)
             
-            # 否則嘗試從Chart API獲取
-            url = f"https://query1.finance.yahoo.com/v8/finance/chart/{symbol}"
-            req = urllib.request.Request(url)
-            req.add_header('User-Agent', 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36')
-            
-            with urllib.request.urlopen(req, timeout=10) as response:
-                data = json.loads(response.read().decode())
-            
-            if data.get('chart') and data['chart'].get('result'):
-                meta = data['chart']['result'][0]['meta']
-                return {
-                    'symbol': symbol,
-                    'name': meta.get('longName', symbol.replace('.HK', '')),
-                    'industry': 'N/A',
-                    'sector': 'N/A', 
-                    'currency': meta.get('currency', 'HKD'),
-                    'exchange': 'HKEX',
-                    'timestamp': datetime.now().isoformat()
-                }
+            # 否則嘗試從Chart API獲取（基本資料快取）
+            chart_info = metadata_cache.get_or_fetch(
+                cache_key('chartInfo', symbol),
+                lambda: self.fetch_hk_chart_info(symbol)
+            )
+            if chart_info:
+                return chart_info
             
             # 如果都失敗，返回基本資訊
             return {
@@ -178,60 +277,49 @@ class handler(BaseHTTPRequestHandler):
                 'timestamp': datetime.now().isoformat()
             }
             
+        except urllib.error.HTTPError:
+            # 交由 get_stock_info 處理（404 寫入負向快取）
+            raise
         except Exception as e:
             return {'error': f'港股查詢錯誤: {str(e)}'}
     
+    def fetch_hk_chart_info(self, symbol):
+        """從Chart API獲取港股名稱，無資料時回傳 None"""
+        url = f"{YAHOO_QUERY_BASE}/v8/finance/chart/{symbol}"
+        data = http_client.get_json(url)
+        
+        if data.get('chart') and data['chart'].get('result'):
+            meta = data['chart']['result'][0]['meta']
+            return {
+                'symbol': symbol,
+                'name': meta.get('longName', symbol.replace('.HK', '')),
+                'industry': 'N/A',
+                'sector': 'N/A', 
+                'currency': meta.get('currency', 'HKD'),
+                'exchange': 'HKEX',
+                'timestamp': datetime.now().isoformat()
+            }
+        
+        return None
+    
+    def fetch_stock_price(self, formatted_symbol):
+        """調用Yahoo Finance報價API獲取股價"""
+        return fetch_quotes([formatted_symbol])[formatted_symbol]
+    
+    def format_symbol(self, symbol):
+        """確保股票代號有正確的後綴（無法判斷市場的4位數字視為日股）"""
+        return classify(symbol, default_market='JP').symbol
+    
     def get_stock_price(self, symbol):
         """獲取股票價格資訊"""
         try:
-            # 確保股票代號有正確的後綴
-            if '.' not in symbol:
-                if symbol.startswith('0') and symbol.isdigit():
-                    # 港股：以0開頭的數字 (如 0700, 00700, 000001)
-                    formatted_symbol = f"{symbol}.HK"
-                elif symbol.isdigit():
-                    # 日股：純數字且不以0開頭 (如 7203, 6758)
-                    formatted_symbol = f"{symbol}.T"
-                else:
-                    formatted_symbol = symbol
-            else:
-                formatted_symbol = symbol
-            
-            # 調用Yahoo Finance Chart API
-            url = f"https://query1.finance.yahoo.com/v8/finance/chart/{formatted_symbol}"
+            formatted_symbol = self.format_symbol(symbol)
             
-            req = urllib.request.Request(url)
-            req.add_header('User-Agent', 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36')
-            
-            with urllib.request.urlopen(req, timeout=10) as response:
-                data = json.loads(response.read().decode())
-            
-            if not data.get('chart') or not data['chart'].get('result'):
-                return {'error': '無法獲取股價數據'}
-            
-            result = data['chart']['result'][0]
-            meta = result['meta']
-            
-            # 獲取最新價格
-            current_price = meta.get('regularMarketPrice', 0)
-            previous_close = meta.get('previousClose', 0)
-            
-            # 計算漲跌
-            change = current_price - previous_close if current_price and previous_close else 0
-            change_percent = (change / previous_close * 100) if previous_close else 0
-            
-            return {
-                'symbol': meta.get('symbol', formatted_symbol),
-                'currentPrice': current_price,
-                'change': change,
-                'changePercent': round(change_percent, 2),
-                'high': meta.get('regularMarketDayHigh', 0),
-                'low': meta.get('regularMarketDayLow', 0),
-                'open': meta.get('regularMarketOpen', 0),
-                'previousClose': previous_close,
-                'volume': meta.get('regularMarketVolume', 0),
-                'timestamp': datetime.now().isoformat()
-            }
+            # 股價快取：相同股票在TTL內只查詢一次上游；剛過期時先回傳舊值並在背景更新
+            return quote_cache.get_or_fetch_swr(
+                cache_key('quote', formatted_symbol),
+                lambda: self.fetch_stock_price(formatted_symbol)
+            )
             
         except urllib.error.HTTPError as e:
             return {'error': f'HTTP錯誤: {e.code} {e.reason}'}
@@ -0,0 +1,48 @@
+"""
+Vercel Functions API：股票代號搜尋
+以本地證券名錄回答代號與名稱的自動完成，不呼叫 Yahoo
+"""
+
+from http.server import BaseHTTPRequestHandler
+import json
+import urllib.parse
+from datetime import datetime
+
+from market_data.search import SEARCH_DEFAULT_LIMIT, search_symbols
+
+class handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        # 解析URL和查詢參數
+        parsed_url = urllib.parse.urlparse(self.path)
+        query_params = urllib.parse.parse_qs(parsed_url.query)
+        
+        # 設置CORS headers
+        self.send_response(200)
+        self.send_header('Content-type', 'application/json')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Allow-Methods', 'GET, OPTIONS')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        self.end_headers()
+        
+        try:
+            query = query_params.get('q', [''])[0]
+            limit = query_params.get('limit', [SEARCH_DEFAULT_LIMIT])[0]
+            market = query_params.get('market', [None])[0]  # HK、JP、TW，未指定時搜尋全部
+            
+            result = search_symbols(query, limit, market)
+            self.wfile.write(json.dumps(result).encode())
+            
+        except Exception as e:
+            error_response = {
+                'error': f'搜尋失敗: {str(e)}',
+                'timestamp': datetime.now().isoformat()
+            }
+            self.wfile.write(json.dumps(error_response).encode())
+    
+    def do_OPTIONS(self):
+        # 處理預檢請求
+        self.send_response(200)
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Allow-Methods', 'GET, OPTIONS')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        self.end_headers()
@@ -6,10 +6,19 @@
 from http.server import BaseHTTPRequestHandler
 import json
 import urllib.parse
-import urllib.request
 import urllib.error
 from datetime import datetime
-import re
+
+from market_data.http_client import YAHOO_QUERY_BASE, http_client
+from market_data.negative_cache import ERROR_MESSAGES, FORMAT_INVALID, NOT_FOUND, negative_cache
+from market_data.quote_cache import cache_key, metadata_cache, quote_cache
+from market_data.snapshot import defer_warm_start
+from market_data.symbol_index import symbol_index
+from market_data.symbols import classify
+from market_data.yahoo_quotes import fetch_quotes
+
+# 建置階段產生的報價快照延到第一次查詢報價時才載入，不查詢報價的請求不受影響
+defer_warm_start()
 
 class handler(BaseHTTPRequestHandler):
     def do_GET(self):
@@ -67,31 +76,20 @@ class handler(BaseHTTPRequestHandler):
         標準化港股代號格式
         基於測試發現：4位格式最有效
         """
-        # 移除所有非數字字符
-        digits = re.sub(r'[^\d]', '', str(symbol))
-        
-        if not digits:
-            raise ValueError(f"無效的股票代號: {symbol}")
-        
-        # 轉換為整數再轉回字符串（自動移除前導0）
-        stock_number = int(digits)
-        
-        # 格式化為4位數字（不足補0）
-        formatted_number = f"{stock_number:04d}"
-        
-        return f"{formatted_number}.HK"
+        return self._normalize_symbol(symbol, 'HK')
     
     def normalize_jp_stock_symbol(self, symbol):
         """
         標準化日股代號格式
         """
-        # 移除所有非數字字符
-        digits = re.sub(r'[^\d]', '', str(symbol))
-        
-        if not digits:
+        return self._normalize_symbol(symbol, 'JP')
+    
+    def _normalize_symbol(self, symbol, market):
+        """去除原有的前綴或後綴後，以指定市場的格式重新組合（港股補足4位數字）"""
+        info = classify(classify(symbol).code, market=market)
+        if info.market != market:
             raise ValueError(f"無效的股票代號: {symbol}")
-        
-        return f"{digits}.T"
+        return info.symbol
     
     def get_formatted_symbol(self, symbol, market):
         """
@@ -130,36 +128,61 @@ class handler(BaseHTTPRequestHandler):
         else:
             formats_to_try = [symbol]
         
-        last_error = None
+        # 解析索引：已知格式優先嘗試
+        known = symbol_index.lookup(symbol, market)
+        if known:
+            formats_to_try = [known['symbol']] + [f for f in formats_to_try if f != known['symbol']]
         
+        # 負向快取：確認查無資料的格式直接略過，全部都查無時不呼叫上游
+        negatives = negative_cache.get_many(formats_to_try)
+        last_error = None
+        reason = None
         for formatted_symbol in formats_to_try:
+            negative = negatives.get(formatted_symbol.upper())
+            if negative is not None:
+                last_error = ERROR_MESSAGES[negative['reason']]
+                reason = negative['reason']
+                continue
             try:
                 result = api_call_func(formatted_symbol)
                 if not result.get('error'):
                     result['format_used'] = formatted_symbol
+                    if not known or known['symbol'] != formatted_symbol:
+                        if formatted_symbol.endswith('.HK'):
+                            resolved_market = 'hk'
+                        elif formatted_symbol.endswith('.T'):
+                            resolved_market = 'jp'
+                        else:
+                            resolved_market = market
+                        symbol_index.record_hit(symbol, market, formatted_symbol, resolved_market)
                     return result
                 last_error = result.get('error')
+                reason = result.get('reason', reason)
+            except urllib.error.HTTPError as e:
+                last_error = str(e)
+                if e.code == 404:
+                    reason = NOT_FOUND
+                    negative_cache.record(formatted_symbol, reason)
+                continue
             except Exception as e:
                 last_error = str(e)
                 continue
         
         return {
             'error': f'所有格式都無法獲取 {symbol} 的資料。最後錯誤: {last_error}',
+            'reason': reason,
             'formats_tried': formats_to_try
         }
     
     def call_yahoo_finance_info_api(self, formatted_symbol):
         """調用Yahoo Finance資訊API"""
-        url = f"https://query1.finance.yahoo.com/v1/finance/quoteType/{formatted_symbol}"
-        
-        req = urllib.request.Request(url)
-        req.add_header('User-Agent', 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36')
+        url = f"{YAHOO_QUERY_BASE}/v1/finance/quoteType/{formatted_symbol}"
         
-        with urllib.request.urlopen(req, timeout=10) as response:
-            data = json.loads(response.read().decode())
+        data = http_client.get_json(url)
         
         if not data.get('quoteType') or not data['quoteType'].get('result'):
-            return {'error': '找不到該股票代號'}
+            negative_cache.record(formatted_symbol, NOT_FOUND)
+            return {'error': '找不到該股票代號', 'reason': NOT_FOUND}
         
         stock_info = data['quoteType']['result'][0]
         
@@ -175,64 +198,51 @@ class handler(BaseHTTPRequestHandler):
     
     def call_yahoo_finance_price_api(self, formatted_symbol):
         """調用Yahoo Finance價格API"""
-        url = f"https://query1.finance.yahoo.com/v8/finance/chart/{formatted_symbol}"
-        
-        req = urllib.request.Request(url)
-        req.add_header('User-Agent', 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36')
-        
-        with urllib.request.urlopen(req, timeout=10) as response:
-            data = json.loads(response.read().decode())
-        
-        if not data.get('chart') or not data['chart'].get('result'):
-            return {'error': '無法獲取股價數據'}
-        
-        result = data['chart']['result'][0]
-        meta = result['meta']
-        
-        # 獲取最新價格
-        current_price = meta.get('regularMarketPrice', 0)
-        previous_close = meta.get('previousClose', 0)
-        
-        # 計算漲跌
-        change = current_price - previous_close if current_price and previous_close else 0
-        change_percent = (change / previous_close * 100) if previous_close else 0
-        
-        return {
-            'symbol': meta.get('symbol', formatted_symbol),
-            'currentPrice': current_price,
-            'change': change,
-            'changePercent': round(change_percent, 2),
-            'high': meta.get('regularMarketDayHigh', 0),
-            'low': meta.get('regularMarketDayLow', 0),
-            'open': meta.get('regularMarketOpen', 0),
-            'previousClose': previous_close,
-            'volume': meta.get('regularMarketVolume', 0),
-            'timestamp': datetime.now().isoformat()
-        }
+        return fetch_quotes([formatted_symbol])[formatted_symbol]
+    
+    def get_cached_info(self, formatted_symbol):
+        """帶快取的資訊查詢（基本資料TTL）"""
+        return metadata_cache.get_or_fetch(
+            cache_key('quoteType', formatted_symbol),
+            lambda: self.call_yahoo_finance_info_api(formatted_symbol)
+        )
+    
+    def get_cached_price(self, formatted_symbol):
+        """帶快取的價格查詢（股價TTL）"""
+        return quote_cache.get_or_fetch(
+            cache_key('quote', formatted_symbol),
+            lambda: self.call_yahoo_finance_price_api(formatted_symbol)
+        )
     
     def get_stock_info(self, symbol, market):
         """獲取股票基本資訊"""
         try:
-            return self.try_multiple_formats(symbol, market, self.call_yahoo_finance_info_api)
+            return self.try_multiple_formats(symbol, market, self.get_cached_info)
         except urllib.error.HTTPError as e:
             return {'error': f'HTTP錯誤: {e.code} {e.reason}'}
         except urllib.error.URLError as e:
             return {'error': f'網路錯誤: {str(e)}'}
         except json.JSONDecodeError:
             return {'error': '無法解析API回應'}
+        except ValueError as e:
+            # 代號無法組成指定市場的格式
+            return {'error': str(e), 'reason': FORMAT_INVALID}
         except Exception as e:
             return {'error': f'未知錯誤: {str(e)}'}
     
     def get_stock_price(self, symbol, market):
         """獲取股票價格資訊"""
         try:
-            return self.try_multiple_formats(symbol, market, self.call_yahoo_finance_price_api)
+            return self.try_multiple_formats(symbol, market, self.get_cached_price)
         except urllib.error.HTTPError as e:
             return {'error': f'HTTP錯誤: {e.code} {e.reason}'}
         except urllib.error.URLError as e:
             return {'error': f'網路錯誤: {str(e)}'}
         except json.JSONDecodeError:
             return {'error': '無法解析API回應'}
+        except ValueError as e:
+            # 代號無法組成指定市場的格式
+            return {'error': str(e), 'reason': FORMAT_INVALID}
         except Exception as e:
             return {'error': f'未知錯誤: {str(e)}'}
 
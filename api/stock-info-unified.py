@@ -4,10 +4,19 @@
 """
 
 import json
-import requests
-import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from urllib.parse import parse_qs
 
+from market_data.http_client import YAHOO_QUERY_BASE, http_client
+from market_data.negative_cache import DELISTED, NOT_FOUND, listing_reason, negative_cache
+from market_data.quote_cache import cache_key, quote_cache
+from market_data.snapshot import defer_warm_start
+from market_data.symbol_index import symbol_index
+from market_data.symbols import classify
+
+# 建置階段產生的報價快照延到第一次查詢報價時才載入，不查詢報價的請求不受影響
+defer_warm_start()
+
 def smart_format_hk_symbol(symbol):
     """
     智能格式化港股代號
@@ -63,85 +72,159 @@ def smart_format_jp_symbol(symbol):
         f"TSE:{base_symbol}",    # TSE前綴格式
     ]
 
-def get_stock_info_with_retry(symbol_formats, original_symbol):
+# 並行探測設定
+PROBE_MAX_CONCURRENCY = 4  # 同時探測的候選格式數上限
+
+def probe_symbol_format(fmt):
+    """
+    查詢單一候選格式
+    回傳 (狀態, 結果)：狀態為 hit（成功）、miss（上游明確查無）或 error（網路、限流等）
+    """
+    # 快取命中：此格式在TTL內已成功查詢過
+    cached = quote_cache.get(cache_key('chartResolve', fmt))
+    if cached is not None:
+        return 'hit', cached
+    
+    try:
+        url = f"{YAHOO_QUERY_BASE}/v8/finance/chart/{fmt}"
+        response = http_client.get(url)
+        
+        if response.status == 200:
+            data = response.json()
+            meta = None
+            if 'chart' in data and data['chart']['result']:
+                result = data['chart']['result'][0]
+                meta = result.get('meta', {})
+                
+                company_name = meta.get('longName') or meta.get('shortName')
+                current_price = meta.get('regularMarketPrice')
+                currency = meta.get('currency', 'USD')
+                
+                if company_name and current_price is not None:
+                    result = {
+                        'success': True,
+                        'symbol': fmt,
+                        'company_name': company_name,
+                        'price': current_price,
+                        'currency': currency,
+                        'format_used': fmt
+                    }
+                    quote_cache.set(cache_key('chartResolve', fmt), result)
+                    return 'hit', result
+            # 只在上游沒有此代號、或仍查得到但沒有價格與交易時間時記錄；
+            # 有價格只是缺名稱的回應不寫入負向快取，避免有效代號被隱藏
+            reason = listing_reason(meta)
+            if reason is not None:
+                negative_cache.record(fmt, reason)
+            return 'miss', None
+        
+        if response.status == 404:
+            # Yahoo 的 404 無法分辨打錯的代號與下市，一律記為查無此代號
+            negative_cache.record(fmt, NOT_FOUND)
+            return 'miss', None
+        return 'error', None
+        
+    except Exception:
+        return 'error', None
+
+def get_stock_info_with_retry(symbol_formats, original_symbol, parallel=False):
     """
     使用多格式重試獲取股票資訊
+    parallel=True 時並行探測所有候選格式，否則依序嘗試
+    上游明確查無資料的格式寫入負向快取（在 probe_symbol_format 中），下次直接略過
     """
-    for fmt in symbol_formats:
-        if fmt is None:  # 跳過無效格式
-            continue
-            
-        try:
-            url = f"https://query1.finance.yahoo.com/v8/finance/chart/{fmt}"
-            response = requests.get(url, timeout=10)
-            
-            if response.status_code == 200:
-                data = response.json()
-                if 'chart' in data and data['chart']['result']:
-                    result = data['chart']['result'][0]
-                    meta = result.get('meta', {})
-                    
-                    company_name = meta.get('longName') or meta.get('shortName')
-                    current_price = meta.get('regularMarketPrice')
-                    currency = meta.get('currency', 'USD')
-                    
-                    if company_name and current_price is not None:
-                        return {
-                            'success': True,
-                            'symbol': fmt,
-                            'company_name': company_name,
-                            'price': current_price,
-                            'currency': currency,
-                            'format_used': fmt
-                        }
-            
-            # 添加小延遲避免API限制
-            time.sleep(0.1)
-            
-        except Exception as e:
-            continue
+    formats = [fmt for fmt in symbol_formats if fmt is not None]  # 跳過無效格式
     
+    # 負向快取中確認查無資料的格式不再探測
+    negatives = negative_cache.get_many(formats)
+    candidates = [fmt for fmt in formats if fmt.upper() not in negatives]
+    
+    if parallel and len(candidates) > 1:
+        outcomes = probe_formats_concurrently(candidates)
+    else:
+        outcomes = []
+        for fmt in candidates:
+            status, result = probe_symbol_format(fmt)
+            outcomes.append((status, result))
+            if status == 'hit':
+                break
+            # 請求速率由 http_client 的上游流量控制統一管理，不再固定延遲
+    
+    for status, result in outcomes:
+        if status == 'hit':
+            return result
+    
+    reasons = {entry['reason'] for entry in negative_cache.get_many(formats).values()}
     return {
         'success': False,
         'error': f'找不到該股票代號',
-        'original_symbol': original_symbol
+        'original_symbol': original_symbol,
+        'reason': DELISTED if DELISTED in reasons else NOT_FOUND
     }
 
-def determine_market(symbol):
+def probe_formats_concurrently(candidates, max_workers=PROBE_MAX_CONCURRENCY):
     """
-    智能判斷股票市場
+    並行探測候選格式（清單順序即優先序）
+    當某候選成功且所有更高優先序的候選皆已失敗時立即回傳，並取消尚未開始的探測；
+    回傳依優先序排列的 (狀態, 結果) 清單，未完成的候選不列入
     """
-    symbol = str(symbol).strip().upper()
-    
-    # 移除後綴進行判斷
-    base_symbol = symbol
-    if '.' in symbol:
-        base_symbol = symbol.split('.')[0]
-    if ':' in symbol:
-        base_symbol = symbol.split(':')[1]
-    
-    # 港股判斷邏輯
-    if symbol.endswith('.HK') or symbol.startswith('HK:'):
-        return 'hk'
-    
-    # 日股判斷邏輯
-    if (symbol.endswith('.T') or symbol.endswith('.TO') or symbol.endswith('.JP') or 
-        symbol.startswith('TYO:') or symbol.startswith('TSE:')):
-        return 'jp'
+    outcomes = [None] * len(candidates)
+    executor = ThreadPoolExecutor(max_workers=min(max_workers, len(candidates)))
+    try:
+        futures = {executor.submit(probe_symbol_format, fmt): i for i, fmt in enumerate(candidates)}
+        pending = set(futures)
+        
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                outcomes[futures[future]] = future.result()
+            
+            # 由最高優先序往下檢查，遇到尚未完成的候選即停止
+            for i, outcome in enumerate(outcomes):
+                if outcome is None:
+                    break
+                if outcome[0] == 'hit':
+                    return outcomes[:i + 1]
+        
+        return outcomes
+    finally:
+        # 不等待進行中的請求，並取消排隊中的探測
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def market_of_format(fmt):
+    """由解析成功的代號格式判斷市場"""
+    return 'hk' if fmt.endswith('.HK') else 'jp'
+
+def resolve_stock_info(symbol, market, symbol_formats):
+    """
+    透過解析索引獲取股票資訊
+    已解析過的輸入只需一次上游查詢；各候選格式的查無資料紀錄由負向快取處理
+    """
+    known = symbol_index.lookup(symbol, market)
+    if known:
+        result = get_stock_info_with_retry([known['symbol']], symbol)
+        if result['success']:
+            return result, known['market']
+        # 已知格式失效，清除後重新嘗試所有格式
+        symbol_index.forget(symbol, market)
     
-    # 基於數字模式判斷
-    if base_symbol.isdigit():
-        # 港股通常以0開頭或者是4位數字
-        if base_symbol.startswith('0') or (len(base_symbol) == 4 and int(base_symbol) >= 1000):
-            return 'hk'
-        # 日股通常是4位數字
-        elif len(base_symbol) == 4:
-            return 'jp'
-        # 較短的數字更可能是日股
-        elif len(base_symbol) < 4:
-            return 'jp'
+    # 未知市場的候選格式橫跨港股與日股，改用並行探測
+    result = get_stock_info_with_retry(symbol_formats, symbol, parallel=market not in ('hk', 'jp'))
+    if result['success']:
+        resolved_market = market_of_format(result['format_used']) if market not in ('hk', 'jp') else market
+        symbol_index.record_hit(symbol, market, result['format_used'], resolved_market)
+        return result, resolved_market
     
-    # 默認返回未知
+    return result, market
+
+def determine_market(symbol):
+    """
+    智能判斷股票市場
+    4位數字港股、日股皆有可能，回傳 'unknown' 由呼叫端兩種格式都嘗試（港股優先）
+    """
+    info = classify(symbol)
+    if info.market in ('HK', 'JP') and not info.ambiguous:
+        return info.market.lower()
     return 'unknown'
 
 def handler(request):
@@ -178,8 +261,8 @@ def handler(request):
             jp_formats = smart_format_jp_symbol(symbol)
             symbol_formats = hk_formats + jp_formats
         
-        # 獲取股票資訊
-        result = get_stock_info_with_retry(symbol_formats, symbol)
+        # 獲取股票資訊（優先使用解析索引）
+        result, market = resolve_stock_info(symbol, market, symbol_formats)
         
         if result['success']:
             return {
@@ -198,6 +281,7 @@ def handler(request):
                 'statusCode': 404,
                 'body': json.dumps({
                     'error': result['error'],
+                    'reason': result.get('reason'),
                     'original_symbol': symbol,
                     'market': market
                 })
@@ -6,11 +6,12 @@
 from http.server import BaseHTTPRequestHandler
 import json
 import urllib.parse
-import urllib.request
 import urllib.error
 from datetime import datetime
 import re
 
+from market_data.http_client import YAHOO_QUERY_BASE, http_client
+
 class handler(BaseHTTPRequestHandler):
     def do_GET(self):
         # 解析URL和查詢參數
@@ -150,13 +151,9 @@ class handler(BaseHTTPRequestHandler):
     
     def call_yahoo_finance_info_api(self, formatted_symbol):
         """調用Yahoo Finance資訊API"""
-        url = f"https://query1.finance.yahoo.com/v1/finance/quoteType/{formatted_symbol}"
-        
-        req = urllib.request.Request(url)
-        req.add_header('User-Agent', 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36')
+        url = f"{YAHOO_QUERY_BASE}/v1/finance/quoteType/{formatted_symbol}"
         
-        with urllib.request.urlopen(req, timeout=10) as response:
-            data = json.loads(response.read().decode())
+        data = http_client.get_json(url)
         
         if not data.get('quoteType') or not data['quoteType'].get('result'):
             return {'error': '找不到該股票代號'}
@@ -175,13 +172,9 @@ class handler(BaseHTTPRequestHandler):
     
     def call_yahoo_finance_price_api(self, formatted_symbol):
         """調用Yahoo Finance價格API"""
-        url = f"https://query1.finance.yahoo.com/v8/finance/chart/{formatted_symbol}"
-        
-        req = urllib.request.Request(url)
-        req.add_header('User-Agent', 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36')
+        url = f"{YAHOO_QUERY_BASE}/v8/finance/chart/{formatted_symbol}"
         
-        with urllib.request.urlopen(req, timeout=10) as response:
-            data = json.loads(response.read().decode())
+        data = http_client.get_json(url)
         
         if not data.get('chart') or not data['chart'].get('result'):
             return {'error': '無法獲取股價數據'}
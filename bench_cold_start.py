@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Vercel Functions 冷啟動基準測試
+每次以全新的 Python 行程（與空的 /tmp 資料目錄）模擬冷啟動，量測 api/index.py 的
+載入時間與第一個股價請求的延遲，比較有無啟動快照的差異
+
+用法：
+    python3 bench_cold_start.py [--runs 5] [--symbols 0700,7203,2330.TW] [--snapshot 路徑]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+# 子行程內執行：載入處理器並發出第一個批次股價請求
+CHILD_SCRIPT = """
+import importlib.util, json, sys, time
+started = time.perf_counter()
+spec = importlib.util.spec_from_file_location('index', 'api/index.py')
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+imported = time.perf_counter()
+handler = module.handler.__new__(module.handler)
+result = handler.get_batch_stock_prices(sys.argv[1])
+finished = time.perf_counter()
+from market_data.snapshot import warm_start
+print(json.dumps({
+    'import_ms': (imported - started) * 1000,
+    'first_request_ms': (finished - imported) * 1000,
+    'snapshot': warm_start(),
+    'errors': result.get('error_count', 0)
+}))
+"""
+
+
+def run_once(symbols, snapshot_path):
+    """以全新行程執行一次，回傳量測結果"""
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(
+            os.environ,
+            SNAPSHOT_PATH=snapshot_path,
+            SYMBOL_INDEX_PATH=os.path.join(tmp, 'symbol_index.sqlite3'),
+            NEGATIVE_CACHE_PATH=os.path.join(tmp, 'negative_cache.sqlite3'),
+            FX_DATA_DIR=os.path.join(tmp, 'fx_series'),
+            PREFETCH_ENABLED='0'
+        )
+        output = subprocess.run(
+            [sys.executable, '-c', CHILD_SCRIPT, symbols],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            env=env, capture_output=True, text=True, check=True
+        ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def summarize(label, results):
+    imports = [r['import_ms'] for r in results]
+    firsts = [r['first_request_ms'] for r in results]
+    print(f"{label:<12} 載入 中位數 {statistics.median(imports):8.1f} ms   "
+          f"第一個請求 中位數 {statistics.median(firsts):8.1f} ms / 最大 {max(firsts):8.1f} ms   "
+          f"錯誤 {results[-1]['errors']}   快照 {results[-1]['snapshot']}")
+
+
+def main():
+    from market_data.snapshot import SNAPSHOT_PATH
+
+    parser = argparse.ArgumentParser(description='冷啟動基準測試')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--symbols', default='0700,0005,7203,9984,2330.TW')
+    parser.add_argument('--snapshot', default=SNAPSHOT_PATH)
+    args = parser.parse_args()
+
+    if not os.path.exists(args.snapshot):
+        print(f"找不到快照 {args.snapshot}，請先執行 python3 -m market_data.snapshot build")
+
+    print(f"股票: {args.symbols}，每種情境執行 {args.runs} 次")
+    with tempfile.TemporaryDirectory() as tmp:
+        missing = os.path.join(tmp, 'snapshot.json')   # 不存在的快照檔
+        summarize('無快照', [run_once(args.symbols, missing) for _ in range(args.runs)])
+    if os.path.exists(args.snapshot):
+        summarize('有快照', [run_once(args.symbols, args.snapshot) for _ in range(args.runs)])
+
+
+if __name__ == '__main__':
+    main()
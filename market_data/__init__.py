@@ -0,0 +1,4 @@
+"""
+市場數據共用模組
+供 api/*.py (Vercel Functions) 與 yahoo_finance_api.py (Flask) 共用的快取與查詢工具
+"""
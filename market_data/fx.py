@@ -0,0 +1,290 @@
+"""
+匯率服務
+保存 USD/HKD/JPY 對台幣的每日匯率序列，存放於本地精簡二進位檔（日期序號 + 匯率），
+單點與區間查詢皆由記憶體以二分搜尋回答；資料不足時才向 Yahoo chart 端點增量補抓
+"""
+
+import bisect
+import logging
+import os
+import struct
+import sys
+import tempfile
+import threading
+import time
+from array import array
+from datetime import date, datetime
+
+from market_data.http_client import YAHOO_QUERY_BASE, http_client
+
+logger = logging.getLogger(__name__)
+
+FX_CURRENCIES = ('USD', 'HKD', 'JPY')
+# 與前端 unifiedPnLCalculator 相同的備用匯率
+FALLBACK_TWD_RATES = {'USD': 28.5, 'HKD': 3.7, 'JPY': 0.2}
+
+FX_DATA_DIR = os.environ.get('FX_DATA_DIR', os.path.join(tempfile.gettempdir(), 'fx_series'))
+FX_REFRESH_INTERVAL = float(os.environ.get('FX_REFRESH_INTERVAL', '21600'))  # 最新資料的更新間隔：6小時
+FX_RETRY_INTERVAL = 300         # 查詢失敗後的重試間隔（秒）
+FX_BACKFILL_DAYS = 365          # 無任何資料時預設補抓的天數
+
+# 檔案格式：標頭（識別碼、筆數）+ int32 日期序號陣列 + float64 匯率陣列（little-endian）
+_MAGIC = b'FXS2'
+_HEADER = struct.Struct('<4sI')
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+# 日K時間為交易所（匯率為倫敦）當地午夜，換算成 UTC 後可能落在前一天（如夏令時間的 23:00 UTC）；
+# 加上12小時再取日期即可對應回交易日，匯率與股價日K共用（適用 UTC-12 至 UTC+12）
+BAR_DAY_SHIFT = 43200
+
+
+def bar_day(ts):
+    """日K時間戳記（UTC 秒）對應的交易日序號"""
+    return (int(ts) + BAR_DAY_SHIFT) // 86400 + _EPOCH_ORDINAL
+
+
+def to_ordinal(value):
+    """日期（date、datetime、'YYYY-MM-DD' 或 ISO 時間字串）轉為日期序號"""
+    if isinstance(value, datetime):
+        return value.date().toordinal()
+    if isinstance(value, date):
+        return value.toordinal()
+    return date.fromisoformat(str(value).strip()[:10]).toordinal()
+
+
+def fx_symbol(currency):
+    return f'{currency}TWD=X'
+
+
+class FXSeries:
+    """單一幣別的每日匯率序列，依日期排序"""
+
+    def __init__(self, currency, days=None, rates=None):
+        self.currency = currency
+        self.days = days if days is not None else array('i')
+        self.rates = rates if rates is not None else array('d')
+
+    @classmethod
+    def load(cls, currency, path):
+        """讀取序列檔，檔案不存在或格式錯誤時回傳空序列"""
+        try:
+            with open(path, 'rb') as f:
+                magic, count = _HEADER.unpack(f.read(_HEADER.size))
+                if magic != _MAGIC:
+                    raise ValueError('檔案格式錯誤')
+                days = array('i')
+                rates = array('d')
+                days.fromfile(f, count)
+                rates.fromfile(f, count)
+        except FileNotFoundError:
+            return cls(currency)
+        except (OSError, EOFError, ValueError, struct.error) as e:
+            logger.warning(f"匯率序列檔無法讀取，將重新建立 ({path}): {e}")
+            return cls(currency)
+
+        if sys.byteorder == 'big':
+            days.byteswap()
+            rates.byteswap()
+        return cls(currency, days, rates)
+
+    def save(self, path):
+        """寫入暫存檔後取代原檔，避免讀到寫一半的檔案"""
+        days = array('i', self.days)
+        rates = array('d', self.rates)
+        if sys.byteorder == 'big':
+            days.byteswap()
+            rates.byteswap()
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(_HEADER.pack(_MAGIC, len(days)))
+            days.tofile(f)
+            rates.tofile(f)
+        os.replace(tmp_path, path)
+
+    def __len__(self):
+        return len(self.days)
+
+    def merge(self, points):
+        """合併 (日期序號, 匯率)，同日期以新資料為準"""
+        merged = dict(zip(self.days, self.rates))
+        merged.update(points)
+        ordered = sorted(merged)
+        self.days = array('i', ordered)
+        self.rates = array('d', (merged[day] for day in ordered))
+
+    def rate_on(self, ordinal):
+        """指定日期的匯率；非交易日取之前最近一日，早於序列起點時回傳 None"""
+        i = bisect.bisect_right(self.days, ordinal) - 1
+        return self.rates[i] if i >= 0 else None
+
+    def between(self, start, end):
+        """區間內的 [(日期序號, 匯率)]（含兩端）"""
+        lo = bisect.bisect_left(self.days, start)
+        hi = bisect.bisect_right(self.days, end)
+        return list(zip(self.days[lo:hi], self.rates[lo:hi]))
+
+
+def parse_fx_chart(data):
+    """解析 chart 端點的每日收盤匯率，回傳 {日期序號: 匯率}"""
+    result = ((data.get('chart') or {}).get('result') or [None])[0]
+    if not result:
+        return {}
+
+    timestamps = result.get('timestamp') or []
+    closes = (((result.get('indicators') or {}).get('quote') or [{}])[0]).get('close') or []
+    points = {}
+    for ts, close in zip(timestamps, closes):
+        if close:
+            points[bar_day(ts)] = float(close)
+    return points
+
+
+class FXProvider:
+    """
+    匯率查詢服務
+    序列常駐記憶體，最新資料超過更新間隔、或查詢日期早於已保存的起點時才向上游補抓
+    """
+
+    def __init__(self, data_dir=FX_DATA_DIR, fetch_json=None):
+        self.data_dir = data_dir
+        self._fetch_json = fetch_json or http_client.get_json
+        self._series = {}
+        self._checked = {}       # 幣別 -> 最後一次查詢上游的時間
+        self._backfilled = {}    # 幣別 -> 已向上游要求過的最早日期
+        self._retry_after = {}   # 幣別 -> 查詢失敗後可再次查詢的時間
+        self._fetch_locks = {}   # 幣別 -> 下載鎖（同一幣別同時只有一個下載）
+        self._lock = threading.Lock()
+        try:
+            os.makedirs(data_dir, exist_ok=True)
+        except OSError as e:
+            logger.warning(f"無法建立匯率資料目錄 ({data_dir}): {e}")
+
+    def _path(self, currency):
+        return os.path.join(self.data_dir, f'{currency}TWD.bin')
+
+    def _series_for(self, currency):
+        series = self._series.get(currency)
+        if series is None:
+            series = self._series[currency] = FXSeries.load(currency, self._path(currency))
+        return series
+
+    def _fetch(self, currency, start, end):
+        period1 = (start - _EPOCH_ORDINAL) * 86400
+        period2 = (end + 1 - _EPOCH_ORDINAL) * 86400
+        data = self._fetch_json(
+            f"{YAHOO_QUERY_BASE}/v8/finance/chart/{fx_symbol(currency)}",
+            params={'period1': period1, 'period2': period2, 'interval': '1d'}
+        )
+        return parse_fx_chart(data)
+
+    def _missing_ranges(self, currency, series, start):
+        """
+        需要向上游補抓的區段，回傳 (回補區段, 更新區段)，各為 (起點, 終點)（日期序號，含兩端）或 None；
+        需持有 self._lock
+        """
+        today = date.today().toordinal()
+        now = time.monotonic()
+        if now < self._retry_after.get(currency, 0):
+            return None, None
+
+        backfill = start is not None and (not len(series) or start < series.days[0]) \
+            and start < self._backfilled.get(currency, today + 1)
+        stale = now - self._checked.get(currency, -FX_REFRESH_INTERVAL) >= FX_REFRESH_INTERVAL
+        if not len(series):
+            # 沒有任何資料：回補區段直接涵蓋至今
+            return ((start, today), None) if backfill else (None, (today - FX_BACKFILL_DAYS, today))
+        head = (start, series.days[0] - 1) if backfill else None
+        tail = (series.days[-1], today) if stale and series.days[-1] < today else None
+        return head, tail
+
+    def ensure(self, currency, start=None):
+        """
+        確保序列涵蓋 start（日期序號）至今
+        只補抓缺少的區段：早於起點的歷史、或最新一日之後的資料；
+        下載時只持有該幣別的下載鎖，不影響其他幣別與不需補抓的查詢
+        """
+        if currency not in FX_CURRENCIES:
+            raise ValueError(f'不支援的幣別: {currency}')
+
+        with self._lock:
+            series = self._series_for(currency)
+            if self._missing_ranges(currency, series, start) == (None, None):
+                return series
+            fetch_lock = self._fetch_locks.setdefault(currency, threading.Lock())
+
+        with fetch_lock:
+            # 等待期間其他執行緒可能已補抓完成，重新檢查
+            with self._lock:
+                head, tail = self._missing_ranges(currency, series, start)
+            if head is None and tail is None:
+                return series
+
+            now = time.monotonic()
+            try:
+                points = {}
+                for fetch_start, fetch_end in (r for r in (head, tail) if r is not None):
+                    points.update(self._fetch(currency, fetch_start, fetch_end))
+            except Exception as e:
+                # 稍後再試，期間以已保存的資料回答
+                with self._lock:
+                    self._retry_after[currency] = now + FX_RETRY_INTERVAL
+                logger.warning(f"匯率查詢失敗 ({currency}): {e}")
+                return series
+
+            with self._lock:
+                if tail is not None or not len(series):
+                    self._checked[currency] = now
+                if head is not None:
+                    self._backfilled[currency] = start
+                if points:
+                    series.merge(points)
+            if points:
+                try:
+                    series.save(self._path(currency))
+                except OSError as e:
+                    logger.warning(f"匯率序列檔寫入失敗 ({currency}): {e}")
+            return series
+
+    def rate(self, currency, on=None):
+        """
+        幣別對台幣的匯率；on 為日期，省略時取最新一日
+        查無資料時回傳 None
+        """
+        if currency == 'TWD':
+            return 1.0
+        ordinal = to_ordinal(on) if on is not None else None
+        series = self.ensure(currency, ordinal)
+        if not len(series):
+            return None
+        return series.rate_on(ordinal) if ordinal is not None else series.rates[-1]
+
+    def rates(self, on=None):
+        """所有支援幣別的匯率 {USD_TWD, HKD_TWD, JPY_TWD}，查無資料時為 None"""
+        return {f'{currency}_TWD': self.rate(currency, on) for currency in FX_CURRENCIES}
+
+    def rates_on(self, currency, dates):
+        """
+        多個日期的匯率（例如每筆交易的交易日），上游最多補抓一次
+        回傳與 dates 順序相同的清單
+        """
+        if currency == 'TWD':
+            return [1.0] * len(dates)
+        ordinals = [to_ordinal(d) for d in dates]
+        if not ordinals:
+            return []
+        series = self.ensure(currency, min(ordinals))
+        return [series.rate_on(ordinal) for ordinal in ordinals]
+
+    def history(self, currency, start, end=None):
+        """區間內的每日匯率 [{'date', 'rate'}]"""
+        start_ordinal = to_ordinal(start)
+        end_ordinal = to_ordinal(end) if end is not None else date.today().toordinal()
+        series = self.ensure(currency, start_ordinal)
+        return [
+            {'date': date.fromordinal(day).isoformat(), 'rate': rate}
+            for day, rate in series.between(start_ordinal, end_ordinal)
+        ]
+
+
+# 全域共用實例
+fx_provider = FXProvider()
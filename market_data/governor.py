@@ -0,0 +1,273 @@
+"""
+上游流量控制
+所有 Yahoo 查詢共用一個令牌桶限制請求速率，遇到 429 時自動降速、成功後逐步回升；
+各端點各自有斷路器，錯誤率過高時暫停呼叫一段時間，重試則使用帶隨機抖動的指數退避
+"""
+
+import logging
+import os
+import random
+import threading
+import time
+import urllib.error
+import urllib.parse
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# 速率限制（每秒請求數，可用環境變數調整）
+UPSTREAM_RATE = float(os.environ.get('UPSTREAM_RATE', '10'))
+UPSTREAM_MIN_RATE = float(os.environ.get('UPSTREAM_MIN_RATE', '1'))
+UPSTREAM_BURST = float(os.environ.get('UPSTREAM_BURST', '20'))
+UPSTREAM_ACQUIRE_TIMEOUT = float(os.environ.get('UPSTREAM_ACQUIRE_TIMEOUT', '10'))  # 等待令牌的秒數上限
+UPSTREAM_MAX_RETRIES = int(os.environ.get('UPSTREAM_MAX_RETRIES', '2'))
+
+# 斷路器設定
+BREAKER_WINDOW = 30             # 統計錯誤率的時間窗（秒）
+BREAKER_MIN_REQUESTS = 10       # 時間窗內至少有這麼多請求才判斷錯誤率
+BREAKER_ERROR_RATE = 0.5        # 錯誤率超過此值即斷路
+BREAKER_COOLDOWN = 30           # 斷路後暫停的秒數，之後放行一個試探請求
+
+# 退避設定
+BACKOFF_BASE = 0.2
+BACKOFF_CAP = 5.0
+
+
+class CircuitOpenError(urllib.error.URLError):
+    """斷路中拒絕呼叫（沿用 URLError，既有的網路錯誤處理不需修改）"""
+
+
+def backoff_delay(attempt, base=BACKOFF_BASE, cap=BACKOFF_CAP):
+    """第 attempt 次重試前的等待秒數（full jitter 指數退避）"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class TokenBucket:
+    """
+    自適應令牌桶
+    throttled() 將速率減半（不低於 min_rate），succeeded() 每次成功小幅回升至 max_rate
+    """
+
+    def __init__(self, rate=UPSTREAM_RATE, burst=UPSTREAM_BURST, min_rate=UPSTREAM_MIN_RATE):
+        self.max_rate = rate
+        self.min_rate = min(min_rate, rate)
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, timeout=UPSTREAM_ACQUIRE_TIMEOUT):
+        """取得一個令牌，逾時回傳 False"""
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait = (1 - self._tokens) / self.rate
+            if now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+    def throttled(self):
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self._tokens = min(self._tokens, 0)
+
+    def succeeded(self):
+        with self._lock:
+            if self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + self.max_rate * 0.05)
+
+
+class CircuitBreaker:
+    """
+    單一端點的斷路器
+    closed：正常放行；open：拒絕呼叫直到冷卻結束；half_open：只放行一個試探請求
+    """
+
+    def __init__(self, name, window=BREAKER_WINDOW, min_requests=BREAKER_MIN_REQUESTS,
+                 error_rate=BREAKER_ERROR_RATE, cooldown=BREAKER_COOLDOWN):
+        self.name = name
+        self.window = window
+        self.min_requests = min_requests
+        self.error_rate = error_rate
+        self.cooldown = cooldown
+        self.state = 'closed'
+        self._opened_at = 0.0
+        self._probing = False
+        self._results = deque()  # (時間, 是否失敗)
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.monotonic() - self._opened_at >= self.cooldown:
+                self.state = 'half_open'
+                self._probing = False
+            if self.state == 'half_open' and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def cancel(self):
+        """已放行的呼叫未實際送出（如等不到令牌），釋放試探名額"""
+        with self._lock:
+            self._probing = False
+
+    def record(self, failed):
+        now = time.monotonic()
+        with self._lock:
+            if self.state == 'half_open':
+                self._probing = False
+                if failed:
+                    self._open(now)
+                else:
+                    self.state = 'closed'
+                    self._results.clear()
+                return
+
+            self._results.append((now, failed))
+            while self._results and now - self._results[0][0] > self.window:
+                self._results.popleft()
+            failures = sum(1 for _, f in self._results if f)
+            if len(self._results) >= self.min_requests and failures / len(self._results) >= self.error_rate:
+                self._open(now)
+
+    def _open(self, now):
+        if self.state != 'open':
+            logger.warning(f"上游端點 {self.name} 錯誤率過高，暫停呼叫 {self.cooldown} 秒")
+        self.state = 'open'
+        self._opened_at = now
+        self._results.clear()
+
+    def status(self):
+        with self._lock:
+            return {'state': self.state, 'requests': len(self._results)}
+
+
+def classify_error(error):
+    """
+    將例外分類：'throttled'（限流）、'unavailable'（上游或網路異常，可重試）、
+    'client'（查無資料等明確結果，不重試也不計入錯誤率）
+    """
+    if isinstance(error, urllib.error.HTTPError):
+        if error.code == 429:
+            return 'throttled'
+        return 'unavailable' if error.code >= 500 else 'client'
+    if isinstance(error, (urllib.error.URLError, OSError, TimeoutError)):
+        return 'unavailable'
+    # yfinance 的限流例外（YFRateLimitError 或訊息含 429）
+    message = str(error)
+    if 'RateLimit' in type(error).__name__ or '429' in message or 'Too Many Requests' in message:
+        return 'throttled'
+    return 'client'
+
+
+def endpoint_of(url):
+    """由 URL 取得斷路器的端點名稱，如 query1.finance.yahoo.com/chart"""
+    parsed = urllib.parse.urlsplit(url)
+    parts = [p for p in parsed.path.split('/') if p]
+    # Yahoo 的路徑格式為 /v8/finance/chart/{symbol}
+    name = parts[2] if len(parts) >= 3 and parts[1] == 'finance' else (parts[0] if parts else '')
+    return f"{parsed.hostname}/{name}"
+
+
+class UpstreamGovernor:
+    """上游呼叫的共用管制：令牌桶 + 各端點斷路器 + 抖動退避重試"""
+
+    def __init__(self, bucket=None, max_retries=UPSTREAM_MAX_RETRIES):
+        self.bucket = bucket or TokenBucket()
+        self.max_retries = max_retries
+        self._breakers = {}
+        self._lock = threading.Lock()
+        self.stats = {'calls': 0, 'retries': 0, 'throttled': 0, 'rejected': 0}
+
+    def breaker(self, endpoint):
+        with self._lock:
+            breaker = self._breakers.get(endpoint)
+            if breaker is None:
+                breaker = self._breakers[endpoint] = CircuitBreaker(endpoint)
+            return breaker
+
+    def call(self, endpoint, fn, retries=None):
+        """
+        經管制呼叫 fn()
+        fn 可回傳帶 status 屬性的回應（429、5xx 視為失敗並重試，重試用盡後回傳最後的回應），
+        或直接拋出例外（依 classify_error 分類）
+        """
+        breaker = self.breaker(endpoint)
+        retries = self.max_retries if retries is None else retries
+        self._count('calls')
+
+        for attempt in range(retries + 1):
+            if not breaker.allow():
+                self._count('rejected')
+                raise CircuitOpenError(f'上游端點暫停呼叫中: {endpoint}')
+            if not self.bucket.acquire():
+                breaker.cancel()
+                self._count('rejected')
+                raise urllib.error.URLError(f'上游請求速率已達上限: {endpoint}')
+
+            retry_after = None
+            try:
+                result = fn()
+            except Exception as e:
+                kind = classify_error(e)
+                if kind == 'client':
+                    breaker.record(False)
+                    raise
+                self._record_failure(breaker, kind)
+                if attempt >= retries:
+                    raise
+                retry_after = self._retry_after(getattr(e, 'headers', None))
+            else:
+                status = getattr(result, 'status', 200)
+                if status != 429 and status < 500:
+                    breaker.record(False)
+                    self.bucket.succeeded()
+                    return result
+                self._record_failure(breaker, 'throttled' if status == 429 else 'unavailable')
+                if attempt >= retries:
+                    return result
+                retry_after = self._retry_after(getattr(result, 'headers', None))
+
+            self._count('retries')
+            delay = backoff_delay(attempt)
+            time.sleep(max(delay, min(retry_after or 0, BACKOFF_CAP)))
+
+    def _count(self, name):
+        """統計計數（多個 worker 執行緒同時呼叫，需持有鎖）"""
+        with self._lock:
+            self.stats[name] += 1
+
+    def _record_failure(self, breaker, kind):
+        breaker.record(True)
+        if kind == 'throttled':
+            self._count('throttled')
+            self.bucket.throttled()
+
+    @staticmethod
+    def _retry_after(headers):
+        try:
+            return float(headers.get('Retry-After')) if headers is not None else None
+        except (TypeError, ValueError):
+            return None
+
+    def status(self):
+        with self._lock:
+            breakers = {name: b.status() for name, b in self._breakers.items()}
+            stats = dict(self.stats)
+        return dict(stats, rate=round(self.bucket.rate, 2), breakers=breakers)
+
+
+# 全域共用實例
+governor = UpstreamGovernor()
@@ -0,0 +1,201 @@
+"""
+共用 HTTP 客戶端
+以連線池重複使用 keep-alive 連線，批次更新時不必每筆報價都重新建立 TLS 連線；
+所有請求經上游流量控制（限速、斷路器、退避重試）；
+錯誤會轉換成 urllib.error 的例外，既有的錯誤處理不需修改
+"""
+
+import http.client
+import io
+import json
+import logging
+import os
+import ssl
+import threading
+import urllib.error
+import urllib.parse
+
+from market_data.governor import endpoint_of, governor as default_governor
+
+logger = logging.getLogger(__name__)
+
+# Yahoo Finance 端點（測試時可指向本地模擬伺服器，如 http://127.0.0.1:8000）
+YAHOO_QUERY_BASE = os.environ.get('YAHOO_QUERY_BASE', 'https://query1.finance.yahoo.com').rstrip('/')
+
+# 連線設定（可用環境變數調整）
+MAX_CONNECTIONS_PER_HOST = int(os.environ.get('HTTP_MAX_CONNECTIONS_PER_HOST', '8'))
+POOL_ACQUIRE_TIMEOUT = float(os.environ.get('HTTP_POOL_ACQUIRE_TIMEOUT', '10'))  # 等待可用連線的秒數
+REQUEST_TIMEOUT = float(os.environ.get('HTTP_REQUEST_TIMEOUT', '10'))
+ENABLE_HTTP2 = os.environ.get('HTTP_ENABLE_HTTP2', '') == '1'  # 需安裝 httpx[http2]
+
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
+    'Accept': 'application/json',
+    'Connection': 'keep-alive'
+}
+
+
+class HTTPResponse:
+    """簡化的回應物件"""
+
+    def __init__(self, url, status, reason, headers, body):
+        self.url = url
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+
+    def json(self):
+        return json.loads(self.body.decode())
+
+
+class _HostPool:
+    """單一主機的連線池，以 semaphore 限制同時連線數"""
+
+    def __init__(self, scheme, host, port, max_connections, timeout):
+        self.scheme = scheme
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_connections)
+        self._idle = []
+        self._lock = threading.Lock()
+        self._ssl_context = ssl.create_default_context() if scheme == 'https' else None
+
+    def _new_connection(self):
+        if self.scheme == 'https':
+            return http.client.HTTPSConnection(
+                self.host, self.port, timeout=self.timeout, context=self._ssl_context
+            )
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def acquire(self):
+        if not self._slots.acquire(timeout=POOL_ACQUIRE_TIMEOUT):
+            raise urllib.error.URLError(f'連線池已滿: {self.host}')
+        with self._lock:
+            if self._idle:
+                return self._idle.pop(), True
+        return self._new_connection(), False
+
+    def release(self, conn, reusable):
+        if reusable:
+            with self._lock:
+                self._idle.append(conn)
+        else:
+            conn.close()
+        self._slots.release()
+
+    def close(self):
+        with self._lock:
+            for conn in self._idle:
+                conn.close()
+            self._idle.clear()
+
+
+class HTTPClient:
+    """
+    連線池 HTTP 客戶端（僅 GET）
+    每個主機最多 max_per_host 條連線，閒置連線會被下一個請求重複使用
+    """
+
+    def __init__(self, max_per_host=MAX_CONNECTIONS_PER_HOST, timeout=REQUEST_TIMEOUT, http2=ENABLE_HTTP2,
+                 governor=default_governor):
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+        self.governor = governor
+        self._pools = {}
+        self._lock = threading.Lock()
+        self._http2_client = None
+        if http2:
+            try:
+                import httpx
+                self._http2_client = httpx.Client(
+                    http2=True,
+                    timeout=timeout,
+                    limits=httpx.Limits(max_keepalive_connections=max_per_host)
+                )
+            except ImportError:
+                logger.warning("未安裝 httpx[http2]，改用 HTTP/1.1 連線池")
+
+    def _pool_for(self, parsed):
+        scheme = parsed.scheme or 'https'
+        port = parsed.port or (443 if scheme == 'https' else 80)
+        key = (scheme, parsed.hostname, port)
+        with self._lock:
+            pool = self._pools.get(key)
+            if pool is None:
+                pool = _HostPool(scheme, parsed.hostname, port, self.max_per_host, self.timeout)
+                self._pools[key] = pool
+            return pool
+
+    def get(self, url, params=None, headers=None):
+        """
+        發送 GET 請求並回傳 HTTPResponse（不檢查狀態碼）
+        網路錯誤拋出 urllib.error.URLError；429 與 5xx 由流量控制退避重試後回傳最後的回應
+        """
+        if params:
+            url = f"{url}{'&' if '?' in url else '?'}{urllib.parse.urlencode(params)}"
+        request_headers = dict(DEFAULT_HEADERS)
+        if headers:
+            request_headers.update(headers)
+
+        if self.governor is None:
+            return self._send(url, request_headers)
+        return self.governor.call(endpoint_of(url), lambda: self._send(url, request_headers))
+
+    def _send(self, url, request_headers):
+        if self._http2_client is not None:
+            return self._get_http2(url, request_headers)
+
+        parsed = urllib.parse.urlsplit(url)
+        path = parsed.path or '/'
+        if parsed.query:
+            path = f"{path}?{parsed.query}"
+        pool = self._pool_for(parsed)
+
+        # 重複使用的連線可能已被伺服器關閉，此時以新連線重試一次（GET 可安全重送）
+        for attempt in range(2):
+            conn, reused = pool.acquire()
+            try:
+                conn.request('GET', path, headers=request_headers)
+                response = conn.getresponse()
+                body = response.read()
+            except (http.client.HTTPException, OSError) as e:
+                pool.release(conn, False)
+                if reused and attempt == 0:
+                    continue
+                raise urllib.error.URLError(e)
+            pool.release(conn, not response.will_close)
+            return HTTPResponse(url, response.status, response.reason, response.headers, body)
+
+    def _get_http2(self, url, headers):
+        import httpx
+        try:
+            response = self._http2_client.get(url, headers=headers)
+        except httpx.HTTPError as e:
+            raise urllib.error.URLError(e)
+        return HTTPResponse(url, response.status_code, response.reason_phrase, response.headers, response.content)
+
+    def get_json(self, url, params=None, headers=None):
+        """
+        發送 GET 請求並解析 JSON
+        非 2xx 回應拋出 urllib.error.HTTPError
+        """
+        response = self.get(url, params=params, headers=headers)
+        if not 200 <= response.status < 300:
+            raise urllib.error.HTTPError(
+                response.url, response.status, response.reason, response.headers, io.BytesIO(response.body)
+            )
+        return response.json()
+
+    def close(self):
+        with self._lock:
+            for pool in self._pools.values():
+                pool.close()
+            self._pools.clear()
+        if self._http2_client is not None:
+            self._http2_client.close()
+
+
+# 全域共用實例
+http_client = HTTPClient()
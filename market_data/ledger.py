@@ -0,0 +1,215 @@
+"""
+增量持股帳本
+每個股票各自保存 FIFO 批次與彙總值，新增交易只更新該股票，
+成本為 O(該股票的批次數)，與整體交易歷史長度無關；
+修改或刪除舊交易時只重算受影響的股票
+"""
+
+import bisect
+import threading
+from collections import deque
+
+from market_data.portfolio import build_holding, calculate_all_holdings
+
+# 驗證模式的容許誤差（金額四捨五入到小數第2位）
+VERIFY_TOLERANCE = 0.011
+
+
+def _order_key(transaction):
+    return transaction.get('timestamp') or transaction.get('date') or ''
+
+
+class SymbolLots:
+    """單一股票的 FIFO 批次與彙總"""
+
+    def __init__(self, symbol):
+        self.symbol = symbol
+        self.market = None
+        self.currency = None
+        self.transactions = []   # 依時間排序
+        self._keys = []          # 與 transactions 對應的排序鍵
+        self.reset()
+
+    def reset(self):
+        self.lots = deque()      # [剩餘股數, 價格, 交易ID, 日期]
+        self.quantity = 0.0
+        self.cost = 0.0
+        self.realized_cost = 0.0
+        self.realized_proceeds = 0.0
+
+    def _apply(self, transaction, strict):
+        quantity = float(transaction.get('quantity') or 0)
+        price = float(transaction.get('price') or 0)
+
+        if transaction.get('type') == 'BUY':
+            if quantity > 0:
+                self.lots.append([quantity, price, transaction.get('id'), transaction.get('date')])
+                self.quantity += quantity
+                self.cost += quantity * price
+            return
+
+        if strict and quantity > self.quantity:
+            raise ValueError(f'賣出數量 ({quantity:g}) 超過持有數量 ({self.quantity:g})')
+
+        # 依 FIFO 消耗最早的批次（超賣部分忽略，與全量計算一致）
+        remaining = min(quantity, self.quantity)
+        while remaining > 0 and self.lots:
+            lot = self.lots[0]
+            matched = min(remaining, lot[0])
+            self.realized_cost += matched * lot[1]
+            self.realized_proceeds += matched * price
+            self.quantity -= matched
+            self.cost -= matched * lot[1]
+            lot[0] -= matched
+            remaining -= matched
+            if lot[0] <= 0:
+                self.lots.popleft()
+
+    def add(self, transaction, strict=True):
+        """
+        新增交易；晚於現有交易時增量套用，否則插入後重算此股票
+        strict=True 時拒絕超過持有數量的賣出
+        """
+        key = _order_key(transaction)
+        if not self._keys or key >= self._keys[-1]:
+            self._apply(transaction, strict)
+            self.transactions.append(transaction)
+            self._keys.append(key)
+        else:
+            index = bisect.bisect_right(self._keys, key)
+            self.transactions.insert(index, transaction)
+            self._keys.insert(index, key)
+            self.rebuild()
+        # 通過驗證後才記錄市場與幣別，被拒絕的交易不影響此股票
+        self.market = self.market or transaction.get('market')
+        self.currency = self.currency or transaction.get('currency')
+
+    def remove(self, transaction_id):
+        """移除交易並重算此股票，回傳被移除的交易"""
+        for i, transaction in enumerate(self.transactions):
+            if transaction.get('id') == transaction_id:
+                del self.transactions[i]
+                del self._keys[i]
+                self.rebuild()
+                return transaction
+        return None
+
+    def rebuild(self):
+        """依序重放此股票的所有交易"""
+        self.reset()
+        for transaction in self.transactions:
+            self._apply(transaction, strict=False)
+
+    def holding(self, current_price=None):
+        lots = [
+            {'transactionId': lot[2], 'quantity': lot[0], 'price': lot[1], 'date': lot[3]}
+            for lot in self.lots
+        ]
+        return build_holding(
+            self.symbol, self.market, self.currency, self.quantity, self.cost, lots,
+            self.realized_cost, self.realized_proceeds, current_price
+        )
+
+
+class PortfolioLedger:
+    """
+    增量持股帳本
+    接受交易事件：buy、sell、edit、delete，只更新受影響股票的批次與彙總
+    """
+
+    def __init__(self, transactions=None):
+        self._symbols = {}
+        self._symbol_of = {}     # 交易ID -> 股票
+        self._lock = threading.Lock()
+        # 匯入既有歷史時不檢查超賣，與全量計算的處理方式一致
+        for transaction in sorted(transactions or [], key=_order_key):
+            self._add(transaction, strict=False)
+
+    def _add(self, transaction, strict=True):
+        transaction = dict(transaction, symbol=str(transaction.get('symbol', '')).upper())
+        if transaction.get('id') in self._symbol_of:
+            raise ValueError(f"交易ID重複: {transaction.get('id')}")
+        # 新股票的批次在交易通過驗證後才加入帳本，被拒絕的賣出不留下空紀錄
+        lots = self._symbols.get(transaction['symbol']) or SymbolLots(transaction['symbol'])
+        lots.add(transaction, strict)
+        self._symbols.setdefault(transaction['symbol'], lots)
+        self._symbol_of[transaction.get('id')] = transaction['symbol']
+        return transaction['symbol']
+
+    def _remove(self, transaction_id):
+        """移除交易，回傳 (股票, 被移除的交易)"""
+        symbol = self._symbol_of.pop(transaction_id, None)
+        if symbol is None:
+            raise ValueError(f'找不到交易: {transaction_id}')
+        lots = self._symbols[symbol]
+        removed = lots.remove(transaction_id)
+        if not lots.transactions:
+            # 沒有任何交易的股票不保留，避免出現在 include_closed 的結果
+            del self._symbols[symbol]
+        return symbol, removed
+
+    def apply(self, event):
+        """
+        套用單一事件，回傳受影響的股票清單
+        event: {'action': 'buy'|'sell'|'edit'|'delete', 'transaction': {...}} 或 delete 時 {'action': 'delete', 'id': ...}
+        """
+        action = event.get('action')
+        transaction = event.get('transaction') or {}
+
+        with self._lock:
+            if action in ('buy', 'sell'):
+                return [self._add(dict(transaction, type=action.upper()))]
+
+            if action == 'edit':
+                old_symbol, old_transaction = self._remove(transaction.get('id'))
+                try:
+                    new_symbol = self._add(transaction)
+                except ValueError:
+                    # 修改無效時還原原交易
+                    self._add(old_transaction, strict=False)
+                    raise
+                return sorted({old_symbol, new_symbol})
+
+            if action == 'delete':
+                symbol, _ = self._remove(event.get('id', transaction.get('id')))
+                return [symbol]
+
+        raise ValueError(f'無效的事件類型: {action}')
+
+    def transactions(self):
+        with self._lock:
+            return [t for lots in self._symbols.values() for t in lots.transactions]
+
+    def holdings(self, symbols=None, prices=None, include_closed=False):
+        """取得持股資訊；symbols 指定時只回傳這些股票"""
+        prices = {str(k).upper(): v for k, v in (prices or {}).items()}
+        with self._lock:
+            targets = symbols if symbols is not None else list(self._symbols)
+            result = {}
+            for symbol in targets:
+                lots = self._symbols.get(symbol)
+                if lots is None or (lots.quantity <= 0 and not include_closed):
+                    continue
+                result[symbol] = lots.holding(prices.get(symbol))
+            return result
+
+    def verify(self):
+        """
+        驗證模式：與全量重算比對
+        回傳不一致的欄位清單，空清單代表增量結果正確
+        """
+        incremental = self.holdings(include_closed=True)
+        full = calculate_all_holdings(self.transactions(), include_closed=True)
+        mismatches = []
+        for symbol in sorted(set(incremental) | set(full)):
+            a = incremental.get(symbol, {})
+            b = full.get(symbol, {})
+            for field in ('totalQuantity', 'totalCost', 'realizedPnL'):
+                if abs(a.get(field, 0) - b.get(field, 0)) > VERIFY_TOLERANCE:
+                    mismatches.append({
+                        'symbol': symbol,
+                        'field': field,
+                        'incremental': a.get(field),
+                        'full': b.get(field)
+                    })
+        return mismatches
@@ -0,0 +1,171 @@
+"""
+投資組合每日淨值
+以交易記錄、本地日K收盤價與匯率序列計算每日市值、成本與損益（台幣），
+持股與成本以 (股票 × 日期) 矩陣累加（cumsum）一次算出，不逐日重算持股
+"""
+
+from datetime import date
+
+import numpy as np
+
+from market_data.fx import BAR_DAY_SHIFT, FALLBACK_TWD_RATES, FX_CURRENCIES, fx_provider, to_ordinal
+from market_data.ohlcv import ohlcv_store
+from market_data.portfolio import TransactionTable, compute_fifo
+from market_data.valuation import MARKET_CURRENCIES, MARKETS, to_yahoo_symbol
+
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+def bar_ordinals(bars):
+    """日K的日期序號（與匯率序列相同的換算，見 fx.bar_day）"""
+    return (np.asarray(bars['ts'], dtype=np.int64) + BAR_DAY_SHIFT) // 86400 + _EPOCH_ORDINAL
+
+
+def forward_fill(source_days, source_values, target_days):
+    """將序列依日期對齊到 target_days，非交易日沿用之前最近一日，早於起點時為 NaN"""
+    if not len(source_days):
+        return np.full(len(target_days), np.nan)
+    index = np.searchsorted(source_days, target_days, side='right') - 1
+    values = np.asarray(source_values, dtype=np.float64)[np.maximum(index, 0)]
+    return np.where(index >= 0, values, np.nan)
+
+
+def fx_matrix(currencies, days, provider):
+    """
+    各幣別在每一天的台幣匯率，回傳 {幣別: 匯率陣列}
+    早於匯率序列起點的日期以序列第一筆回補，完全無資料時使用備用匯率
+    """
+    rates = {'TWD': np.ones(len(days))}
+    for currency in set(currencies):
+        if currency in rates:
+            continue
+        if currency not in FX_CURRENCIES:
+            # 不支援的幣別以原始金額計算（與前端一致）
+            rates[currency] = np.ones(len(days))
+            continue
+        series = provider.ensure(currency, int(days[0]))
+        if not len(series):
+            rates[currency] = np.full(len(days), FALLBACK_TWD_RATES[currency])
+            continue
+        filled = forward_fill(np.asarray(series.days), np.asarray(series.rates), days)
+        rates[currency] = np.where(np.isnan(filled), series.rates[0], filled)
+    return rates
+
+
+def compute_daily_nav(transactions, start=None, end=None, store=None, provider=None,
+                      weekdays_only=True, refresh=False):
+    """
+    計算每日淨值序列
+    回傳每日的市值、成本、未實現與已實現損益（台幣），整體與各市場分開；
+    成本與市值以當日匯率換算，已實現損益以各筆賣出交易日的匯率換算後累加
+    收盤價只讀本地K線，缺少或過期的股票交由背景補齊（列於 refreshing）；
+    refresh=True 時先以一次並行下載補齊所有股票再計算
+    """
+    store = store or ohlcv_store
+    provider = provider or fx_provider
+    if not transactions:
+        return {'dates': [], 'totals': {}, 'byMarket': {}, 'refreshing': [], 'symbols': []}
+
+    table = TransactionTable.from_records(transactions)
+    fifo = compute_fifo(table)
+    trade_days = np.array([to_ordinal(d) for d in table.dates], dtype=np.int64)
+
+    first_day = int(trade_days.min())
+    start_day = to_ordinal(start) if start else first_day
+    end_day = to_ordinal(end) if end else date.today().toordinal()
+    if end_day < start_day:
+        raise ValueError('結束日期早於開始日期')
+
+    # 由第一筆交易起算，累加後再裁切到查詢區間
+    axis_start = min(first_day, start_day)
+    days = np.arange(axis_start, end_day + 1, dtype=np.int64)
+    n_symbols, n_days = len(table.symbols), len(days)
+
+    # 交易當日的持股、成本、已實現損益變化量，分散到 (股票 × 日期) 矩陣後沿日期累加
+    buy_qty = np.where(table.is_buy, table.quantities, 0.0)
+    delta_qty = buy_qty - fifo['sold_qty']
+    delta_cost = buy_qty * table.prices - fifo['sold_cost']
+    delta_realized = fifo['sold_proceeds'] - fifo['sold_cost']
+
+    currencies = [
+        table.currencies[code] or MARKET_CURRENCIES.get(table.markets[code], 'TWD')
+        for code in range(n_symbols)
+    ]
+    fx = fx_matrix(currencies, days, provider)
+    symbol_fx = np.vstack([fx[c] for c in currencies])                  # (股票 × 日期)
+
+    # 晚於結束日期的交易不計入；已實現損益以交易日匯率換算
+    in_range = trade_days <= end_day
+    column = np.clip(trade_days - axis_start, 0, n_days - 1)
+    trade_fx = symbol_fx[table.codes, column]
+    delta_qty, delta_cost, delta_realized = (
+        np.where(in_range, delta, 0.0) for delta in (delta_qty, delta_cost, delta_realized)
+    )
+
+    flat = table.codes * n_days + column
+    quantity = np.bincount(flat, weights=delta_qty, minlength=n_symbols * n_days)
+    cost = np.bincount(flat, weights=delta_cost, minlength=n_symbols * n_days)
+    realized_twd = np.bincount(flat, weights=delta_realized * trade_fx, minlength=n_symbols * n_days)
+    quantity = np.cumsum(quantity.reshape(n_symbols, n_days), axis=1)
+    cost = np.cumsum(cost.reshape(n_symbols, n_days), axis=1)
+    realized_twd = np.cumsum(realized_twd.reshape(n_symbols, n_days), axis=1)
+    # 清除累加的浮點誤差，避免已出清的股票殘留極小持股
+    quantity[np.abs(quantity) < 1e-9] = 0.0
+
+    # 收盤價矩陣：每個股票一次本地區間查詢，對齊日期軸
+    close = np.full((n_symbols, n_days), np.nan)
+    yahoo_symbols = [to_yahoo_symbol(symbol, table.markets[code]) for code, symbol in enumerate(table.symbols)]
+    axis_start_text = date.fromordinal(axis_start).isoformat()
+    if refresh:
+        store.update_many(yahoo_symbols, '1d', axis_start_text)
+        refreshing = []
+    else:
+        refreshing = store.update_in_background(yahoo_symbols, '1d', axis_start_text)
+    for code, yahoo_symbol in enumerate(yahoo_symbols):
+        bars = store.range(yahoo_symbol, '1d', start=axis_start_text, refresh=False)
+        if len(bars):
+            close[code] = forward_fill(bar_ordinals(bars), bars['close'], days)
+
+    # 尚無收盤價的日期以成本計價（與前端無報價時的處理一致）
+    market_value = np.where(np.isnan(close), cost, quantity * close)
+    market_value_twd = market_value * symbol_fx
+    cost_twd = cost * symbol_fx
+
+    # 裁切到查詢區間（可只保留平日）
+    keep = days >= start_day
+    if weekdays_only:
+        keep &= (days % 7 != 0) & (days % 7 != 6)   # 序號 % 7：0 為週日、6 為週六
+    days = days[keep]
+    market_value_twd = market_value_twd[:, keep]
+    cost_twd = cost_twd[:, keep]
+    realized_twd = realized_twd[:, keep]
+
+    def summarize(rows):
+        value = market_value_twd[rows].sum(axis=0)
+        basis = cost_twd[rows].sum(axis=0)
+        realized = realized_twd[rows].sum(axis=0)
+        return {
+            'marketValueTWD': np.round(value, 2).tolist(),
+            'totalCostTWD': np.round(basis, 2).tolist(),
+            'unrealizedPnLTWD': np.round(value - basis, 2).tolist(),
+            'realizedPnLTWD': np.round(realized, 2).tolist()
+        }
+
+    markets = np.asarray(table.markets, dtype=object)
+    by_market = {}
+    for market in MARKETS:
+        rows = np.flatnonzero(markets == market)
+        if len(rows):
+            by_market[market] = summarize(rows)
+
+    return {
+        'dates': [date.fromordinal(int(day)).isoformat() for day in days],
+        'totals': summarize(slice(None)),
+        'byMarket': by_market,
+        'refreshing': refreshing,
+        'symbols': [
+            {'symbol': symbol, 'yahooSymbol': yahoo_symbols[code], 'market': table.markets[code],
+             'currency': currencies[code], 'hasPrices': bool(np.any(~np.isnan(close[code])))}
+            for code, symbol in enumerate(table.symbols)
+        ]
+    }
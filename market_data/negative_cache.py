@@ -0,0 +1,163 @@
+"""
+查無資料的負向快取
+以 Yahoo 代號為鍵記錄上游明確回應查無資料的股票與原因，所有端點共用；
+記錄期間內同一代號直接回傳錯誤，不再向上游嘗試，原因不同有效期也不同
+"""
+
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+NEGATIVE_CACHE_PATH = os.environ.get(
+    'NEGATIVE_CACHE_PATH',
+    os.path.join(tempfile.gettempdir(), 'negative_cache.sqlite3')
+)
+
+# 原因代碼
+NOT_FOUND = 'not_found'            # 上游查無此代號
+DELISTED = 'delisted'              # 代號仍查得到，但已沒有價格與交易
+FORMAT_INVALID = 'format_invalid'  # 代號格式無法對應任何市場
+
+# 各原因的有效期（秒）
+NEGATIVE_TTLS = {
+    NOT_FOUND: float(os.environ.get('NEGATIVE_TTL_NOT_FOUND', str(6 * 3600))),
+    DELISTED: float(os.environ.get('NEGATIVE_TTL_DELISTED', str(7 * 86400))),
+    FORMAT_INVALID: float(os.environ.get('NEGATIVE_TTL_FORMAT_INVALID', str(30 * 86400)))
+}
+
+ERROR_MESSAGES = {
+    NOT_FOUND: '找不到該股票代號',
+    DELISTED: '該股票可能已下市',
+    FORMAT_INVALID: '無效的股票代號格式'
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS negative_results (
+    symbol TEXT PRIMARY KEY,
+    reason TEXT NOT NULL,
+    recorded_at REAL NOT NULL
+)
+"""
+
+
+def _normalize(symbol):
+    return str(symbol).strip().upper()
+
+
+def is_missing_text(text):
+    """
+    上游錯誤訊息是否表示查無資料
+    Yahoo 對未知代號與下市股票的 404 說明都是 No data found, symbol may be delisted，
+    無法分辨，一律視為 NOT_FOUND；是否下市改由 listing_reason() 依查得的資料判斷
+    """
+    text = str(text).lower()
+    return any(marker in text for marker in ('no data found', 'delisted', 'not found'))
+
+
+def listing_reason(listing):
+    """
+    由上游查得的證券資料（chart meta、quote 或 quoteType 結果）判斷原因
+    沒有資料為 NOT_FOUND；代號仍查得到但沒有價格也沒有交易時間才是 DELISTED；仍在交易時回傳 None
+    """
+    if not listing:
+        return NOT_FOUND
+    if listing.get('regularMarketPrice') is None and not listing.get('regularMarketTime'):
+        return DELISTED
+    return None
+
+
+def negative_result(symbol, entry):
+    """負向快取命中時回傳給前端的錯誤結果"""
+    return {
+        'error': ERROR_MESSAGES.get(entry['reason'], ERROR_MESSAGES[NOT_FOUND]),
+        'reason': entry['reason'],
+        'symbol': symbol,
+        'negativeCache': True
+    }
+
+
+class NegativeCache:
+    """
+    持久化的負向快取（SQLite，重啟後仍然有效）
+    只記錄上游明確的查無資料回應；網路錯誤與限流不應寫入
+    """
+
+    def __init__(self, path=NEGATIVE_CACHE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.records = 0
+        try:
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute(_SCHEMA)
+        except sqlite3.Error:
+            # 檔案無法寫入時退回記憶體模式，至少在本次執行期間有效
+            self.path = ':memory:'
+            self._conn = sqlite3.connect(':memory:', check_same_thread=False)
+            self._conn.execute(_SCHEMA)
+        self._conn.commit()
+
+    def get(self, symbol):
+        """查詢負向紀錄，回傳 {'reason', 'age'}，無紀錄或已過期時回傳 None"""
+        return self.get_many([symbol]).get(_normalize(symbol))
+
+    def get_many(self, symbols):
+        """批次查詢，回傳 {標準化代號: {'reason', 'age'}}，只列出有效的紀錄"""
+        keys = list(dict.fromkeys(_normalize(s) for s in symbols))
+        if not keys:
+            return {}
+        placeholders = ','.join('?' * len(keys))
+        with self._lock:
+            rows = self._conn.execute(
+                f'SELECT symbol, reason, recorded_at FROM negative_results WHERE symbol IN ({placeholders})',
+                keys
+            ).fetchall()
+
+        now = time.time()
+        entries = {}
+        expired = []
+        for symbol, reason, recorded_at in rows:
+            age = now - recorded_at
+            if age > NEGATIVE_TTLS.get(reason, NEGATIVE_TTLS[NOT_FOUND]):
+                expired.append(symbol)
+            else:
+                entries[symbol] = {'reason': reason, 'age': round(age)}
+        if expired:
+            self._execute_many('DELETE FROM negative_results WHERE symbol = ?', [(s,) for s in expired])
+        self.hits += len(entries)
+        return entries
+
+    def record(self, symbol, reason=NOT_FOUND):
+        """記錄確認查無資料的代號"""
+        self.records += 1
+        logger.info(f"負向快取: {_normalize(symbol)} ({reason})")
+        self._execute_many(
+            'INSERT OR REPLACE INTO negative_results VALUES (?, ?, ?)',
+            [(_normalize(symbol), reason, time.time())]
+        )
+
+    def forget(self, symbol):
+        self._execute_many('DELETE FROM negative_results WHERE symbol = ?', [(_normalize(symbol),)])
+
+    def _execute_many(self, sql, params):
+        try:
+            with self._lock:
+                self._conn.executemany(sql, params)
+                self._conn.commit()
+        except sqlite3.Error:
+            # 負向快取只是加速用途，寫入失敗不影響查詢結果
+            pass
+
+    def stats(self):
+        with self._lock:
+            size = self._conn.execute('SELECT COUNT(*) FROM negative_results').fetchone()[0]
+        return {'size': size, 'hits': self.hits, 'records': self.records}
+
+
+# 全域共用實例
+negative_cache = NegativeCache()
@@ -0,0 +1,296 @@
+"""
+OHLCV 歷史資料庫
+每個 (股票, K線週期) 存成一個 NumPy 結構化陣列檔（.npy），以 memmap 唯讀開啟，
+區間查詢以 searchsorted 定位後直接切片，不複製資料；
+更新時只向 yfinance 下載最後一根K線之後的缺口
+"""
+
+import logging
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timezone
+
+import numpy as np
+
+from market_data.fx import BAR_DAY_SHIFT
+from market_data.governor import governor
+
+logger = logging.getLogger(__name__)
+
+OHLCV_DATA_DIR = os.environ.get('OHLCV_DATA_DIR', os.path.join(tempfile.gettempdir(), 'ohlcv'))
+OHLCV_RETRY_INTERVAL = 300       # 下載失敗後的重試間隔（秒）
+OHLCV_DEFAULT_LOOKBACK = 365     # 無任何資料時預設下載的天數
+OHLCV_UPDATE_WORKERS = int(os.environ.get('OHLCV_UPDATE_WORKERS', '8'))  # 批次補齊的並行下載數
+
+# 各週期的更新間隔（秒）：最新一根K線超過此時間才重新下載
+REFRESH_INTERVALS = {
+    '1m': 60, '5m': 300, '15m': 900, '30m': 1800, '1h': 3600,
+    '1d': 3600, '1wk': 6 * 3600, '1mo': 24 * 3600
+}
+
+# 日K以上的週期：K線時間為交易所當地午夜，查詢日期以交易日對應（見 fx.bar_day）
+DAILY_INTERVALS = ('1d', '1wk', '1mo')
+
+BAR_DTYPE = np.dtype([
+    ('ts', '<i8'),        # K線開始時間（UTC 秒）
+    ('open', '<f8'),
+    ('high', '<f8'),
+    ('low', '<f8'),
+    ('close', '<f8'),
+    ('volume', '<f8')
+])
+
+
+def to_timestamp(value):
+    """日期（date、datetime、'YYYY-MM-DD'、ISO 時間字串或 UTC 秒）轉為 UTC 秒"""
+    if value is None:
+        return None
+    if isinstance(value, (int, float, np.integer)):
+        return int(value)
+    if isinstance(value, datetime):
+        dt = value
+    elif isinstance(value, date):
+        dt = datetime(value.year, value.month, value.day)
+    else:
+        dt = datetime.fromisoformat(str(value).strip())
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp())
+
+
+def bar_bounds(start, end, interval):
+    """
+    查詢區間轉為 K線時間的 [起點, 終點]（UTC 秒，None 表示不限）
+    日K以上的週期以日期為單位：起點日與結束日的K線不論交易所時區都包含在內
+    （台股當日K線為前一天 16:00 UTC，美股為當日 05:00 UTC）
+    """
+    start_ts = to_timestamp(start)
+    end_ts = to_timestamp(end)
+    if interval in DAILY_INTERVALS:
+        if start_ts is not None:
+            start_ts = start_ts // 86400 * 86400 - BAR_DAY_SHIFT
+        if end_ts is not None:
+            end_ts = (end_ts // 86400 + 1) * 86400 - BAR_DAY_SHIFT - 1
+    return start_ts, end_ts
+
+
+def frame_to_bars(frame):
+    """yfinance history() 的 DataFrame 轉為 BAR_DTYPE 陣列"""
+    bars = np.empty(len(frame), dtype=BAR_DTYPE)
+    if not len(frame):
+        return bars
+    # 有時區的 DatetimeIndex 以 UTC 奈秒儲存
+    bars['ts'] = np.asarray(frame.index.asi8, dtype=np.int64) // 1_000_000_000
+    for field, column in (('open', 'Open'), ('high', 'High'), ('low', 'Low'), ('close', 'Close'), ('volume', 'Volume')):
+        bars[field] = frame[column].to_numpy(dtype=np.float64)
+    return bars[~np.isnan(bars['close'])]
+
+
+def fetch_yfinance_history(symbol, interval, start, end=None):
+    """以 yfinance 下載 [start, end) 的K線（start/end 為 UTC 秒）"""
+    import yfinance as yf
+
+    kwargs = {'interval': interval, 'start': datetime.fromtimestamp(start, tz=timezone.utc), 'auto_adjust': False}
+    if end is not None:
+        kwargs['end'] = datetime.fromtimestamp(end, tz=timezone.utc)
+    frame = governor.call('yfinance/history', lambda: yf.Ticker(symbol).history(**kwargs))
+    return frame_to_bars(frame)
+
+
+def merge_bars(stored, fresh):
+    """合併K線，相同時間以新下載的資料為準（最後一根可能是未收盤的K線）"""
+    if not len(stored):
+        return np.sort(fresh, order='ts')
+    combined = np.concatenate((fresh, stored))
+    _, first = np.unique(combined['ts'], return_index=True)
+    return combined[first]
+
+
+class OHLCVStore:
+    """
+    本地 OHLCV 資料庫
+    range() 回傳 memmap 上的切片；檔案更新以暫存檔取代，已回傳的切片仍指向舊檔內容
+    """
+
+    def __init__(self, data_dir=OHLCV_DATA_DIR, fetch_history=None):
+        self.data_dir = data_dir
+        self._fetch_history = fetch_history or fetch_yfinance_history
+        self._arrays = {}
+        self._checked = {}       # (股票, 週期) -> 最後一次下載的時間
+        self._backfilled = {}    # (股票, 週期) -> 已要求過的最早時間
+        self._retry_after = {}
+        self._pending = set()    # 背景補齊中的 (股票, 週期)
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+        try:
+            os.makedirs(data_dir, exist_ok=True)
+        except OSError as e:
+            logger.warning(f"無法建立K線資料目錄 ({data_dir}): {e}")
+
+    def _path(self, symbol, interval):
+        safe_symbol = symbol.replace('/', '_').replace('=', '_').replace('^', '_')
+        return os.path.join(self.data_dir, f'{safe_symbol}_{interval}.npy')
+
+    def _lock_for(self, key):
+        with self._locks_lock:
+            lock = self._locks.get(key)
+            if lock is None:
+                lock = self._locks[key] = threading.Lock()
+            return lock
+
+    def bars(self, symbol, interval='1d'):
+        """已保存的所有K線（唯讀 memmap），無資料時為空陣列"""
+        key = (symbol.upper(), interval)
+        bars = self._arrays.get(key)
+        if bars is None:
+            path = self._path(*key)
+            try:
+                bars = np.load(path, mmap_mode='r') if os.path.exists(path) else np.empty(0, dtype=BAR_DTYPE)
+            except (OSError, ValueError) as e:
+                logger.warning(f"K線檔無法讀取，將重新下載 ({path}): {e}")
+                bars = np.empty(0, dtype=BAR_DTYPE)
+            self._arrays[key] = bars
+        return bars
+
+    def _write(self, key, bars):
+        path = self._path(*key)
+        tmp_path = f'{path}.tmp.npy'
+        np.save(tmp_path, bars)
+        os.replace(tmp_path, path)
+        self._arrays[key] = np.load(path, mmap_mode='r')
+
+    def _pending_fetch(self, key, stored, start):
+        """回傳 (需要回補, 需要更新)；下載失敗後的重試間隔內兩者皆為 False"""
+        if time.monotonic() < self._retry_after.get(key, 0):
+            return False, False
+        backfill = start is not None and (not len(stored) or start < stored['ts'][0]) \
+            and start < self._backfilled.get(key, time.time())
+        refresh = REFRESH_INTERVALS.get(key[1], 3600)
+        stale = time.monotonic() - self._checked.get(key, -refresh) >= refresh
+        return backfill, stale
+
+    def needs_update(self, symbol, interval='1d', start=None):
+        """update() 是否會向上游下載（只檢查本地狀態）"""
+        key = (symbol.upper(), interval)
+        return any(self._pending_fetch(key, self.bars(*key), bar_bounds(start, None, interval)[0]))
+
+    def update(self, symbol, interval='1d', start=None):
+        """
+        補齊K線：下載最後一根K線之後的資料，start 早於已保存的起點時
+        另外只下載 [start, 已保存的起點) 的缺口回補；回傳更新後的K線
+        """
+        key = (symbol.upper(), interval)
+        start = bar_bounds(start, None, interval)[0]
+
+        with self._lock_for(key):
+            stored = self.bars(*key)
+            now = time.time()
+            backfill, stale = self._pending_fetch(key, stored, start)
+            if not backfill and not stale:
+                return stored
+
+            # 要下載的區間 [(起點, 終點)]：回補只取已保存起點之前的缺口，更新只取最後一根K線之後
+            ranges = []
+            if not len(stored):
+                ranges.append((start if backfill else int(now) - OHLCV_DEFAULT_LOOKBACK * 86400, None))
+            else:
+                if backfill:
+                    ranges.append((start, int(stored['ts'][0])))
+                if stale:
+                    ranges.append((int(stored['ts'][-1]), None))
+
+            try:
+                fresh = np.concatenate([
+                    self._fetch_history(key[0], interval, fetch_start, fetch_end)
+                    for fetch_start, fetch_end in ranges
+                ])
+            except Exception as e:
+                self._retry_after[key] = time.monotonic() + OHLCV_RETRY_INTERVAL
+                logger.warning(f"K線下載失敗 ({key[0]} {interval}): {e}")
+                return stored
+
+            if stale or not len(stored):
+                self._checked[key] = time.monotonic()
+            if backfill:
+                self._backfilled[key] = start
+            if len(fresh):
+                try:
+                    self._write(key, merge_bars(np.asarray(stored), fresh))
+                except OSError as e:
+                    logger.warning(f"K線檔寫入失敗 ({key[0]} {interval}): {e}")
+                    self._arrays[key] = merge_bars(np.asarray(stored), fresh)
+                logger.info(f"K線更新 {key[0]} {interval}: 下載 {len(fresh)} 根")
+            return self.bars(*key)
+
+    def update_many(self, symbols, interval='1d', start=None, max_workers=OHLCV_UPDATE_WORKERS):
+        """並行補齊多個股票的K線（上游流量由 governor 控制），回傳實際需要下載的股票"""
+        due = [s for s in dict.fromkeys(symbols) if self.needs_update(s, interval, start)]
+        if len(due) == 1:
+            self.update(due[0], interval, start)
+        elif due:
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(due))) as executor:
+                list(executor.map(lambda s: self.update(s, interval, start), due))
+        return due
+
+    def update_in_background(self, symbols, interval='1d', start=None):
+        """
+        在背景執行緒補齊需要下載的股票，請求本身只讀本地資料；
+        已在背景補齊中的股票略過，回傳交由背景補齊的股票
+        """
+        with self._locks_lock:
+            due = [
+                s for s in dict.fromkeys(symbols)
+                if (s.upper(), interval) not in self._pending and self.needs_update(s, interval, start)
+            ]
+            self._pending.update((s.upper(), interval) for s in due)
+        if not due:
+            return []
+
+        def run():
+            try:
+                self.update_many(due, interval, start)
+            except Exception as e:
+                logger.warning(f"背景K線補齊失敗 ({len(due)} 檔): {e}")
+            finally:
+                with self._locks_lock:
+                    self._pending.difference_update((s.upper(), interval) for s in due)
+
+        threading.Thread(target=run, name='ohlcv-backfill', daemon=True).start()
+        return due
+
+    def range(self, symbol, interval='1d', start=None, end=None, refresh=True):
+        """
+        查詢 [start, end] 區間的K線（含兩端，日K以上的週期以交易日比對，見 bar_bounds）
+        refresh=True 時先補齊缺口；回傳的陣列為 memmap 切片
+        """
+        start_ts, end_ts = bar_bounds(start, end, interval)
+        bars = self.update(symbol, interval, start) if refresh else self.bars(symbol, interval)
+        if not len(bars):
+            return bars
+
+        ts = bars['ts']
+        lo = int(np.searchsorted(ts, start_ts, side='left')) if start_ts is not None else 0
+        hi = int(np.searchsorted(ts, end_ts, side='right')) if end_ts is not None else len(bars)
+        return bars[lo:hi]
+
+
+def bars_to_records(bars):
+    """K線陣列轉為 JSON 可用的清單"""
+    return [
+        {
+            'date': datetime.fromtimestamp(int(bar['ts']), tz=timezone.utc).isoformat(),
+            'open': float(bar['open']),
+            'high': float(bar['high']),
+            'low': float(bar['low']),
+            'close': float(bar['close']),
+            'volume': float(bar['volume'])
+        }
+        for bar in bars
+    ]
+
+
+# 全域共用實例
+ohlcv_store = OHLCVStore()
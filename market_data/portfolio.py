@@ -0,0 +1,221 @@
+"""
+投資組合持股計算引擎
+交易記錄以欄位陣列（NumPy）儲存，一次排序即完成依股票分組，
+FIFO 批次、平均成本、已實現與未實現損益皆以向量化運算一次算出所有股票
+"""
+
+import numpy as np
+
+
+class TransactionTable:
+    """
+    欄位式交易表
+    依 (股票, 交易時間) 排序；同一股票的交易在陣列中連續排列
+    """
+
+    def __init__(self, ids, symbols, sides, quantities, prices, dates, order_keys, currencies, markets):
+        # 依股票分組、組內依時間排序（穩定排序，同時間保留原始順序）
+        codes_symbols, codes = np.unique(np.asarray(symbols, dtype=str), return_inverse=True)
+        order = np.lexsort((np.asarray(order_keys, dtype=str), codes))
+
+        self.symbols = codes_symbols
+        self.codes = codes[order]
+        self.ids = np.asarray(ids, dtype=object)[order]
+        self.is_buy = np.asarray(sides, dtype=bool)[order]
+        self.quantities = np.asarray(quantities, dtype=np.float64)[order]
+        self.prices = np.asarray(prices, dtype=np.float64)[order]
+        self.dates = np.asarray(dates, dtype=object)[order]
+
+        # 每個股票的幣別與市場（取該股票第一筆交易）
+        first = np.searchsorted(self.codes, np.arange(len(self.symbols)))
+        self.group_starts = first
+        self.currencies = np.asarray(currencies, dtype=object)[order][first] if len(order) else np.array([], dtype=object)
+        self.markets = np.asarray(markets, dtype=object)[order][first] if len(order) else np.array([], dtype=object)
+
+    @classmethod
+    def from_records(cls, transactions):
+        """由前端的交易記錄（dict 清單）建立交易表"""
+        return cls(
+            ids=[t.get('id') for t in transactions],
+            symbols=[str(t.get('symbol', '')).upper() for t in transactions],
+            sides=[t.get('type') == 'BUY' for t in transactions],
+            quantities=[float(t.get('quantity') or 0) for t in transactions],
+            prices=[float(t.get('price') or 0) for t in transactions],
+            dates=[t.get('date') for t in transactions],
+            order_keys=[t.get('timestamp') or t.get('date') or '' for t in transactions],
+            currencies=[t.get('currency') for t in transactions],
+            markets=[t.get('market') for t in transactions]
+        )
+
+    def __len__(self):
+        return len(self.codes)
+
+
+def compute_fifo(table):
+    """
+    向量化 FIFO 計算
+    將每個股票的買入視為數線上連續的區段（累計買入股數），賣出依序消耗最前面的股數，
+    已消耗部分的成本即累計成本函數在「累計賣出股數」處的值（分段線性內插）；
+    所有股票串接在同一條數線上（各自加上偏移量），一次 np.interp 算完
+    回傳各股票彙總、每筆買入的剩餘股數與每筆賣出的成交股數、成本與金額
+    """
+    n_symbols = len(table.symbols)
+    codes = table.codes
+    buy_qty = np.where(table.is_buy, table.quantities, 0.0)
+    sell_qty = np.where(table.is_buy, 0.0, table.quantities)
+
+    # 全域累計買入股數與成本
+    cum_buy_qty = np.cumsum(buy_qty)
+    cum_buy_cost = np.cumsum(buy_qty * table.prices)
+    cum_sell_qty = np.cumsum(sell_qty)
+
+    # 各股票在數線上的起點（該組第一筆之前的累計值）
+    starts = table.group_starts
+    offset_qty = (cum_buy_qty - buy_qty)[starts]
+    offset_cost = (cum_buy_cost - buy_qty * table.prices)[starts]
+    offset_sell = (cum_sell_qty - sell_qty)[starts]
+
+    # 組內累計值
+    group_buy_qty = cum_buy_qty - offset_qty[codes]
+    group_sell_qty = cum_sell_qty - offset_sell[codes]
+    # 賣出不可超過當時持有的股數，超賣部分忽略（不會由之後的買入抵銷）：
+    # consumed_t = S_t + min(0, 組內 min_{k<=t}(B_k - S_k))
+    # 各組減去遞增的偏移量，讓 np.minimum.accumulate 不會跨組延續
+    headroom = group_buy_qty - group_sell_qty
+    span = 2 * np.abs(headroom).max() + 1 if len(headroom) else 1.0
+    running_min = np.minimum.accumulate(headroom - codes * span) + codes * span
+    consumed = group_sell_qty + np.minimum(running_min, 0.0)
+
+    # 累計成本函數：只取有股數的買入點，確保 xp 嚴格遞增
+    lots = buy_qty > 0
+    xp = np.concatenate(([0.0], cum_buy_qty[lots]))
+    fp = np.concatenate(([0.0], cum_buy_cost[lots]))
+    consumed_cost = np.interp(offset_qty[codes] + consumed, xp, fp) - offset_cost[codes]
+
+    # 每筆賣出的已實現成本 = 組內累計消耗成本的差分
+    prev_consumed = np.concatenate(([0.0], consumed[:-1]))
+    prev_consumed_cost = np.concatenate(([0.0], consumed_cost[:-1]))
+    group_first = np.zeros(len(codes), dtype=bool)
+    group_first[starts] = True
+    prev_consumed[group_first] = 0.0
+    prev_consumed_cost[group_first] = 0.0
+
+    sold_qty = np.where(table.is_buy, 0.0, consumed - prev_consumed)
+    sold_cost = np.where(table.is_buy, 0.0, consumed_cost - prev_consumed_cost)
+    sold_proceeds = sold_qty * table.prices
+
+    # 各股票彙總
+    ends = np.append(starts[1:], len(codes)) - 1
+    total_bought = group_buy_qty[ends]
+    total_bought_cost = (cum_buy_cost - offset_cost[codes])[ends]
+    total_sold = consumed[ends]
+    total_sold_cost = consumed_cost[ends]
+
+    realized_cost = np.bincount(codes, weights=sold_cost, minlength=n_symbols)
+    realized_proceeds = np.bincount(codes, weights=sold_proceeds, minlength=n_symbols)
+
+    # 每筆買入的剩餘股數：該批次區段扣除已賣出的部分
+    lot_end = group_buy_qty
+    lot_start = lot_end - buy_qty
+    remaining = np.where(
+        table.is_buy,
+        np.clip(lot_end - np.maximum(lot_start, total_sold[codes]), 0.0, buy_qty),
+        0.0
+    )
+
+    return {
+        'quantity': total_bought - total_sold,
+        'cost': total_bought_cost - total_sold_cost,
+        'realized_cost': realized_cost,
+        'realized_proceeds': realized_proceeds,
+        'lot_remaining': remaining,
+        'sold_qty': sold_qty,
+        'sold_cost': sold_cost,
+        'sold_proceeds': sold_proceeds
+    }
+
+
+def calculate_all_holdings(transactions, prices=None, include_closed=False):
+    """
+    計算所有股票的持股與損益
+    prices 為 {symbol: 現價}，提供時一併計算市值與未實現損益；
+    回傳格式與前端 calculateAllHoldings 相容，並附加損益欄位
+    """
+    if not transactions:
+        return {}
+
+    table = TransactionTable.from_records(transactions)
+    fifo = compute_fifo(table)
+    prices = {str(k).upper(): v for k, v in (prices or {}).items()}
+
+    quantity = fifo['quantity']
+    cost = fifo['cost']
+    current = np.array([float(prices.get(symbol, np.nan) or np.nan) for symbol in table.symbols])
+
+    # 剩餘批次（FIFO 可賣出部位）
+    open_lots = np.flatnonzero(fifo['lot_remaining'] > 0)
+    lots_by_symbol = {}
+    for i in open_lots:
+        lots_by_symbol.setdefault(table.codes[i], []).append({
+            'transactionId': table.ids[i],
+            'quantity': float(fifo['lot_remaining'][i]),
+            'price': float(table.prices[i]),
+            'date': table.dates[i]
+        })
+
+    holdings = {}
+    for code, symbol in enumerate(table.symbols):
+        if quantity[code] <= 0 and not include_closed:
+            continue
+        holdings[symbol] = build_holding(
+            symbol,
+            table.markets[code],
+            table.currencies[code],
+            float(quantity[code]),
+            float(cost[code]),
+            lots_by_symbol.get(code, []),
+            float(fifo['realized_cost'][code]),
+            float(fifo['realized_proceeds'][code]),
+            None if np.isnan(current[code]) else float(current[code])
+        )
+
+    return holdings
+
+
+def build_holding(symbol, market, currency, quantity, cost, lots, realized_cost, realized_proceeds, current_price=None):
+    """組合單一股票的持股資訊（與前端 calculateHoldings 格式相容，附加損益欄位）"""
+    holding = {
+        'symbol': symbol,
+        'market': market,
+        'currency': currency,
+        'totalQuantity': quantity,
+        'averageCost': round(cost / quantity, 2) if quantity > 0 else 0,
+        'totalCost': round(cost, 2),
+        'availablePositions': lots,
+        'canSell': quantity > 0,
+        'realizedPnL': round(realized_proceeds - realized_cost, 2),
+        'realizedCost': round(realized_cost, 2)
+    }
+    if current_price is not None:
+        market_value = quantity * current_price
+        holding.update({
+            'currentPrice': current_price,
+            'marketValue': round(market_value, 2),
+            'unrealizedPnL': round(market_value - cost, 2)
+        })
+    return holding
+
+
+def summarize_holdings(holdings):
+    """彙總持股損益（各幣別分開加總）"""
+    summary = {}
+    for holding in holdings.values():
+        currency = holding.get('currency') or 'N/A'
+        totals = summary.setdefault(currency, {
+            'totalCost': 0.0, 'marketValue': 0.0, 'unrealizedPnL': 0.0, 'realizedPnL': 0.0
+        })
+        totals['totalCost'] += holding['totalCost']
+        totals['realizedPnL'] += holding['realizedPnL']
+        totals['marketValue'] += holding.get('marketValue', 0.0)
+        totals['unrealizedPnL'] += holding.get('unrealizedPnL', 0.0)
+    return {currency: {k: round(v, 2) for k, v in totals.items()} for currency, totals in summary.items()}
@@ -0,0 +1,138 @@
+"""
+背景報價預取
+依各市場交易時段，定期把近期被查詢或持有中的股票報價更新到伺服器快取，
+使用者查詢時大多直接命中快取；收盤期間暫停，直到下一次開盤
+"""
+
+import logging
+import os
+import threading
+import time
+
+from market_data.sessions import SESSIONS, market_of_symbol
+
+logger = logging.getLogger(__name__)
+
+PREFETCH_ENABLED = os.environ.get('PREFETCH_ENABLED', '1') == '1'
+PREFETCH_INTERVAL = float(os.environ.get('PREFETCH_INTERVAL', '30'))          # 開盤期間的更新間隔（秒）
+PREFETCH_ACTIVE_WINDOW = float(os.environ.get('PREFETCH_ACTIVE_WINDOW', '1800'))  # 查詢後持續預取的秒數
+PREFETCH_MAX_SLEEP = 900        # 全部收盤時最長的等待秒數（期間仍可被新查詢喚醒）
+PREFETCH_MAX_SYMBOLS = 500      # 追蹤的股票數上限
+
+
+class PrefetchScheduler:
+    """
+    交易時段預取排程
+    refresh(symbols) 負責實際查詢並寫入快取；held_symbols() 回傳持有中的 Yahoo 代號
+    """
+
+    def __init__(self, refresh, held_symbols=None, interval=PREFETCH_INTERVAL,
+                 active_window=PREFETCH_ACTIVE_WINDOW):
+        self._refresh = refresh
+        self._held_symbols = held_symbols or (lambda: [])
+        self.interval = interval
+        self.active_window = active_window
+        self._requested = {}     # 代號 -> 最後一次被查詢的時間
+        self._refreshed = {}     # 代號 -> 最後一次預取的時間
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.stats = {'cycles': 0, 'refreshed': 0, 'errors': 0}
+
+    def track(self, symbol):
+        """記錄被查詢的股票，之後在交易時段內持續預取"""
+        symbol = str(symbol).upper()
+        now = time.monotonic()
+        with self._lock:
+            first_seen = symbol not in self._requested
+            self._requested[symbol] = now
+            if len(self._requested) > PREFETCH_MAX_SYMBOLS:
+                oldest = min(self._requested, key=self._requested.get)
+                del self._requested[oldest]
+        if first_seen:
+            self._wake.set()
+
+    def active_symbols(self):
+        """近期被查詢或持有中的股票"""
+        now = time.monotonic()
+        with self._lock:
+            for symbol in [s for s, seen in self._requested.items() if now - seen > self.active_window]:
+                del self._requested[symbol]
+            symbols = set(self._requested)
+        try:
+            symbols.update(str(s).upper() for s in self._held_symbols())
+        except Exception as e:
+            logger.warning(f"取得持股清單失敗: {e}")
+        return symbols
+
+    def due_symbols(self, now_utc=None):
+        """
+        回傳 (需要更新的股票, 建議等待秒數)
+        只更新所屬市場正在開盤、且距上次預取超過間隔的股票
+        """
+        now = time.monotonic()
+        due = []
+        wait = PREFETCH_MAX_SLEEP
+        active = self.active_symbols()
+        for symbol in [s for s in self._refreshed if s not in active]:
+            del self._refreshed[symbol]
+        for symbol in active:
+            session = SESSIONS.get(market_of_symbol(symbol))
+            until_open = session.seconds_until_open(now_utc) if session else 0.0
+            if until_open > 0:
+                wait = min(wait, until_open)
+                continue
+            elapsed = now - self._refreshed.get(symbol, float('-inf'))
+            if elapsed >= self.interval:
+                due.append(symbol)
+                wait = min(wait, self.interval)
+            else:
+                wait = min(wait, self.interval - elapsed)
+        return sorted(due), max(wait, 1.0)
+
+    def run_once(self, now_utc=None):
+        """執行一輪預取，回傳下一輪前的等待秒數"""
+        due, wait = self.due_symbols(now_utc)
+        if due:
+            try:
+                self._refresh(due)
+                self.stats['refreshed'] += len(due)
+            except Exception as e:
+                self.stats['errors'] += 1
+                logger.warning(f"預取報價失敗: {e}")
+            finished = time.monotonic()
+            for symbol in due:
+                self._refreshed[symbol] = finished
+        self.stats['cycles'] += 1
+        return wait
+
+    def _loop(self):
+        logger.info(f"啟動報價預取排程（間隔 {self.interval:g} 秒）")
+        while not self._stop.is_set():
+            self._wake.clear()
+            wait = self.run_once()
+            self._wake.wait(wait)
+
+    def start(self):
+        """啟動背景執行緒；可重複呼叫，每個行程只會有一個（fork 後的子行程會重新啟動）"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name='price-prefetch', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def status(self):
+        with self._lock:
+            tracked = len(self._requested)
+        return dict(self.stats, tracked=tracked, running=self._thread is not None and self._thread.is_alive())
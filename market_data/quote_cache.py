@@ -0,0 +1,283 @@
+"""
+伺服器端股價快取
+以標準化股票代號為鍵的 TTL + LRU 快取，所有 Python 價格端點共用同一份實例，
+讓多個使用者輪詢相同股票時，每個 TTL 週期只需向上游查詢一次；
+股價的 TTL 依交易所開收盤狀態決定：開盤中短 TTL，收盤後有效至下一次開盤；
+過期不久的股價可先回傳（stale-while-revalidate），同時在背景重新查詢
+"""
+
+import copy
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from market_data.sessions import SESSIONS, market_of_symbol
+from market_data.singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# 快取設定（可用環境變數調整）
+QUOTE_TTL = float(os.environ.get('QUOTE_CACHE_TTL', '60'))             # 股價（開盤中）：60秒
+QUOTE_CLOSED_MAX_TTL = float(os.environ.get('QUOTE_CLOSED_MAX_TTL', str(72 * 3600)))  # 收盤後的 TTL 上限
+QUOTE_SETTLE_WINDOW = float(os.environ.get('QUOTE_SETTLE_WINDOW', '1800'))  # 收盤後仍用短 TTL 的秒數（等待收盤價確定）
+QUOTE_MAX_STALE = float(os.environ.get('QUOTE_MAX_STALE', '600'))     # 過期後仍可先回傳的秒數
+METADATA_TTL = float(os.environ.get('METADATA_CACHE_TTL', '86400'))    # 名稱等基本資料：24小時
+QUOTE_CACHE_SIZE = int(os.environ.get('QUOTE_CACHE_SIZE', '2048'))
+METADATA_CACHE_SIZE = int(os.environ.get('METADATA_CACHE_SIZE', '4096'))
+
+
+def normalize_symbol(symbol):
+    """標準化股票代號作為快取鍵（去除空白、轉大寫）"""
+    return str(symbol).strip().upper()
+
+
+def cache_key(kind, symbol):
+    """
+    組合快取鍵
+    kind 區分不同端點的資料格式（如 chart、quoteType、yfinance），避免互相覆蓋
+    """
+    return f"{kind}:{normalize_symbol(symbol)}"
+
+
+def market_quote_ttl(symbol, now=None):
+    """
+    依交易所開收盤狀態計算股價的 TTL（秒）
+    開盤中與剛收盤的一段時間內使用 QUOTE_TTL，其餘時間有效至下一次開盤（含午休後開盤）；
+    匯率（=X）等沒有固定交易時段的代號一律使用 QUOTE_TTL
+    """
+    symbol = normalize_symbol(symbol)
+    session = None if '=' in symbol else SESSIONS.get(market_of_symbol(symbol))
+    if session is None or session.is_open(now):
+        return QUOTE_TTL
+
+    last_close = session.previous_close(now)
+    if last_close is not None:
+        current = now or datetime.now(timezone.utc)
+        if current.tzinfo is None:
+            current = current.replace(tzinfo=timezone.utc)
+        if (current - last_close).total_seconds() < QUOTE_SETTLE_WINDOW:
+            return QUOTE_TTL
+
+    return min(max(session.seconds_until_open(now), QUOTE_TTL), QUOTE_CLOSED_MAX_TTL)
+
+
+def quote_ttl_for_key(key):
+    """由快取鍵（kind:SYMBOL）取出代號計算 TTL"""
+    return market_quote_ttl(key.split(':', 1)[-1])
+
+
+class TTLCache:
+    """
+    執行緒安全的 TTL + LRU 快取
+    超過 maxsize 時淘汰最久未使用的項目，記憶體用量有上限；
+    ttl 可為固定秒數，或以快取鍵計算秒數的函數；
+    max_stale 為過期後仍保留、可供 get_or_fetch_swr 先回傳的秒數
+    """
+
+    def __init__(self, maxsize, ttl, max_stale=0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self._data = OrderedDict()  # key -> (expiry, value, stored_at)
+        self._lock = threading.Lock()
+        self._flight = SingleFlight()
+        self._refreshing = set()
+        self._loader = None
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+
+    def _lookup(self, key, now):
+        """回傳快取項目；超過 stale 保留期的項目一併刪除（需持有鎖）"""
+        entry = self._data.get(key)
+        if entry is not None and entry[0] + self.max_stale <= now:
+            del self._data[key]
+            return None
+        return entry
+
+    def load_on_first_miss(self, loader):
+        """登錄第一次未命中時才執行的載入函數（如啟動快照），載入後重新查詢；載入函數需自行保證只執行一次"""
+        self._loader = loader
+
+    def _load_pending(self):
+        """執行尚未執行的載入函數，回傳是否有執行"""
+        loader = self._loader
+        if loader is None:
+            return False
+        try:
+            loader()
+        except Exception as e:
+            logger.warning(f"快取預先載入失敗: {e}")
+        self._loader = None
+        return True
+
+    def get(self, key):
+        """取得未過期的快取值，不存在或已過期回傳 None"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._lookup(key, now)
+            if entry is None or entry[0] <= now:
+                value = None
+                if self._loader is None:
+                    self.misses += 1
+            else:
+                self._data.move_to_end(key)
+                self.hits += 1
+                value = entry[1]
+        if value is None:
+            return self.get(key) if self._load_pending() else None
+        # 回傳副本，呼叫端修改結果不會污染快取
+        return copy.copy(value)
+
+    def get_stale(self, key):
+        """
+        取得已過期但仍在 stale 保留期內的快取值
+        回傳 (值, 存放秒數)；未過期、不存在或超過保留期時回傳 None
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._lookup(key, now)
+            if entry is None or entry[0] > now:
+                return None
+            self.stale_hits += 1
+            return copy.copy(entry[1]), now - entry[2]
+
+    def peek(self, key):
+        """取得仍在 TTL 或 stale 保留期內的快取值（不計入命中統計，不調整 LRU 順序），否則回傳 None"""
+        with self._lock:
+            entry = self._lookup(key, time.monotonic())
+        if entry is None:
+            return self.peek(key) if self._load_pending() else None
+        return copy.copy(entry[1])
+
+    def set(self, key, value, ttl=None, age=0):
+        """
+        寫入快取，ttl 未指定時使用預設值；age 為資料寫入前已存在的秒數（如啟動快照）
+        ttl 可為負值：資料已過期，只剩 ttl + max_stale 秒的 stale 保留期
+        """
+        if ttl is None:
+            ttl = self.ttl(key) if callable(self.ttl) else self.ttl
+        now = time.monotonic()
+        with self._lock:
+            self._data[key] = (now + ttl, copy.copy(value), now - age)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+            self.stale_hits = 0
+
+    def get_or_fetch(self, key, fetch, ttl=None):
+        """
+        快取命中直接回傳，否則呼叫 fetch() 取得資料
+        同一鍵的並行未命中請求經 single-flight 合併為一次上游呼叫
+        只快取成功結果（含 error 欄位的 dict 不寫入）
+        """
+        cached = self.get(key)
+        if cached is not None:
+            return cached
+        return self._flight.do(key, lambda: self._load(key, fetch, ttl))
+
+    def _load(self, key, fetch, ttl):
+        value = fetch()
+        if value is not None and not (isinstance(value, dict) and value.get('error')):
+            self.set(key, value, ttl)
+        return value
+
+    def get_or_fetch_swr(self, key, fetch, ttl=None):
+        """
+        stale-while-revalidate 版的 get_or_fetch
+        快取已過期但仍在保留期內時，立即回傳舊值（標記 stale 與 cacheAge 秒數）並在背景重新查詢；
+        超過保留期才同步查詢上游
+        注意：Vercel Functions 在回應送出後會凍結執行環境，背景查詢可能延到下次呼叫才完成，
+        因此舊值最久只會被使用 max_stale 秒
+        """
+        cached = self.get(key)
+        if cached is not None:
+            return cached
+
+        stale = self.get_stale(key)
+        if stale is None:
+            return self._flight.do(key, lambda: self._load(key, fetch, ttl))
+
+        value, age = stale
+        self.revalidate(key, fetch, ttl)
+        if isinstance(value, dict):
+            value.update({'stale': True, 'cacheAge': round(age, 1)})
+        return value
+
+    def revalidate(self, key, fetch, ttl=None):
+        """
+        在背景重新查詢並更新快取；同一鍵同時只有一個背景查詢，
+        並與前景的同鍵查詢經 single-flight 合併；回傳是否已啟動新的背景查詢
+        """
+        with self._lock:
+            if key in self._refreshing:
+                return False
+            self._refreshing.add(key)
+
+        def run():
+            try:
+                self._flight.do(key, lambda: self._load(key, fetch, ttl))
+            except Exception as e:
+                logger.warning(f"背景更新快取失敗 ({key}): {e}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=run, name=f'revalidate-{key}', daemon=True).start()
+        return True
+
+    def revalidate_many(self, keys, fetch_many, ttl=None):
+        """
+        批次版 revalidate：fetch_many(keys) 回傳 {鍵: 值}，以一次背景查詢更新多個鍵
+        已有背景查詢的鍵略過；回傳實際交由背景查詢的鍵
+        """
+        with self._lock:
+            claimed = [key for key in dict.fromkeys(keys) if key not in self._refreshing]
+            self._refreshing.update(claimed)
+        if not claimed:
+            return []
+
+        def run():
+            try:
+                for key, value in fetch_many(claimed).items():
+                    if value is not None and not (isinstance(value, dict) and value.get('error')):
+                        self.set(key, value, ttl)
+            except Exception as e:
+                logger.warning(f"背景批次更新快取失敗 ({len(claimed)} 筆): {e}")
+            finally:
+                with self._lock:
+                    self._refreshing.difference_update(claimed)
+
+        threading.Thread(target=run, name='revalidate-batch', daemon=True).start()
+        return claimed
+
+    def stats(self):
+        """快取統計"""
+        with self._lock:
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'stale_hits': self.stale_hits,
+                'refreshing': len(self._refreshing),
+                'coalesced': self._flight.shared
+            }
+
+
+# 全域共用實例
+quote_cache = TTLCache(QUOTE_CACHE_SIZE, quote_ttl_for_key, max_stale=QUOTE_MAX_STALE)
+metadata_cache = TTLCache(METADATA_CACHE_SIZE, METADATA_TTL)
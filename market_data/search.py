@@ -0,0 +1,196 @@
+"""
+股票代號搜尋
+以證券名錄建立記憶體內的前綴樹（代號、名稱與名稱中的詞）與三字元索引（容許打錯字），
+輸入時即可自動完成，不需逐字向 Yahoo 嘗試各種代號格式
+"""
+
+import threading
+import time
+import unicodedata
+from collections import Counter
+
+from market_data.securities import securities, security_to_dict
+from market_data.symbols import normalize_market
+
+SEARCH_DEFAULT_LIMIT = 10
+SEARCH_MAX_LIMIT = 50
+PREFIX_BUCKET_SIZE = 64      # 前綴樹每個節點保留的候選數
+TRIGRAM_MIN_SIMILARITY = 0.3
+
+# 排名分數：完全符合代號 > 代號前綴 > 名稱前綴 > 名稱中的詞或片段 > 三字元相似
+SCORE_EXACT = 100
+SCORE_CODE_PREFIX = 80
+SCORE_NAME_PREFIX = 60
+SCORE_TOKEN_PREFIX = 40
+SCORE_FUZZY = 30
+
+
+def normalize_text(text):
+    """全形轉半形、轉小寫（ＵＦＪ → ufj），供索引與查詢共用"""
+    return unicodedata.normalize('NFKC', str(text)).strip().lower()
+
+
+def _is_cjk(char):
+    return ord(char) > 0x2E80
+
+
+def trigrams(text):
+    """前後補空白的三字元集合；不足三字元的字串本身作為一個元素"""
+    padded = f'  {text} '
+    if len(text) < 3:
+        return {text} if text else set()
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class _TrieNode:
+    __slots__ = ('children', 'ids')
+
+    def __init__(self):
+        self.children = {}
+        self.ids = []
+
+
+class SymbolSearch:
+    """
+    證券名錄的搜尋索引（首次搜尋時建立）
+    前綴樹的每個節點直接保存前 PREFIX_BUCKET_SIZE 個候選，查詢只需走完查詢字串的長度；
+    全部市場與各市場各有一組前綴樹，指定市場時候選數上限不會被其他市場的證券佔滿
+    """
+
+    def __init__(self, master=securities):
+        self.master = master
+        self._rows = None
+        self._code_tries = None
+        self._name_tries = None
+        self._trigrams = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _insert(trie, key, row_id):
+        node = trie
+        for char in key:
+            node = node.children.setdefault(char, _TrieNode())
+            if len(node.ids) < PREFIX_BUCKET_SIZE and (not node.ids or node.ids[-1] != row_id):
+                node.ids.append(row_id)
+
+    @staticmethod
+    def _walk(trie, prefix):
+        node = trie
+        for char in prefix:
+            node = node.children.get(char)
+            if node is None:
+                return []
+        return node.ids
+
+    def _build(self):
+        if self._rows is not None:
+            return
+        with self._lock:
+            if self._rows is not None:
+                return
+            rows = self.master.all()
+            code_tries = {}      # 市場（None 為全部）-> 前綴樹
+            name_tries = {}
+            index = {}
+            for row_id, row in enumerate(rows):
+                code = row.symbol.split('.')[0].lower()
+                code_keys = {code}
+                if code.isdigit() and code.lstrip('0') != code:
+                    code_keys.add(code.lstrip('0'))
+
+                name = normalize_text(row.name)
+                name_keys = set(name.split()) | {name}
+                # 中日文名稱沒有空格分詞，改為索引每個後綴（控股 可找到 騰訊控股、ufj 可找到 三菱ＵＦＪ）
+                name_keys.update(name[i:] for i in range(1, len(name)) if _is_cjk(name[i]) or _is_cjk(name[i - 1]))
+
+                for market in (None, row.market):
+                    code_trie = code_tries.setdefault(market, _TrieNode())
+                    name_trie = name_tries.setdefault(market, _TrieNode())
+                    for key in sorted(code_keys):
+                        self._insert(code_trie, key, row_id)
+                    self._insert(name_trie, name, row_id)
+                    for key in sorted(name_keys - {name}):
+                        self._insert(name_trie, key, row_id)
+
+                for gram in trigrams(code) | trigrams(name):
+                    index.setdefault(gram, []).append(row_id)
+
+            self._code_tries = code_tries
+            self._name_tries = name_tries
+            self._trigrams = index
+            self._rows = rows
+
+    def reload(self):
+        with self._lock:
+            self._rows = None
+
+    def search(self, query, limit=SEARCH_DEFAULT_LIMIT, market=None):
+        """回傳依分數排序的 [(分數, Security)]"""
+        self._build()
+        text = normalize_text(query)
+        if not text:
+            return []
+        market = normalize_market(market)
+        rows = self._rows
+        code_query = text.split('.')[0].split(':')[-1]
+
+        scores = {}
+
+        def add(row_id, score):
+            if scores.get(row_id, 0) < score:
+                scores[row_id] = score
+
+        # 指定市場時走該市場的前綴樹，候選上限只計算該市場的證券
+        empty = _TrieNode()
+        for row_id in self._walk(self._code_tries.get(market, empty), code_query):
+            code = rows[row_id].symbol.split('.')[0].lower()
+            add(row_id, SCORE_EXACT if code_query in (code, code.lstrip('0')) else SCORE_CODE_PREFIX)
+        for row_id in self._walk(self._name_tries.get(market, empty), text):
+            name = normalize_text(rows[row_id].name)
+            add(row_id, SCORE_EXACT if name == text else SCORE_NAME_PREFIX if name.startswith(text) else SCORE_TOKEN_PREFIX)
+
+        # 前綴沒有足夠結果時，以三字元相似度補上（容許打錯或漏字）
+        if len(scores) < limit and len(text) >= 3:
+            grams = trigrams(text)
+            shared = Counter()
+            for gram in grams:
+                shared.update(self._trigrams.get(gram, ()))
+            for row_id, count in shared.items():
+                similarity = count / len(grams)
+                if similarity >= TRIGRAM_MIN_SIMILARITY:
+                    add(row_id, SCORE_FUZZY * similarity)
+
+        ranked = sorted(
+            ((score, rows[row_id]) for row_id, score in scores.items()
+             if market is None or rows[row_id].market == market),
+            key=lambda item: (-item[0], len(item[1].symbol), item[1].symbol)
+        )
+        return ranked[:limit]
+
+
+def search_symbols(query, limit=SEARCH_DEFAULT_LIMIT, market=None):
+    """搜尋端點共用的回應格式"""
+    if not query or not str(query).strip():
+        return {'error': '缺少搜尋關鍵字'}
+    try:
+        limit = max(1, min(int(limit), SEARCH_MAX_LIMIT))
+    except (TypeError, ValueError):
+        return {'error': '無效的 limit 參數'}
+
+    started = time.perf_counter()
+    results = []
+    for score, security in symbol_search.search(query, limit, market):
+        item = security_to_dict(security)
+        item.update({'market': security.market, 'score': round(score, 1)})
+        del item['timestamp']
+        results.append(item)
+    return {
+        'query': query,
+        'results': results,
+        'count': len(results),
+        'elapsed_ms': round((time.perf_counter() - started) * 1000, 2)
+    }
+
+
+# 全域共用實例
+symbol_search = SymbolSearch()
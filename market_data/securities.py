@@ -0,0 +1,409 @@
+"""
+上市證券名錄
+港股（HKEX）、日股（TSE）、台股（TWSE）的代號、當地名稱、幣別與每手股數，
+存放於隨程式部署的 data/securities.tsv（依代號排序），載入後以二分搜尋查詢與前綴搜尋，
+查詢股票名稱不需呼叫 Yahoo
+
+更新名錄（以交易所公布的證券清單匯入，取代該市場的所有紀錄）：
+    python -m market_data.securities fetch [HK JP TW]            # 直接下載各交易所最新清單
+    python -m market_data.securities import HK ListOfSecurities.xlsx
+    python -m market_data.securities import JP data_j.xls        # .xls 需安裝 xlrd（列於 requirements.txt）
+    python -m market_data.securities import TW isin_strMode2.html
+
+清單格式依檔案內容判斷：xlsx、xls、HTML 表格（TWSE 證券編碼公告）或 CSV；
+部署建置（npm run build:vercel）會先執行 fetch，下載失敗的市場保留現有紀錄並在 stderr 警告，
+加上 --strict 時任一市場失敗即以非零狀態結束；名錄中任一市場沒有紀錄時一律視為失敗
+"""
+
+import argparse
+import bisect
+import csv
+import io
+import logging
+import os
+import re
+import sys
+import threading
+import urllib.request
+import zipfile
+from collections import namedtuple
+from datetime import datetime
+from html.parser import HTMLParser
+from xml.etree import ElementTree
+
+from market_data.symbols import MARKETS, classify
+
+logger = logging.getLogger(__name__)
+
+SECURITIES_PATH = os.environ.get(
+    'SECURITIES_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'securities.tsv')
+)
+
+EXCHANGES = {'HK': 'HKEX', 'JP': 'TSE', 'TW': 'TWSE'}
+DEFAULT_LOT_SIZES = {'HK': None, 'JP': 100, 'TW': 1000}
+
+# 各交易所證券清單的欄位名稱，依序以表頭比對採用第一個符合的格式；
+# filter 為 (欄位, 值)，只匯入符合的列（如港股只取股本證券）；
+# name 為 None 時代號與名稱在同一欄（以空白分隔）；sections 為只匯入的分類（清單中只有一格的分類標題列）
+EXCHANGE_DUMPS = {
+    'HK': [
+        {'code': '股份代號', 'name': '股份名稱', 'lot': '買賣單位', 'filter': ('分類', '股本')},
+        {'code': 'Stock Code', 'name': 'Name of Securities', 'lot': 'Board Lot', 'filter': ('Category', 'Equity')}
+    ],
+    'JP': [{'code': 'コード', 'name': '銘柄名', 'lot': None, 'filter': None}],
+    'TW': [
+        {'code': '有價證券代號及名稱', 'name': None, 'lot': None, 'filter': None,
+         'sections': {'股票', 'ETF', 'ETN', '特別股', '創新板', '臺灣存託憑證(TDR)', '受益證券-不動產投資信託'}},
+        {'code': '公司代號', 'name': '公司簡稱', 'lot': None, 'filter': None}
+    ]
+}
+
+# fetch 指令下載的交易所清單：[(網址, HTML/CSV 的文字編碼)]，依序嘗試（港股優先取中文名稱版）
+EXCHANGE_SOURCES = {
+    'HK': [
+        ('https://www.hkex.com.hk/chi/services/trading/securities/securitieslists/ListOfSecurities_c.xlsx', None),
+        ('https://www.hkex.com.hk/eng/services/trading/securities/securitieslists/ListOfSecurities.xlsx', None)
+    ],
+    'JP': [('https://www.jpx.co.jp/markets/statistics-equities/misc/tvdivq0000001vg2-att/data_j.xls', None)],
+    'TW': [('https://isin.twse.com.tw/isin/C_public.jsp?strMode=2', 'cp950')]
+}
+FETCH_TIMEOUT = 60
+
+_XLSX_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+_CELL_COLUMN = re.compile(r'^([A-Z]+)')
+
+_FIELDS = ['symbol', 'market', 'name', 'currency', 'lot_size']
+
+Security = namedtuple('Security', _FIELDS)
+
+
+def security_to_dict(security):
+    """名錄紀錄轉為與 Yahoo 查詢結果相同格式的股票資訊"""
+    return {
+        'symbol': security.symbol,
+        'name': security.name,
+        'industry': 'N/A',
+        'sector': 'N/A',
+        'currency': security.currency,
+        'exchange': EXCHANGES.get(security.market, ''),
+        'lotSize': security.lot_size,
+        'source': 'directory',
+        'timestamp': datetime.now().isoformat()
+    }
+
+
+def read_securities(path):
+    """讀取名錄檔，回傳依代號排序的 Security 清單（檔案不存在時為空）"""
+    if not os.path.exists(path):
+        return []
+    rows = []
+    with open(path, encoding='utf-8', newline='') as f:
+        for line in f:
+            if not line.strip() or line.startswith('#'):
+                continue
+            symbol, market, name, currency, lot_size = line.rstrip('\n').split('\t')
+            rows.append(Security(symbol, market, name, currency, int(lot_size) if lot_size else None))
+    rows.sort(key=lambda s: s.symbol)
+    return rows
+
+
+def write_securities(path, rows):
+    """依代號排序寫入名錄檔（先寫暫存檔再取代）"""
+    rows = sorted(rows, key=lambda s: s.symbol)
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8', newline='') as f:
+        f.write('# ' + '\t'.join(_FIELDS) + '\n')
+        for s in rows:
+            f.write(f"{s.symbol}\t{s.market}\t{s.name}\t{s.currency}\t{s.lot_size or ''}\n")
+    os.replace(tmp_path, path)
+
+
+def _cell_text(value):
+    """試算表儲存格轉為字串（整數值的數字不帶小數點，如 1301.0 → 1301）"""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value).strip()
+
+
+def _read_xlsx(data):
+    """以標準庫讀取 xlsx 第一個工作表的所有列（共用字串與行內字串皆支援）"""
+    with zipfile.ZipFile(io.BytesIO(data)) as book:
+        shared = []
+        if 'xl/sharedStrings.xml' in book.namelist():
+            for item in ElementTree.fromstring(book.read('xl/sharedStrings.xml')).iter(f'{_XLSX_NS}si'):
+                shared.append(''.join(t.text or '' for t in item.iter(f'{_XLSX_NS}t')))
+        sheets = sorted(n for n in book.namelist() if n.startswith('xl/worksheets/sheet'))
+        sheet = ElementTree.fromstring(book.read(sheets[0]))
+
+    rows = []
+    for row in sheet.iter(f'{_XLSX_NS}row'):
+        cells = {}
+        for cell in row.iter(f'{_XLSX_NS}c'):
+            column = 0
+            for char in _CELL_COLUMN.match(cell.get('r', 'A')).group(1):
+                column = column * 26 + ord(char) - 64
+            kind = cell.get('t')
+            if kind == 'inlineStr':
+                value = ''.join(t.text or '' for t in cell.iter(f'{_XLSX_NS}t'))
+            else:
+                node = cell.find(f'{_XLSX_NS}v')
+                value = '' if node is None else node.text or ''
+                if kind == 's' and value:
+                    value = shared[int(value)]
+                elif kind is None and value:
+                    value = _cell_text(float(value)) if re.fullmatch(r'-?\d+(\.\d+)?', value) else value
+            cells[column - 1] = value
+        rows.append([cells.get(i, '') for i in range(max(cells) + 1)] if cells else [])
+    return rows
+
+
+def _read_xls(data):
+    """讀取舊版 xls（JPX 的 data_j.xls），需安裝 xlrd"""
+    try:
+        import xlrd
+    except ImportError:
+        raise ValueError('讀取 .xls 需要安裝 xlrd（pip install xlrd），或先以試算表軟體另存為 CSV 或 xlsx')
+    sheet = xlrd.open_workbook(file_contents=data).sheet_by_index(0)
+    return [[_cell_text(v) for v in sheet.row_values(i)] for i in range(sheet.nrows)]
+
+
+class _TableParser(HTMLParser):
+    """收集 HTML 表格的所有列（TWSE 證券編碼公告）"""
+
+    def __init__(self):
+        super().__init__()
+        self.rows = []
+        self._row = None
+        self._cell = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'tr':
+            self._row = []
+        elif tag in ('td', 'th') and self._row is not None:
+            self._cell = []
+
+    def handle_endtag(self, tag):
+        if tag in ('td', 'th') and self._cell is not None:
+            self._row.append(''.join(self._cell).strip())
+            self._cell = None
+        elif tag == 'tr' and self._row is not None:
+            self.rows.append(self._row)
+            self._row = None
+
+    def handle_data(self, data):
+        if self._cell is not None:
+            self._cell.append(data)
+
+
+def read_table(data, encoding='utf-8-sig'):
+    """
+    讀取交易所證券清單（bytes），依內容判斷格式：xlsx、xls、HTML 表格或 CSV
+    回傳字串清單的清單
+    """
+    if data[:2] == b'PK':
+        return _read_xlsx(data)
+    if data[:4] == b'\xd0\xcf\x11\xe0':
+        return _read_xls(data)
+    text = data.decode(encoding, errors='replace')
+    if text.lstrip()[:1] == '<':
+        parser = _TableParser()
+        parser.feed(text)
+        return parser.rows
+    return list(csv.reader(io.StringIO(text)))
+
+
+def parse_exchange_dump(path, market, encoding='utf-8-sig', data=None):
+    """
+    解析交易所證券清單，回傳該市場的 Security 清單
+    表頭前的說明列（如 HKEX 清單的標題與更新日期）自動略過；data 為已下載的內容時不讀取 path
+    """
+    if data is None:
+        with open(path, 'rb') as f:
+            data = f.read()
+    table = read_table(data, encoding)
+    currency = MARKETS[market][1]
+
+    for position, header in enumerate(table):
+        header = [str(h).strip() for h in header]
+        columns = next((c for c in EXCHANGE_DUMPS[market] if c['code'] in header), None)
+        if columns is not None:
+            break
+    else:
+        raise ValueError(f"找不到證券代號欄位: {path}")
+
+    index = {name: i for i, name in enumerate(header)}
+    sections = columns.get('sections')
+    section = None
+    rows = {}
+    for record in table[position + 1:]:
+        if sections and len(record) == 1:
+            section = record[0].strip()
+            continue
+        if len(record) < len(header) or (sections and section not in sections):
+            continue
+        if columns['filter'] and record[index[columns['filter'][0]]].strip() != columns['filter'][1]:
+            continue
+        code = record[index[columns['code']]].strip()
+        if columns['name']:
+            name = record[index[columns['name']]].strip()
+        else:
+            code, _, name = code.replace('\u3000', ' ').partition(' ')
+            name = name.strip()
+        if not code or not name:
+            continue
+        info = classify(code, market=market)
+        if info.market != market:
+            # 帶英文字母的代號（台股特別股 2881A、槓桿 ETF 00631L）加上市場後綴再判斷
+            info = classify(f'{code}{MARKETS[market][0]}')
+            if info.market != market:
+                continue
+        lot_size = DEFAULT_LOT_SIZES[market]
+        if columns['lot']:
+            lot_text = record[index[columns['lot']]].replace(',', '').strip()
+            lot_size = int(float(lot_text)) if re.fullmatch(r'\d+(\.0+)?', lot_text) else None
+        rows[info.symbol] = Security(info.symbol, market, name, currency, lot_size)
+    return list(rows.values())
+
+
+class SecuritiesMaster:
+    """
+    排序後的證券名錄（首次查詢時載入）
+    lookup() 為 O(log n) 二分搜尋；prefix() 找出代號以指定前綴開頭的證券
+    """
+
+    def __init__(self, path=SECURITIES_PATH):
+        self.path = path
+        self._symbols = None
+        self._rows = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._rows is None:
+            with self._lock:
+                if self._rows is None:
+                    try:
+                        rows = read_securities(self.path)
+                    except (OSError, ValueError) as e:
+                        logger.warning(f"證券名錄無法讀取 ({self.path}): {e}")
+                        rows = []
+                    self._symbols = [s.symbol for s in rows]
+                    self._rows = rows
+        return self._rows
+
+    def __len__(self):
+        return len(self._load())
+
+    def all(self):
+        return list(self._load())
+
+    def lookup(self, symbol, market=None):
+        """依代號查詢（接受 0700、700.HK、TSE:7203 等格式），查無時回傳 None"""
+        rows = self._load()
+        info = classify(symbol, market=market)
+        if info.market == 'UNKNOWN' and info.ambiguous:
+            # 4位數字未指定市場：依港股、日股、台股的順序查詢
+            candidates = [classify(symbol, market=m).symbol for m in EXCHANGES]
+        else:
+            candidates = [info.symbol]
+        for candidate in candidates:
+            i = bisect.bisect_left(self._symbols, candidate)
+            if i < len(rows) and self._symbols[i] == candidate:
+                return rows[i]
+        return None
+
+    def prefix(self, prefix, limit=20, market=None):
+        """代號以 prefix 開頭的證券（依代號排序）"""
+        rows = self._load()
+        prefix = str(prefix).strip().upper()
+        if not prefix:
+            return []
+        results = []
+        for i in range(bisect.bisect_left(self._symbols, prefix), len(rows)):
+            if not self._symbols[i].startswith(prefix) or len(results) >= limit:
+                break
+            if market is None or rows[i].market == market:
+                results.append(rows[i])
+        return results
+
+    def reload(self):
+        with self._lock:
+            self._rows = None
+            self._symbols = None
+
+
+def import_dump(path, market, dump_path, encoding='utf-8-sig', data=None):
+    """以交易所清單取代名錄中該市場的紀錄，回傳 (匯入筆數, 名錄總筆數)"""
+    fresh = parse_exchange_dump(dump_path, market, encoding, data)
+    if not fresh:
+        raise ValueError(f"清單中沒有可匯入的證券: {dump_path}")
+    rows = [s for s in read_securities(path) if s.market != market] + fresh
+    write_securities(path, rows)
+    return len(fresh), len(rows)
+
+
+def fetch_import(path, market, timeout=FETCH_TIMEOUT):
+    """下載並匯入交易所最新的證券清單，依序嘗試各來源；回傳 (匯入筆數, 名錄總筆數)"""
+    error = None
+    for url, encoding in EXCHANGE_SOURCES[market]:
+        try:
+            request = urllib.request.Request(url, headers={'User-Agent': 'Mozilla/5.0'})
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                data = response.read()
+            return import_dump(path, market, url, encoding or 'utf-8-sig', data)
+        except Exception as e:
+            logger.warning(f"{EXCHANGES[market]} 清單下載或解析失敗 ({url}): {e}")
+            error = e
+    raise error
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='更新上市證券名錄')
+    sub = parser.add_subparsers(dest='command', required=True)
+    importer = sub.add_parser('import', help='匯入交易所證券清單（CSV、xlsx、xls 或 HTML）')
+    importer.add_argument('market', choices=sorted(EXCHANGE_DUMPS))
+    importer.add_argument('dump')
+    importer.add_argument('--encoding', default='utf-8-sig')
+    importer.add_argument('--output', default=SECURITIES_PATH)
+    fetcher = sub.add_parser('fetch', help='下載並匯入交易所最新清單（失敗的市場保留現有紀錄）')
+    fetcher.add_argument('markets', nargs='*', metavar='MARKET', help='HK、JP、TW，省略時更新所有市場')
+    fetcher.add_argument('--output', default=SECURITIES_PATH)
+    fetcher.add_argument('--strict', action='store_true', help='任一市場下載失敗即以非零狀態結束')
+    args = parser.parse_args(argv)
+
+    if args.command == 'import':
+        imported, total = import_dump(args.output, args.market, args.dump, args.encoding)
+        print(f"{EXCHANGES[args.market]}: 匯入 {imported} 筆，名錄共 {total} 筆 ({args.output})")
+        return
+
+    markets = [m.upper() for m in args.markets] or sorted(EXCHANGE_SOURCES)
+    unknown = set(markets) - set(EXCHANGE_SOURCES)
+    if unknown:
+        parser.error(f"不支援的市場: {', '.join(sorted(unknown))}")
+    failed = []
+    for market in markets:
+        try:
+            imported, total = fetch_import(args.output, market)
+            print(f"{EXCHANGES[market]}: 匯入 {imported} 筆，名錄共 {total} 筆 ({args.output})")
+        except Exception as e:
+            failed.append(market)
+            kept = sum(1 for s in read_securities(args.output) if s.market == market)
+            print(f"警告: {EXCHANGES[market]} 清單更新失敗，保留現有 {kept} 筆紀錄: {e}", file=sys.stderr)
+
+    counts = {market: 0 for market in markets}
+    for s in read_securities(args.output):
+        if s.market in counts:
+            counts[s.market] += 1
+    empty = [market for market, count in counts.items() if not count]
+    if empty:
+        print(f"錯誤: 名錄中沒有任何 {', '.join(EXCHANGES[m] for m in empty)} 證券 ({args.output})", file=sys.stderr)
+    if empty or (failed and args.strict):
+        sys.exit(1)
+
+
+# 全域共用實例
+securities = SecuritiesMaster()
+
+
+if __name__ == '__main__':
+    main()
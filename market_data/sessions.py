@@ -0,0 +1,127 @@
+"""
+交易時段
+港股（HKEX）、日股（TSE）、美股（NYSE）、台股（TWSE）的常規交易時段與午休，
+以交易所當地時間判斷是否開盤、下一次開盤與收盤時間；
+僅排除週末，不含國定假日（假日期間視為開盤，只會多做幾次無變化的更新）
+"""
+
+from datetime import datetime, time as dtime, timedelta, timezone
+
+try:
+    from zoneinfo import ZoneInfo
+except ImportError:  # Python < 3.9
+    ZoneInfo = None
+
+
+class MarketSession:
+    """單一市場的交易時段"""
+
+    def __init__(self, market, tz_name, utc_offset_hours, periods):
+        self.market = market
+        self.tz_name = tz_name
+        self.periods = periods            # [(開始, 結束)]，當地時間
+        self.tz = self._load_tz(tz_name, utc_offset_hours)
+
+    @staticmethod
+    def _load_tz(tz_name, utc_offset_hours):
+        # 系統沒有時區資料庫時退回固定時差（美股夏令時間會差一小時）
+        if ZoneInfo is not None:
+            try:
+                return ZoneInfo(tz_name)
+            except Exception:
+                pass
+        return timezone(timedelta(hours=utc_offset_hours), tz_name)
+
+    def local(self, now=None):
+        now = now or datetime.now(timezone.utc)
+        if now.tzinfo is None:
+            now = now.replace(tzinfo=timezone.utc)
+        return now.astimezone(self.tz)
+
+    def state(self, now=None):
+        """回傳 'open'、'break'（午休）或 'closed'"""
+        local = self.local(now)
+        if local.weekday() >= 5:
+            return 'closed'
+        current = local.time()
+        for start, end in self.periods:
+            if start <= current < end:
+                return 'open'
+        if self.periods[0][0] <= current < self.periods[-1][1]:
+            return 'break'
+        return 'closed'
+
+    def is_open(self, now=None):
+        return self.state(now) == 'open'
+
+    def _boundaries(self, local):
+        """由當地時間起，依序產生未來 (時間, 是否為開盤) 的時段邊界"""
+        day = local.date()
+        for offset in range(8):
+            current_day = day + timedelta(days=offset)
+            if current_day.weekday() >= 5:
+                continue
+            for start, end in self.periods:
+                for boundary, is_start in ((start, True), (end, False)):
+                    moment = datetime.combine(current_day, boundary, tzinfo=self.tz)
+                    if moment > local:
+                        yield moment, is_start
+
+    def next_open(self, now=None):
+        """下一次開盤（含午休後開盤）的時間（UTC）"""
+        local = self.local(now)
+        for moment, is_start in self._boundaries(local):
+            if is_start:
+                return moment.astimezone(timezone.utc)
+        return None
+
+    def next_close(self, now=None):
+        """下一次收盤（含午休開始）的時間（UTC）"""
+        local = self.local(now)
+        for moment, is_start in self._boundaries(local):
+            if not is_start:
+                return moment.astimezone(timezone.utc)
+        return None
+
+    def previous_close(self, now=None):
+        """最近一次收盤（含午休開始）的時間（UTC），一週內沒有時回傳 None"""
+        local = self.local(now)
+        day = local.date()
+        for offset in range(8):
+            current_day = day - timedelta(days=offset)
+            if current_day.weekday() >= 5:
+                continue
+            for start, end in reversed(self.periods):
+                moment = datetime.combine(current_day, end, tzinfo=self.tz)
+                if moment <= local:
+                    return moment.astimezone(timezone.utc)
+        return None
+
+    def seconds_until_open(self, now=None):
+        """距離下一次開盤的秒數，開盤中為 0"""
+        if self.is_open(now):
+            return 0.0
+        now = now or datetime.now(timezone.utc)
+        if now.tzinfo is None:
+            now = now.replace(tzinfo=timezone.utc)
+        return max((self.next_open(now) - now).total_seconds(), 0.0)
+
+
+SESSIONS = {
+    'HK': MarketSession('HK', 'Asia/Hong_Kong', 8, [(dtime(9, 30), dtime(12, 0)), (dtime(13, 0), dtime(16, 0))]),
+    'JP': MarketSession('JP', 'Asia/Tokyo', 9, [(dtime(9, 0), dtime(11, 30)), (dtime(12, 30), dtime(15, 30))]),
+    'US': MarketSession('US', 'America/New_York', -5, [(dtime(9, 30), dtime(16, 0))]),
+    'TW': MarketSession('TW', 'Asia/Taipei', 8, [(dtime(9, 0), dtime(13, 30))])
+}
+
+
+def market_of_symbol(symbol):
+    """由 Yahoo 代號後綴判斷市場（無後綴視為美股）"""
+    symbol = str(symbol).upper()
+    if symbol.endswith('.HK'):
+        return 'HK'
+    if symbol.endswith('.T'):
+        return 'JP'
+    if symbol.endswith('.TW') or symbol.endswith('.TWO'):
+        return 'TW'
+    return 'US'
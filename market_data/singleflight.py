@@ -0,0 +1,64 @@
+"""
+請求合併（single-flight）
+相同鍵的並行請求只會有一個真正呼叫上游，其餘等待並共用同一結果
+"""
+
+import copy
+import threading
+
+
+class _Call:
+    """進行中的上游請求"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    以鍵合併並行請求
+    第一個呼叫者負責執行 fn，期間到達的相同鍵呼叫者等待其完成後取得結果副本；
+    若 fn 拋出例外，所有等待者都會收到同一例外
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.shared = 0  # 因合併而省下的上游請求數
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self.shared += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                leader = True
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return copy.copy(call.result)
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+    def in_flight(self):
+        """目前進行中的請求數"""
+        with self._lock:
+            return len(self._calls)
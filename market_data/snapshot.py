@@ -0,0 +1,174 @@
+"""
+啟動快照
+部署建置時把熱門股票（SNAPSHOT_SYMBOLS）的最新報價寫入 data/snapshot.json，隨 Vercel Functions 一起部署；
+冷啟動的函數在報價快取第一次未命中時才載入快照，不查詢報價的請求不需讀取快照，
+查詢熱門股票的第一個請求也不必先付一次上游查詢的延遲
+
+建置快照（網路失敗時保留舊檔，不中斷建置）：
+    python -m market_data.snapshot build [--symbols 0700.HK,7203.T] [--output 路徑]
+"""
+
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+from market_data.quote_cache import (
+    QUOTE_SETTLE_WINDOW, QUOTE_TTL, cache_key, market_quote_ttl, normalize_symbol, quote_cache
+)
+from market_data.sessions import SESSIONS, market_of_symbol
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_PATH = os.environ.get(
+    'SNAPSHOT_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'snapshot.json')
+)
+SNAPSHOT_MAX_AGE = float(os.environ.get('SNAPSHOT_MAX_AGE', str(24 * 3600)))  # 超過此秒數的快照不載入
+SNAPSHOT_MAX_SYMBOLS = int(os.environ.get('SNAPSHOT_MAX_SYMBOLS', '200'))
+# 快照收錄的熱門股票（Yahoo 代號，以逗號分隔）
+SNAPSHOT_SYMBOLS = os.environ.get('SNAPSHOT_SYMBOLS', ','.join([
+    '0700.HK', '9988.HK', '3690.HK', '1810.HK', '0005.HK', '1299.HK', '0939.HK', '0941.HK', '2318.HK', '0388.HK',
+    '7203.T', '6758.T', '8306.T', '9984.T', '6861.T', '9983.T', '7974.T', '6501.T', '8035.T', '9432.T',
+    '2330.TW', '2317.TW', '2454.TW', '2308.TW', '2382.TW', '2881.TW', '2882.TW', '2412.TW', '0050.TW', '0056.TW'
+]))
+SNAPSHOT_VERSION = 2
+
+_state = {'loaded': False, 'stats': None}
+_lock = threading.Lock()
+
+
+def quote_seed_ttl(symbol, generated_at, now=None):
+    """
+    快照報價寫入快取時的 TTL（秒）
+    快照在上次收盤（含等待收盤價確定的時間）之後產生、且目前仍未開盤時，有效至下一次開盤；
+    否則為一般 TTL 扣掉快照經過的時間，已過期時為負值（stale 保留期同樣從報價的實際時間起算）
+    """
+    now = now or datetime.now(timezone.utc)
+    age = now.timestamp() - generated_at
+    symbol = normalize_symbol(symbol)
+    session = None if '=' in symbol else SESSIONS.get(market_of_symbol(symbol))
+    if session is not None and not session.is_open(now):
+        last_close = session.previous_close(now)
+        if last_close is not None and generated_at >= last_close.timestamp() + QUOTE_SETTLE_WINDOW:
+            return market_quote_ttl(symbol, now)
+    return QUOTE_TTL - age
+
+
+def build_snapshot(symbols=None, fetch_quotes=None):
+    """
+    查詢最新報價並組成快照
+    對象為 symbols（省略時為 SNAPSHOT_SYMBOLS），最多 SNAPSHOT_MAX_SYMBOLS 個
+    """
+    if fetch_quotes is None:
+        from market_data.yahoo_quotes import fetch_quotes
+
+    if symbols is None:
+        symbols = SNAPSHOT_SYMBOLS.split(',')
+    targets = list(dict.fromkeys(normalize_symbol(s) for s in symbols if s.strip()))[:SNAPSHOT_MAX_SYMBOLS]
+
+    quotes = {}
+    if targets:
+        for symbol, quote in fetch_quotes(targets).items():
+            if quote and not quote.get('error'):
+                quotes[normalize_symbol(symbol)] = quote
+
+    return {
+        'version': SNAPSHOT_VERSION,
+        'generated_at': time.time(),
+        'quotes': quotes
+    }
+
+
+def write_snapshot(snapshot, path=SNAPSHOT_PATH):
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(snapshot, f, ensure_ascii=False, separators=(',', ':'))
+    os.replace(tmp_path, path)
+
+
+def load_snapshot(snapshot, now=None):
+    """
+    將快照填入報價快取，回傳載入統計
+    報價保留快照當時的存放時間（cacheAge 反映實際經過的秒數），到期與 stale 保留期都從報價的實際時間起算，
+    超過 TTL + stale 保留期的報價不載入
+    """
+    now = now or datetime.now(timezone.utc)
+    generated_at = snapshot['generated_at']
+    age = max(0.0, now.timestamp() - generated_at)
+
+    loaded = expired = 0
+    for symbol, quote in snapshot.get('quotes', {}).items():
+        ttl = quote_seed_ttl(symbol, generated_at, now)
+        if ttl + quote_cache.max_stale <= 0:
+            expired += 1
+            continue
+        quote_cache.set(cache_key('quote', symbol), quote, ttl=ttl, age=age)
+        loaded += 1
+    return {'quotes': loaded, 'expired': expired, 'age': round(age)}
+
+
+def warm_start(path=SNAPSHOT_PATH):
+    """
+    載入快照（每個行程只執行一次，並行的呼叫等待第一次載入完成）
+    快照不存在、格式不符或過舊時略過；回傳載入統計
+    """
+    if _state['loaded']:
+        return _state['stats']
+    with _lock:
+        if _state['loaded']:
+            return _state['stats']
+        started = time.perf_counter()
+        stats = {'loaded': False}
+        try:
+            with open(path, encoding='utf-8') as f:
+                snapshot = json.load(f)
+            age = time.time() - snapshot['generated_at']
+            if snapshot.get('version') != SNAPSHOT_VERSION:
+                logger.warning(f"啟動快照版本不符，略過 ({path})")
+            elif age > SNAPSHOT_MAX_AGE:
+                logger.info(f"啟動快照已過舊（{age / 3600:.1f} 小時），略過")
+            else:
+                stats.update(load_snapshot(snapshot), loaded=True)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning(f"啟動快照無法讀取 ({path}): {e}")
+        stats['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 2)
+        _state['stats'] = stats
+        _state['loaded'] = True
+        return stats
+
+
+def defer_warm_start(path=SNAPSHOT_PATH):
+    """冷啟動時登錄快照載入，延到報價快取第一次未命中時才讀取快照"""
+    quote_cache.load_on_first_miss(lambda: warm_start(path))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='建置啟動快照')
+    sub = parser.add_subparsers(dest='command', required=True)
+    builder = sub.add_parser('build', help='查詢最新報價並寫入快照檔')
+    builder.add_argument('--symbols', default=SNAPSHOT_SYMBOLS,
+                         help='收錄的 Yahoo 代號，以逗號分隔（預設為 SNAPSHOT_SYMBOLS）')
+    builder.add_argument('--output', default=SNAPSHOT_PATH)
+    args = parser.parse_args(argv)
+
+    symbols = args.symbols.split(',')
+    try:
+        snapshot = build_snapshot(symbols)
+    except Exception as e:
+        print(f"快照建置失敗，保留現有檔案: {e}")
+        return
+    if not snapshot['quotes'] and os.path.exists(args.output):
+        print("沒有取得任何報價，保留現有快照")
+        return
+    write_snapshot(snapshot, args.output)
+    print(f"快照: {len(snapshot['quotes'])} 筆報價 ({args.output})")
+
+
+if __name__ == '__main__':
+    main()
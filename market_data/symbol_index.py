@@ -0,0 +1,99 @@
+"""
+股票代號解析索引
+記錄使用者輸入對應到的 Yahoo 代號與市場，存放於本地 SQLite 檔案，重啟後仍然有效；
+查無資料的代號由 negative_cache 以 Yahoo 代號為鍵記錄，各端點共用
+"""
+
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+# Vercel Functions 只有 /tmp 可寫入，預設放在系統暫存目錄
+DEFAULT_INDEX_PATH = os.environ.get(
+    'SYMBOL_INDEX_PATH',
+    os.path.join(tempfile.gettempdir(), 'symbol_index.sqlite3')
+)
+RESOLUTION_TTL = float(os.environ.get('SYMBOL_RESOLUTION_TTL', str(30 * 86400)))  # 成功解析：30天
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS resolutions (
+    raw TEXT NOT NULL,
+    market TEXT NOT NULL,
+    resolved TEXT NOT NULL,
+    resolved_market TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (raw, market)
+)
+"""
+
+
+def _normalize(raw):
+    return str(raw).strip().upper()
+
+
+class SymbolIndex:
+    """
+    持久化的代號解析索引
+    """
+
+    def __init__(self, path=DEFAULT_INDEX_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        try:
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute(_SCHEMA)
+        except sqlite3.Error:
+            # 檔案無法寫入時退回記憶體模式，至少在本次執行期間有效
+            self.path = ':memory:'
+            self._conn = sqlite3.connect(':memory:', check_same_thread=False)
+            self._conn.execute(_SCHEMA)
+        self._conn.commit()
+
+    def lookup(self, raw, market):
+        """
+        查詢解析紀錄
+        回傳 {'symbol', 'market'}，無紀錄時回傳 None
+        """
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT resolved, resolved_market, updated_at FROM resolutions WHERE raw = ? AND market = ?',
+                (_normalize(raw), market)
+            ).fetchone()
+        if row is None:
+            return None
+
+        resolved, resolved_market, updated_at = row
+        if time.time() - updated_at > RESOLUTION_TTL:
+            self.forget(raw, market)
+            return None
+        return {'symbol': resolved, 'market': resolved_market}
+
+    def record_hit(self, raw, market, resolved, resolved_market):
+        """記錄成功解析的代號"""
+        self._write(raw, market, resolved, resolved_market)
+
+    def forget(self, raw, market):
+        with self._lock:
+            self._conn.execute(
+                'DELETE FROM resolutions WHERE raw = ? AND market = ?',
+                (_normalize(raw), market)
+            )
+            self._conn.commit()
+
+    def _write(self, raw, market, resolved, resolved_market):
+        try:
+            with self._lock:
+                self._conn.execute(
+                    'INSERT OR REPLACE INTO resolutions VALUES (?, ?, ?, ?, ?)',
+                    (_normalize(raw), market, resolved, resolved_market, time.time())
+                )
+                self._conn.commit()
+        except sqlite3.Error:
+            # 索引只是加速用途，寫入失敗不影響查詢結果
+            pass
+
+
+# 全域共用實例
+symbol_index = SymbolIndex()
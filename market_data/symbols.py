@@ -0,0 +1,95 @@
+"""
+股票代號標準化與市場判斷
+以預先編譯的規則表將使用者輸入轉為 Yahoo 標準代號、市場與幣別，
+結果以 LRU 快取保存，批次端點中重複的代號只需查表
+"""
+
+import os
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+SYMBOL_CACHE_SIZE = int(os.environ.get('SYMBOL_CACHE_SIZE', '8192'))
+
+# 市場 -> (Yahoo 後綴, 幣別)
+MARKETS = {
+    'HK': ('.HK', 'HKD'),
+    'JP': ('.T', 'JPY'),
+    'TW': ('.TW', 'TWD'),
+    'US': ('', 'USD')
+}
+
+SymbolInfo = namedtuple('SymbolInfo', ['raw', 'symbol', 'code', 'market', 'currency', 'ambiguous'])
+
+# 規則表：(正規表示式, 市場)，依序比對，第一個符合者生效；市場為 None 代表無法單從代號判斷
+# 交易所前綴與後綴明確指定市場；純數字依位數與前導0判斷
+_RULES = [
+    (re.compile(r'^(\d{1,5})\.HK$'), 'HK'),
+    (re.compile(r'^HK:(\d{1,5})$'), 'HK'),
+    (re.compile(r'^(\d{3}[0-9A-Z])\.(?:T|JP)$'), 'JP'),
+    (re.compile(r'^(?:TYO|TSE):(\d{3}[0-9A-Z])$'), 'JP'),
+    (re.compile(r'^(\d{4,6}[A-Z]?)\.TW$'), 'TW'),
+    (re.compile(r'^(\d{4,6}[A-Z]?\.TWO)$'), 'TW'),       # 上櫃股票保留 .TWO 後綴
+    (re.compile(r'^(?:TPE|TWSE):(\d{4,6}[A-Z]?)$'), 'TW'),
+    (re.compile(r'^(0\d{1,4})$'), 'HK'),                 # 以0開頭：港股（0700、00700）
+    (re.compile(r'^(\d{1,3})$'), 'HK'),                  # 1~3位數字：只有港股代號會這麼短
+    (re.compile(r'^(\d{5})$'), 'HK'),
+    (re.compile(r'^(\d{3}[A-Z])$'), 'JP'),               # 日股新式英數代號（如 130A）
+    (re.compile(r'^([1-9]\d{3})$'), None),               # 4位數字：港股、日股、台股皆有可能
+    # 6位數字：港股代號最多5位，改判為台股（006208 等 ETF、910322 等 TDR）；
+    # 舊版把所有以0開頭的數字視為港股，000001 會查成 0001.HK
+    (re.compile(r'^(\d{6})$'), 'TW'),
+    (re.compile(r'^([A-Z][A-Z0-9\-]{0,9}(?:\.[A-Z])?)$'), 'US'),  # 英文代號（如 AAPL、BRK.B）
+]
+
+_BARE_CODE = re.compile(r'^(?:\d+|\d{3}[A-Z])$')
+
+_MARKET_ALIASES = {'HK': 'HK', 'JP': 'JP', 'TW': 'TW', 'US': 'US', 'AUTO': None, '': None}
+
+
+def normalize_market(market):
+    """市場參數（hk、jp、auto 等，大小寫不拘）轉為 HK/JP/TW/US，auto 或空值回傳 None"""
+    if market is None:
+        return None
+    return _MARKET_ALIASES.get(str(market).strip().upper())
+
+
+def _canonical(code, market):
+    """組合市場的標準代號：港股補足4位數字，其他市場加上後綴"""
+    if market == 'HK':
+        code = f"{int(code):04d}"
+    if market == 'TW' and code.endswith('.TWO'):
+        return code, code[:-4]
+    return f"{code}{MARKETS[market][0]}", code
+
+
+@lru_cache(maxsize=SYMBOL_CACHE_SIZE)
+def _classify(raw, market, default_market):
+    text = raw.strip().upper()
+
+    # 指定市場時，純數字代號直接套用該市場格式
+    if market is not None:
+        if _BARE_CODE.match(text) and (market != 'HK' or text.isdigit()):
+            symbol, code = _canonical(text, market)
+            return SymbolInfo(raw, symbol, code, market, MARKETS[market][1], False)
+
+    for pattern, rule_market in _RULES:
+        match = pattern.match(text)
+        if match is None:
+            continue
+        resolved = rule_market or market or default_market
+        if resolved is None:
+            return SymbolInfo(raw, text, match.group(1), 'UNKNOWN', None, True)
+        symbol, code = _canonical(match.group(1), resolved)
+        return SymbolInfo(raw, symbol, code, resolved, MARKETS[resolved][1], rule_market is None)
+
+    return SymbolInfo(raw, text, text, 'UNKNOWN', None, False)
+
+
+def classify(raw, market=None, default_market=None):
+    """
+    標準化單一代號，回傳 SymbolInfo(raw, symbol, code, market, currency, ambiguous)
+    market 為呼叫端指定的市場（優先採用）；default_market 只用於無法判斷市場的代號（如 4 位數字），
+    此時 ambiguous 為 True；兩者皆未提供時 market 為 'UNKNOWN'
+    """
+    return _classify(str(raw), normalize_market(market), normalize_market(default_market))
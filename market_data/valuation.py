@@ -0,0 +1,193 @@
+"""
+多幣別持股估值
+一次查詢所有持股的報價與匯率（快取優先），以幣別代碼陣列向量化換算為台幣，
+取代前端逐筆呼叫 convertToTWD 的計算方式
+"""
+
+import numpy as np
+
+from market_data.fx import FALLBACK_TWD_RATES, FX_CURRENCIES, fx_provider, fx_symbol
+from market_data.quote_cache import cache_key, quote_cache
+from market_data.symbols import classify
+from market_data.yahoo_quotes import fetch_quotes
+
+FX_SYMBOLS = {currency: fx_symbol(currency) for currency in FX_CURRENCIES}
+
+MARKET_CURRENCIES = {'US': 'USD', 'TW': 'TWD', 'HK': 'HKD', 'JP': 'JPY'}
+MARKET_SUFFIXES = {'HK': '.HK', 'JP': '.T', 'TW': '.TW'}
+MARKETS = ('US', 'TW', 'HK', 'JP')
+
+
+def to_yahoo_symbol(symbol, market):
+    """前端的股票代號轉為 Yahoo 代號（港股補足4位數字）"""
+    symbol = str(symbol).strip().upper()
+    if market not in MARKET_SUFFIXES:
+        return symbol
+    return classify(symbol, market=market).symbol
+
+
+def lookup_quotes(yahoo_symbols):
+    """
+    取得多個代號的現價：先查快取，未命中的一次批次查詢
+    回傳 {代號: 現價}，查無者不列入
+    """
+    prices = {}
+    missing = []
+    for symbol in dict.fromkeys(yahoo_symbols):
+        cached = quote_cache.get(cache_key('quote', symbol))
+        if cached is not None:
+            prices[symbol] = cached.get('currentPrice')
+        else:
+            missing.append(symbol)
+
+    if missing:
+        for symbol, quote in fetch_quotes(missing).items():
+            if quote.get('error'):
+                continue
+            quote_cache.set(cache_key('quote', symbol), quote)
+            prices[symbol] = quote.get('currentPrice')
+
+    return {symbol: price for symbol, price in prices.items() if price}
+
+
+def resolve_twd_rates(quoted_prices, overrides=None):
+    """
+    由報價結果組出台幣匯率表 {幣別: 匯率}
+    優先順序：請求指定 > 即時匯率 > 匯率序列最新一日 > 備用匯率
+    """
+    rates = {'TWD': 1.0}
+    sources = {'TWD': 'fixed'}
+    for currency, symbol in FX_SYMBOLS.items():
+        if overrides and overrides.get(f'{currency}_TWD'):
+            rates[currency] = float(overrides[f'{currency}_TWD'])
+            sources[currency] = 'request'
+            continue
+        if quoted_prices.get(symbol):
+            rates[currency] = float(quoted_prices[symbol])
+            sources[currency] = 'live'
+            continue
+
+        stored = fx_provider.rate(currency)
+        if stored:
+            rates[currency] = stored
+            sources[currency] = 'history'
+        else:
+            rates[currency] = FALLBACK_TWD_RATES[currency]
+            sources[currency] = 'fallback'
+    return rates, sources
+
+
+def value_holdings(holdings, rates=None):
+    """
+    估值所有持股
+    holdings 為持股清單（symbol、market、currency、totalQuantity、totalCost，可選 currentPrice、realizedPnL）；
+    rates 可指定 {USD_TWD, HKD_TWD, JPY_TWD} 覆寫匯率；
+    已出清的持股不查報價、不列入明細，但已實現損益仍計入總計
+    """
+    holdings = list(holdings)
+    is_open = np.array([float(h.get('totalQuantity') or 0) > 0 for h in holdings], dtype=bool)
+
+    # 報價與匯率合併為一次查詢
+    yahoo_symbols = [to_yahoo_symbol(h.get('symbol'), h.get('market')) for h in holdings]
+    need_quotes = [
+        s for s, h, held in zip(yahoo_symbols, holdings, is_open)
+        if held and not h.get('currentPrice')
+    ]
+    need_fx = [fx for currency, fx in FX_SYMBOLS.items() if not (rates and rates.get(f'{currency}_TWD'))]
+    quoted = lookup_quotes(need_quotes + need_fx) if need_quotes or need_fx else {}
+    twd_rates, rate_sources = resolve_twd_rates(quoted, rates)
+
+    # 欄位陣列
+    currencies = [h.get('currency') or MARKET_CURRENCIES.get(h.get('market'), 'TWD') for h in holdings]
+    currency_list = sorted(set(currencies))
+    currency_codes = np.array([currency_list.index(c) for c in currencies], dtype=np.intp)
+    # 不支援的幣別以原始金額計算（與前端一致）
+    rate_table = np.array([twd_rates.get(c, 1.0) for c in currency_list], dtype=np.float64)
+
+    # 已出清的持股數量、成本與市值皆為0，只保留已實現損益
+    quantity = np.array([float(h.get('totalQuantity') or 0) for h in holdings], dtype=np.float64)
+    quantity = np.where(is_open, quantity, 0.0)
+    cost = np.array([float(h.get('totalCost') or 0) for h in holdings], dtype=np.float64)
+    cost = np.where(is_open, cost, 0.0)
+    realized = np.array([float(h.get('realizedPnL') or 0) for h in holdings], dtype=np.float64)
+    price = np.array([
+        float(h.get('currentPrice') or quoted.get(s) or np.nan) if held else 0.0
+        for h, s, held in zip(holdings, yahoo_symbols, is_open)
+    ], dtype=np.float64)
+
+    # 無報價時以平均成本計價（與前端一致）
+    has_price = ~np.isnan(price)
+    average_cost = np.divide(cost, quantity, out=np.zeros_like(cost), where=quantity > 0)
+    price = np.where(has_price, price, average_cost)
+
+    market_value = quantity * price
+    unrealized = market_value - cost
+    return_rate = np.divide(unrealized, cost, out=np.zeros_like(cost), where=cost > 0) * 100
+
+    fx = rate_table[currency_codes] if len(holdings) else np.zeros(0)
+    market_value_twd = market_value * fx
+    cost_twd = cost * fx
+    unrealized_twd = unrealized * fx
+    realized_twd = realized * fx
+
+    rows = []
+    for i, holding in enumerate(holdings):
+        if not is_open[i]:
+            continue
+        rows.append({
+            'symbol': holding.get('symbol'),
+            'market': holding.get('market'),
+            'currency': currencies[i],
+            'quantity': float(quantity[i]),
+            'avgCost': round(float(average_cost[i]), 4),
+            'currentPrice': float(price[i]),
+            'priceSource': 'quote' if has_price[i] else 'cost',
+            'marketValue': round(float(market_value[i]), 2),
+            'totalCost': round(float(cost[i]), 2),
+            'unrealizedPnL': round(float(unrealized[i]), 2),
+            'realizedPnL': round(float(realized[i]), 2),
+            'returnRate': round(float(return_rate[i]), 2),
+            'fxRate': float(fx[i]),
+            'marketValueTWD': round(float(market_value_twd[i]), 2),
+            'totalCostTWD': round(float(cost_twd[i]), 2),
+            'unrealizedPnLTWD': round(float(unrealized_twd[i]), 2),
+            'realizedPnLTWD': round(float(realized_twd[i]), 2)
+        })
+
+    # 各市場台幣總計
+    market_codes = np.array([
+        MARKETS.index(h.get('market')) if h.get('market') in MARKETS else len(MARKETS)
+        for h in holdings
+    ], dtype=np.intp)
+    n_groups = len(MARKETS) + 1
+    by_market = {}
+    sums = {
+        'marketValueTWD': np.bincount(market_codes, weights=market_value_twd, minlength=n_groups),
+        'totalCostTWD': np.bincount(market_codes, weights=cost_twd, minlength=n_groups),
+        'unrealizedPnLTWD': np.bincount(market_codes, weights=unrealized_twd, minlength=n_groups),
+        'realizedPnLTWD': np.bincount(market_codes, weights=realized_twd, minlength=n_groups)
+    }
+    for i, market in enumerate(MARKETS):
+        by_market[market] = {field: round(float(values[i]), 2) for field, values in sums.items()}
+
+    total_value = float(market_value_twd.sum())
+    total_cost = float(cost_twd.sum())
+    totals = {
+        'marketValueTWD': round(total_value, 2),
+        'totalCostTWD': round(total_cost, 2),
+        'unrealizedPnLTWD': round(float(unrealized_twd.sum()), 2),
+        'realizedPnLTWD': round(float(realized_twd.sum()), 2),
+        'returnRate': round((total_value - total_cost) / total_cost * 100, 2) if total_cost > 0 else 0
+    }
+    for market in MARKETS:
+        by_market[market]['distribution'] = round(
+            by_market[market]['marketValueTWD'] / total_value * 100, 1
+        ) if total_value > 0 else 0
+
+    return {
+        'holdings': rows,
+        'totals': totals,
+        'byMarket': by_market,
+        'rates': {f'{c}_TWD': twd_rates[c] for c in FX_SYMBOLS},
+        'rateSources': {c: rate_sources[c] for c in FX_SYMBOLS}
+    }
@@ -0,0 +1,264 @@
+"""
+Yahoo Finance 報價轉接層
+以 v7 multi-quote 端點分批查詢多個股票（需先取得 cookie 與 crumb），
+未回傳的股票再以 v8 chart 端點逐一補查；
+解析函數與傳輸分離，可直接以錄製的 JSON 回應測試
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from market_data.http_client import YAHOO_QUERY_BASE, http_client
+from market_data.negative_cache import ERROR_MESSAGES, NOT_FOUND, listing_reason, negative_cache, negative_result
+from market_data.singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+QUOTE_CHUNK_SIZE = int(os.environ.get('YAHOO_QUOTE_CHUNK_SIZE', '50'))  # 每次 multi-quote 請求的股票數
+CHART_FALLBACK_WORKERS = 8      # chart 補查的並行數
+MULTI_QUOTE_COOLDOWN = 600      # multi-quote 被拒（401/403）後停用的秒數
+YAHOO_COOKIE_URL = os.environ.get('YAHOO_COOKIE_URL', 'https://fc.yahoo.com')  # 取得 cookie 的網址
+CRUMB_RETRY_INTERVAL = 300      # 取得 crumb 失敗後的重試間隔（秒）
+
+_multi_quote_state = {'disabled_until': 0}
+_multi_quote_lock = threading.Lock()
+
+
+def build_quote(symbol, current_price, previous_close, high, low, open_price, volume):
+    """組合統一的報價格式（與 api/index.py 的 action=price 回應相同）"""
+    current_price = current_price or 0
+    previous_close = previous_close or 0
+    change = current_price - previous_close if current_price and previous_close else 0
+    change_percent = (change / previous_close * 100) if previous_close else 0
+    return {
+        'symbol': symbol,
+        'currentPrice': current_price,
+        'change': change,
+        'changePercent': round(change_percent, 2),
+        'high': high or 0,
+        'low': low or 0,
+        'open': open_price or 0,
+        'previousClose': previous_close,
+        'volume': volume or 0,
+        'timestamp': datetime.now().isoformat()
+    }
+
+
+def parse_quote_response(data):
+    """解析 v7 multi-quote 回應，回傳 {symbol: 報價}；沒有價格的項目略過"""
+    quotes = {}
+    for item in (data.get('quoteResponse') or {}).get('result') or []:
+        symbol = item.get('symbol')
+        if not symbol or item.get('regularMarketPrice') is None:
+            continue
+        quotes[symbol.upper()] = build_quote(
+            symbol,
+            item.get('regularMarketPrice'),
+            item.get('regularMarketPreviousClose'),
+            item.get('regularMarketDayHigh'),
+            item.get('regularMarketDayLow'),
+            item.get('regularMarketOpen'),
+            item.get('regularMarketVolume')
+        )
+    return quotes
+
+
+def parse_chart_response(data, symbol):
+    """解析 v8 chart 回應，無資料時回傳錯誤"""
+    if not data.get('chart') or not data['chart'].get('result'):
+        return {'error': '無法獲取股價數據'}
+
+    meta = data['chart']['result'][0]['meta']
+    return build_quote(
+        meta.get('symbol', symbol),
+        meta.get('regularMarketPrice', 0),
+        meta.get('previousClose', 0),
+        meta.get('regularMarketDayHigh', 0),
+        meta.get('regularMarketDayLow', 0),
+        meta.get('regularMarketOpen', 0),
+        meta.get('regularMarketVolume', 0)
+    )
+
+
+def describe_error(e):
+    """將上游例外轉換為 API 錯誤訊息"""
+    if isinstance(e, urllib.error.HTTPError):
+        return f'HTTP錯誤: {e.code} {e.reason}'
+    if isinstance(e, urllib.error.URLError):
+        return f'網路錯誤: {str(e)}'
+    if isinstance(e, json.JSONDecodeError):
+        return '無法解析API回應'
+    return f'未知錯誤: {str(e)}'
+
+
+def fetch_chart_quote(symbol, fetch_json=None):
+    """
+    以 chart 端點查詢單一股票
+    錯誤結果的 retryable 表示是否為暫時性錯誤（網路、限流等），而非上游明確查無資料
+    """
+    fetch_json = fetch_json or http_client.get_json
+    try:
+        data = fetch_json(f"{YAHOO_QUERY_BASE}/v8/finance/chart/{symbol}")
+    except urllib.error.HTTPError as e:
+        if e.code != 404:
+            return {'error': describe_error(e), 'retryable': True}
+        # Yahoo 的 404 說明不論打錯或下市都是 symbol may be delisted，一律記為查無此代號
+        negative_cache.record(symbol, NOT_FOUND)
+        return {'error': describe_error(e), 'retryable': False, 'reason': NOT_FOUND}
+    except Exception as e:
+        return {'error': describe_error(e), 'retryable': True}
+
+    # 代號仍查得到但已沒有價格與交易時間：視為已下市
+    results = (data.get('chart') or {}).get('result') or []
+    reason = listing_reason(results[0].get('meta')) if results else None
+    if reason is not None:
+        negative_cache.record(symbol, reason)
+        return {'error': ERROR_MESSAGES[reason], 'retryable': False, 'reason': reason}
+    return parse_chart_response(data, symbol)
+
+
+def cookie_header(headers):
+    """由回應的 Set-Cookie 標頭組成 Cookie 標頭值（只保留名稱與值）"""
+    if headers is None:
+        return ''
+    values = headers.get_all('Set-Cookie') if hasattr(headers, 'get_all') else headers.get_list('set-cookie')
+    return '; '.join(value.split(';', 1)[0].strip() for value in values or [] if '=' in value)
+
+
+class YahooCrumb:
+    """
+    v7 multi-quote 端點需要的 cookie 與 crumb
+    先由 fc.yahoo.com 取得 cookie，再以 cookie 查詢 getcrumb；取得後所有請求共用，
+    端點回應 401/403 時以 invalidate() 作廢並重新取得
+    """
+
+    def __init__(self, get=None):
+        self._get = get
+        self._auth = None            # (cookie, crumb)
+        self._retry_after = 0
+        self._lock = threading.Lock()
+        self._flight = SingleFlight()
+
+    def get(self):
+        """回傳 (cookie, crumb)；無法取得時回傳 None（重試間隔內不再嘗試）"""
+        with self._lock:
+            if self._auth is not None or time.monotonic() < self._retry_after:
+                return self._auth
+        return self._flight.do('crumb', self._load)
+
+    def invalidate(self, auth):
+        """作廢被拒絕的 crumb（其他執行緒已換新時不影響）"""
+        with self._lock:
+            if self._auth == auth:
+                self._auth = None
+
+    def _load(self):
+        try:
+            auth = self._fetch()
+        except Exception as e:
+            logger.warning(f"無法取得 Yahoo crumb: {e}")
+            auth = None
+        with self._lock:
+            self._auth = auth
+            if auth is None:
+                self._retry_after = time.monotonic() + CRUMB_RETRY_INTERVAL
+        return auth
+
+    def _fetch(self):
+        get = self._get or http_client.get
+        # fc.yahoo.com 通常回應 404，但會附上 cookie
+        cookie = cookie_header(get(YAHOO_COOKIE_URL).headers)
+        if not cookie:
+            logger.warning("Yahoo 未回傳 cookie，無法取得 crumb")
+            return None
+        response = get(f"{YAHOO_QUERY_BASE}/v1/test/getcrumb", headers={'Cookie': cookie})
+        crumb = response.body.decode(errors='replace').strip()
+        if response.status != 200 or not crumb or '<' in crumb or ' ' in crumb:
+            logger.warning(f"Yahoo crumb 查詢失敗 ({response.status})")
+            return None
+        return cookie, crumb
+
+
+def fetch_multi_quotes(symbols, fetch_json=None, chunk_size=QUOTE_CHUNK_SIZE, crumb=None):
+    """
+    以 multi-quote 端點分批查詢，回傳成功取得的 {symbol: 報價}
+    請求附上 cookie 與 crumb，被拒（401/403）時重新取得 crumb 再試一次；
+    仍被拒絕時暫停使用一段時間，避免每次都多付一次失敗請求
+    """
+    fetch_json = fetch_json or http_client.get_json
+    crumb = crumb or yahoo_crumb
+    quotes = {}
+    if time.monotonic() < _multi_quote_state['disabled_until']:
+        return quotes
+    auth = crumb.get()
+    if auth is None:
+        return quotes
+
+    for i in range(0, len(symbols), chunk_size):
+        chunk = symbols[i:i + chunk_size]
+        for attempt in range(2):
+            try:
+                data = fetch_json(
+                    f"{YAHOO_QUERY_BASE}/v7/finance/quote",
+                    params={'symbols': ','.join(chunk), 'crumb': auth[1]},
+                    headers={'Cookie': auth[0]}
+                )
+                quotes.update(parse_quote_response(data))
+            except urllib.error.HTTPError as e:
+                if e.code not in (401, 403):
+                    logger.warning(f"multi-quote 查詢失敗: {e}")
+                    break
+                crumb.invalidate(auth)
+                auth = crumb.get() if attempt == 0 else None
+                if auth is not None:
+                    continue
+                with _multi_quote_lock:
+                    _multi_quote_state['disabled_until'] = time.monotonic() + MULTI_QUOTE_COOLDOWN
+                logger.warning(f"multi-quote 端點拒絕存取 ({e.code})，暫停使用 {MULTI_QUOTE_COOLDOWN} 秒")
+                return quotes
+            except Exception as e:
+                logger.warning(f"multi-quote 查詢失敗: {e}")
+            break
+    return quotes
+
+
+def fetch_quotes(symbols, fetch_json=None, chunk_size=QUOTE_CHUNK_SIZE):
+    """
+    查詢多個股票報價，回傳 {symbol: 報價或 {'error': ...}}
+    先以 multi-quote 分批查詢，遺漏的股票再以 chart 端點並行補查；
+    負向快取中確認查無資料的股票直接回傳錯誤，不查詢上游
+    """
+    results = {}
+    unique = list(dict.fromkeys(symbols))
+    negatives = negative_cache.get_many(unique)
+    for symbol in [s for s in unique if s.upper() in negatives]:
+        results[symbol] = negative_result(symbol, negatives[symbol.upper()])
+        unique.remove(symbol)
+    fetched = fetch_multi_quotes(unique, fetch_json, chunk_size) if unique else {}
+
+    missing = []
+    for symbol in unique:
+        quote = fetched.get(symbol.upper())
+        if quote is not None:
+            results[symbol] = quote
+        else:
+            missing.append(symbol)
+
+    if len(missing) == 1:
+        results[missing[0]] = fetch_chart_quote(missing[0], fetch_json)
+    elif missing:
+        with ThreadPoolExecutor(max_workers=min(CHART_FALLBACK_WORKERS, len(missing))) as executor:
+            for symbol, quote in zip(missing, executor.map(lambda s: fetch_chart_quote(s, fetch_json), missing)):
+                results[symbol] = quote
+
+    return results
+
+
+# 全域共用實例
+yahoo_crumb = YahooCrumb()
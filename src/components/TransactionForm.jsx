@@ -3,6 +3,7 @@ import { useForm } from 'react-hook-form';
 import { useNavigate } from 'react-router-dom';
 import { ArrowLeft, TrendingUp, TrendingDown, Info, AlertTriangle } from 'lucide-react';
 import StockNameLookup from './StockNameLookup';
+import apiManager from '../services/apiManager';
 import { 
   validateSellTransaction, 
   createEnhancedTransaction,
@@ -26,6 +27,7 @@ const TransactionForm = ({ market }) => {
   const [stockInfo, setStockInfo] = useState(null);
   const [holdings, setHoldings] = useState(null);
   const [sellValidation, setSellValidation] = useState(null);
+  const [suggestions, setSuggestions] = useState([]);
 
   const marketConfig = {
     US: { currency: 'USD', placeholder: 'AAPL', name: '美股', flag: '🇺🇸' },
@@ -84,6 +86,22 @@ const TransactionForm = ({ market }) => {
     }
   }, [watchedSymbol, watchedType, watchedQuantity]);
 
+  // 股票代碼自動完成（港股、日股、台股使用本地證券名錄搜尋）
+  useEffect(() => {
+    if (!watchedSymbol || market === 'US') {
+      setSuggestions([]);
+      return;
+    }
+
+    const timeoutId = setTimeout(() => {
+      apiManager.searchSymbols(watchedSymbol, market)
+        .then(setSuggestions)
+        .catch(() => setSuggestions([]));
+    }, 150);
+
+    return () => clearTimeout(timeoutId);
+  }, [watchedSymbol, market]);
+
   // 表單提交處理
   const onSubmit = async (data) => {
     try {
@@ -249,7 +267,16 @@ const TransactionForm = ({ market }) => {
                   {...register('symbol', validationRules.symbol)}
                   placeholder={`例如: ${config.placeholder}`}
                   className={errors.symbol ? 'border-destructive' : ''}
+                  list="symbol-suggestions"
+                  autoComplete="off"
                 />
+                <datalist id="symbol-suggestions">
+                  {suggestions.map((item) => (
+                    <option key={item.symbol} value={item.symbol.split('.')[0]}>
+                      {item.name}
+                    </option>
+                  ))}
+                </datalist>
                 {errors.symbol && (
                   <p className="text-sm text-destructive">{errors.symbol.message}</p>
                 )}
@@ -513,12 +513,97 @@ class APIManager {
     }
   }
 
+  // 港股/日股批次股價查詢 (單次Vercel Functions調用)
+  // symbols 為 `${market}:${symbol}` 格式（如 HK:9988、JP:7203），回傳結果以相同字串為鍵
+  async getBatchYahooStockPrices(symbols) {
+    const prices = {};
+    const missing = [];
+
+    for (const symbol of symbols) {
+      const cached = this.getCache(`yahoo_price_${symbol}`);
+      if (cached) {
+        prices[symbol] = cached;
+      } else {
+        missing.push(symbol);
+      }
+    }
+
+    if (missing.length === 0) return prices;
+
+    const response = await fetch(
+      `/api?symbols=${encodeURIComponent(missing.join(','))}&action=price`
+    );
+
+    if (!response.ok) {
+      throw new Error(`HTTP ${response.status}: ${response.statusText}`);
+    }
+
+    const data = await response.json();
+
+    if (data.error) {
+      throw new Error(data.error);
+    }
+
+    for (const symbol of missing) {
+      const item = data.results?.[symbol];
+      if (!item || !item.success) {
+        prices[symbol] = { error: item?.error || '無法獲取股價數據' };
+        continue;
+      }
+
+      const stockData = {
+        symbol: item.symbol,
+        currentPrice: item.currentPrice,
+        change: item.change,
+        changePercent: item.changePercent,
+        high: item.high,
+        low: item.low,
+        open: item.open,
+        previousClose: item.previousClose,
+        timestamp: Date.now()
+      };
+
+      this.setCache(`yahoo_price_${symbol}`, stockData, this.cacheTimeout.stockPrice);
+      prices[symbol] = stockData;
+    }
+
+    return prices;
+  }
+
   // 批次股價更新
   async updateMultipleStockPrices(stocks) {
     const results = [];
     const errors = [];
 
-    for (const stock of stocks) {
+    // 港股/日股合併為一次批次查詢
+    const yahooStocks = stocks.filter(stock => stock.market === 'HK' || stock.market === 'JP');
+    const otherStocks = stocks.filter(stock => stock.market !== 'HK' && stock.market !== 'JP');
+
+    if (yahooStocks.length > 0) {
+      try {
+        // 以市場加代號區分（港股與日股可能有相同的4位數字代號）
+        const marketSymbol = stock => `${stock.market}:${stock.symbol}`;
+        const prices = await this.getBatchYahooStockPrices(
+          [...new Set(yahooStocks.map(marketSymbol))]
+        );
+
+        for (const stock of yahooStocks) {
+          const price = prices[marketSymbol(stock)];
+          if (price && !price.error) {
+            results.push({ ...stock, ...price, success: true });
+          } else {
+            errors.push({ ...stock, error: price?.error || '無法獲取股價數據', success: false });
+          }
+        }
+      } catch (error) {
+        console.error('港股/日股批次查詢失敗:', error);
+        for (const stock of yahooStocks) {
+          errors.push({ ...stock, error: error.message, success: false });
+        }
+      }
+    }
+
+    for (const stock of otherStocks) {
       try {
         const price = await this.getStockPrice(stock.symbol, stock.market);
         results.push({ ...stock, ...price, success: true });
@@ -530,6 +615,75 @@ class APIManager {
     return { results, errors };
   }
 
+  // 伺服器端持股計算 (FIFO、平均成本、已實現/未實現損益)
+  async calculatePortfolioHoldings(transactions, prices = {}) {
+    const response = await fetch(`${this.YAHOO_FINANCE_API_BASE}/portfolio/holdings`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ transactions, prices })
+    });
+
+    if (!response.ok) {
+      throw new Error(`HTTP ${response.status}: ${response.statusText}`);
+    }
+
+    const data = await response.json();
+
+    if (data.error) {
+      throw new Error(data.error);
+    }
+
+    return data;
+  }
+
+  // 後端一次完成所有持股的台幣估值（匯率與報價批次查詢）
+  async calculatePortfolioValuation(holdings, prices = {}, rates = null) {
+    const body = { holdings, prices };
+    if (rates) {
+      body.rates = rates;
+    }
+
+    const response = await fetch(`${this.YAHOO_FINANCE_API_BASE}/portfolio/valuation`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify(body)
+    });
+
+    if (!response.ok) {
+      throw new Error(`HTTP ${response.status}: ${response.statusText}`);
+    }
+
+    const data = await response.json();
+
+    if (data.error) {
+      throw new Error(data.error);
+    }
+
+    return data;
+  }
+
+  // 股票代號搜尋（本地證券名錄，供輸入時自動完成）
+  async searchSymbols(query, market = null, limit = 10) {
+    const params = new URLSearchParams({ q: query, limit: String(limit) });
+    if (market) {
+      params.set('market', market);
+    }
+
+    const response = await fetch(`/api/search?${params.toString()}`);
+
+    if (!response.ok) {
+      throw new Error(`HTTP ${response.status}: ${response.statusText}`);
+    }
+
+    const data = await response.json();
+
+    if (data.error) {
+      throw new Error(data.error);
+    }
+
+    return data.results;
+  }
+
   // 清除緩存
   clearCache() {
     this.cache.clear();
@@ -0,0 +1,15 @@
+"""
+測試共用設定
+快取與資料檔改放在暫存目錄，測試不讀寫正式環境的檔案
+"""
+
+import os
+import sys
+import tempfile
+
+_DATA_DIR = tempfile.mkdtemp(prefix='market_data_tests_')
+os.environ.setdefault('NEGATIVE_CACHE_PATH', os.path.join(_DATA_DIR, 'negative_cache.sqlite3'))
+os.environ.setdefault('OHLCV_DATA_DIR', os.path.join(_DATA_DIR, 'ohlcv'))
+os.environ.setdefault('FX_DATA_DIR', os.path.join(_DATA_DIR, 'fx_series'))
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
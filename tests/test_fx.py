@@ -0,0 +1,74 @@
+"""匯率序列：只補抓缺少的區段，下載期間不阻塞其他查詢"""
+
+import threading
+from datetime import date
+
+from market_data.fx import FXProvider
+
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+def chart(start, end):
+    """start..end（日期序號）每天一筆的 chart 回應，匯率為日期序號的末兩位"""
+    days = range(start, end + 1)
+    return {'chart': {'result': [{
+        'timestamp': [(day - _EPOCH_ORDINAL) * 86400 for day in days],
+        'indicators': {'quote': [{'close': [30 + day % 100 / 100 for day in days]}]}
+    }]}}
+
+
+class FakeChart:
+    def __init__(self, gate=None):
+        self.calls = []
+        self.gate = gate
+
+    def __call__(self, url, params=None):
+        start = params['period1'] // 86400 + _EPOCH_ORDINAL
+        end = params['period2'] // 86400 + _EPOCH_ORDINAL - 1
+        self.calls.append((url.rsplit('/', 1)[-1], start, end))
+        if self.gate is not None and url.endswith('USDTWD=X'):
+            assert self.gate.wait(5)
+        return chart(start, min(end, date.today().toordinal()))
+
+
+def test_earlier_start_fetches_only_missing_head(tmp_path):
+    fetch = FakeChart()
+    provider = FXProvider(data_dir=str(tmp_path), fetch_json=fetch)
+    today = date.today().toordinal()
+
+    provider.ensure('USD', today - 10)
+    provider.ensure('USD', today - 40)
+
+    assert fetch.calls == [('USDTWD=X', today - 10, today), ('USDTWD=X', today - 40, today - 11)]
+    series = provider.ensure('USD', today - 40)
+    assert series.days[0] == today - 40 and series.days[-1] == today
+    assert len(fetch.calls) == 2
+
+
+def test_series_is_reloaded_from_disk(tmp_path):
+    today = date.today().toordinal()
+    FXProvider(data_dir=str(tmp_path), fetch_json=FakeChart()).ensure('JPY', today - 5)
+
+    fetch = FakeChart()
+    provider = FXProvider(data_dir=str(tmp_path), fetch_json=fetch)
+    provider._checked['JPY'] = float('inf')
+    assert provider.rate('JPY', date.fromordinal(today - 3)) == 30 + (today - 3) % 100 / 100
+    assert fetch.calls == []
+
+
+def test_download_does_not_block_other_currencies(tmp_path):
+    gate = threading.Event()
+    fetch = FakeChart(gate)
+    provider = FXProvider(data_dir=str(tmp_path), fetch_json=fetch)
+    today = date.today().toordinal()
+
+    worker = threading.Thread(target=provider.ensure, args=('USD', today - 10))
+    worker.start()
+    while not fetch.calls:
+        threading.Event().wait(0.01)
+
+    # USD 仍在下載中，HKD 的查詢不需等待
+    assert len(provider.ensure('HKD', today - 10)) == 11
+    gate.set()
+    worker.join(5)
+    assert len(provider.ensure('USD')) == 11
@@ -0,0 +1,147 @@
+"""連線池、流量控制與斷路器（以本地模擬伺服器測試）"""
+
+import json
+import threading
+import time
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from market_data import governor as governor_module
+from market_data.governor import CircuitOpenError, TokenBucket, UpstreamGovernor
+from market_data.http_client import HTTPClient
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'   # keep-alive
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.hits[self.path] = server.hits.get(self.path, 0) + 1
+            server.clients.add(self.client_address)
+            server.active += 1
+            server.peak = max(server.peak, server.active)
+            hits = server.hits[self.path]
+        try:
+            if self.path == '/slow':
+                time.sleep(0.05)
+            if self.path == '/throttled' and hits == 1:
+                self.reply(429, {'error': 'Too Many Requests'}, {'Retry-After': '0'})
+            elif self.path == '/flaky' and hits <= 2:
+                self.reply(503, {'error': 'Service Unavailable'})
+            elif self.path == '/down':
+                self.reply(500, {'error': 'Internal Server Error'})
+            elif self.path == '/missing':
+                self.reply(404, {'error': 'Not Found'})
+            else:
+                self.reply(200, {'path': self.path, 'hits': hits})
+        finally:
+            with server.lock:
+                server.active -= 1
+
+    def reply(self, status, payload, headers=None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    httpd.daemon_threads = True
+    httpd.lock = threading.Lock()
+    httpd.hits = {}
+    httpd.clients = set()
+    httpd.active = 0
+    httpd.peak = 0
+    thread = threading.Thread(target=httpd.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True)
+    thread.start()
+    httpd.base = f'http://127.0.0.1:{httpd.server_address[1]}'
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def governor(monkeypatch):
+    monkeypatch.setattr(governor_module, 'backoff_delay', lambda attempt: 0)
+    return UpstreamGovernor(bucket=TokenBucket(rate=1000, burst=1000, min_rate=100), max_retries=2)
+
+
+@pytest.fixture
+def client(governor):
+    client = HTTPClient(max_per_host=2, timeout=5, http2=False, governor=governor)
+    yield client
+    client.close()
+
+
+def test_keep_alive_connection_is_reused(server, client):
+    for _ in range(5):
+        assert client.get_json(f'{server.base}/ok')['path'] == '/ok'
+    assert len(server.clients) == 1
+
+
+def test_pool_limits_connections_per_host(server, client):
+    with ThreadPoolExecutor(max_workers=6) as executor:
+        results = list(executor.map(lambda _: client.get_json(f'{server.base}/slow'), range(12)))
+
+    assert len(results) == 12
+    assert server.peak <= 2
+    assert len(server.clients) <= 2
+
+
+def test_retries_5xx_and_429(server, client, governor):
+    assert client.get_json(f'{server.base}/flaky')['hits'] == 3
+    assert client.get_json(f'{server.base}/throttled')['hits'] == 2
+
+    stats = governor.status()
+    assert stats['retries'] == 3
+    assert stats['throttled'] == 1
+    assert stats['rate'] < 1000
+
+
+def test_client_errors_are_not_retried(server, client, governor):
+    with pytest.raises(urllib.error.HTTPError) as e:
+        client.get_json(f'{server.base}/missing')
+    assert e.value.code == 404
+    assert server.hits['/missing'] == 1
+    assert governor.status()['breakers']['127.0.0.1/missing']['state'] == 'closed'
+
+
+def test_circuit_breaker_opens_per_endpoint(server, client, governor):
+    for _ in range(4):
+        with pytest.raises(urllib.error.URLError):
+            client.get_json(f'{server.base}/down')
+    hits = server.hits['/down']
+
+    # 斷路後不再送出請求，直接拒絕
+    with pytest.raises(CircuitOpenError):
+        client.get_json(f'{server.base}/down')
+    assert server.hits['/down'] == hits
+    assert governor.status()['breakers']['127.0.0.1/down']['state'] == 'open'
+
+    # 其他端點不受影響
+    assert client.get_json(f'{server.base}/ok')['path'] == '/ok'
+
+
+def test_breaker_half_open_probe_closes_on_success(server, client, governor):
+    breaker = governor.breaker('127.0.0.1/ok')
+    breaker.cooldown = 0.05
+    for _ in range(breaker.min_requests):
+        breaker.record(True)
+    assert breaker.state == 'open'
+
+    time.sleep(0.06)
+    assert client.get_json(f'{server.base}/ok')['path'] == '/ok'
+    assert breaker.state == 'closed'
@@ -0,0 +1,114 @@
+"""增量持股帳本：新增、修改、刪除與驗證模式"""
+
+import random
+
+import pytest
+
+from market_data.ledger import PortfolioLedger
+
+
+def trade(id, symbol, side, quantity, price, date):
+    return {'id': id, 'symbol': symbol, 'type': side, 'quantity': quantity, 'price': price,
+            'date': date, 'market': 'TW', 'currency': 'TWD'}
+
+
+def test_buy_sell_updates_only_affected_symbol():
+    ledger = PortfolioLedger([trade('b1', '2330', 'BUY', 10, 500, '2024-01-02')])
+
+    assert ledger.apply({'action': 'buy', 'transaction': trade('b2', '0050', 'BUY', 20, 100, '2024-01-03')}) == ['0050']
+    assert ledger.apply({'action': 'sell', 'transaction': trade('s1', '2330', 'SELL', 4, 600, '2024-01-04')}) == ['2330']
+
+    holdings = ledger.holdings()
+    assert holdings['2330']['totalQuantity'] == 6
+    assert holdings['2330']['realizedPnL'] == 400
+    assert holdings['0050']['totalCost'] == 2000
+    assert ledger.verify() == []
+
+
+def test_backdated_trade_is_inserted_in_order():
+    ledger = PortfolioLedger([
+        trade('b1', '2330', 'BUY', 10, 500, '2024-01-05'),
+        trade('s1', '2330', 'SELL', 5, 600, '2024-01-10'),
+    ])
+    ledger.apply({'action': 'buy', 'transaction': trade('b0', '2330', 'BUY', 5, 400, '2024-01-01')})
+
+    holding = ledger.holdings()['2330']
+    # 較早的 b0 先被賣出
+    assert holding['realizedPnL'] == 1000
+    assert [lot['transactionId'] for lot in holding['availablePositions']] == ['b1']
+    assert ledger.verify() == []
+
+
+def test_edit_and_delete():
+    ledger = PortfolioLedger([
+        trade('b1', '2330', 'BUY', 10, 500, '2024-01-02'),
+        trade('b2', '0050', 'BUY', 10, 100, '2024-01-03'),
+    ])
+
+    affected = ledger.apply({'action': 'edit', 'transaction': trade('b2', '2317', 'BUY', 10, 100, '2024-01-03')})
+    assert affected == ['0050', '2317']
+    assert set(ledger.holdings(include_closed=True)) == {'2330', '2317'}
+
+    assert ledger.apply({'action': 'delete', 'id': 'b1'}) == ['2330']
+    assert set(ledger.holdings(include_closed=True)) == {'2317'}
+    assert ledger.verify() == []
+
+    with pytest.raises(ValueError):
+        ledger.apply({'action': 'delete', 'id': 'b1'})
+
+
+def test_rejected_sell_leaves_no_entry():
+    ledger = PortfolioLedger()
+    with pytest.raises(ValueError):
+        ledger.apply({'action': 'sell', 'transaction': trade('s1', '2330', 'SELL', 1, 600, '2024-01-02')})
+
+    assert ledger.holdings(include_closed=True) == {}
+    assert ledger.transactions() == []
+
+
+def test_invalid_edit_restores_original():
+    ledger = PortfolioLedger([
+        trade('b1', '2330', 'BUY', 10, 500, '2024-01-02'),
+        trade('s1', '2330', 'SELL', 5, 600, '2024-01-03'),
+    ])
+    with pytest.raises(ValueError):
+        ledger.apply({'action': 'edit', 'transaction': trade('s1', '2330', 'SELL', 50, 600, '2024-01-03')})
+
+    assert ledger.holdings()['2330']['totalQuantity'] == 5
+    assert ledger.verify() == []
+
+
+def test_duplicate_id_rejected():
+    ledger = PortfolioLedger([trade('b1', '2330', 'BUY', 10, 500, '2024-01-02')])
+    with pytest.raises(ValueError):
+        ledger.apply({'action': 'buy', 'transaction': trade('b1', '2330', 'BUY', 1, 500, '2024-01-03')})
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_random_events_match_full_recalculation(seed):
+    rng = random.Random(seed)
+    ledger = PortfolioLedger()
+    ids = []
+    for i in range(150):
+        roll = rng.random()
+        if ids and roll < 0.15:
+            ledger.apply({'action': 'delete', 'id': ids.pop(rng.randrange(len(ids)))})
+            continue
+        side = 'BUY' if roll < 0.6 else 'SELL'
+        transaction = trade(f't{i}', rng.choice(['2330', '0050', '2317']), side,
+                            rng.choice([1, 10, 100]), round(rng.uniform(10, 900), 2),
+                            f'2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}')
+        if ids and roll > 0.9:
+            transaction['id'] = rng.choice(ids)
+            action = 'edit'
+        else:
+            action = side.lower()
+        try:
+            ledger.apply({'action': action, 'transaction': transaction})
+        except ValueError:
+            continue
+        if action != 'edit':
+            ids.append(transaction['id'])
+
+    assert ledger.verify() == []
+    assert all(lots.transactions for lots in ledger._symbols.values())
@@ -0,0 +1,101 @@
+"""每日淨值：本地K線與匯率序列的小型案例"""
+
+import threading
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import pytest
+
+from market_data.fx import FXProvider
+from market_data.nav import compute_daily_nav
+from market_data.ohlcv import BAR_DTYPE, OHLCVStore
+
+
+def utc(text):
+    return int(datetime.fromisoformat(text).replace(tzinfo=timezone.utc).timestamp())
+
+
+# yfinance 日K時間為交易所當地午夜（台股為前一天 16:00 UTC，美股冬令時間為 05:00 UTC）
+CLOSES = {
+    '2330.TW': [('2024-01-07T16:00', 510.0), ('2024-01-08T16:00', 520.0), ('2024-01-09T16:00', 530.0)],
+    'AAPL': [('2024-01-08T05:00', 99.0), ('2024-01-09T05:00', 101.0), ('2024-01-10T05:00', 102.0)],
+}
+
+# 匯率日K為倫敦午夜（冬令時間 00:00 UTC）
+USD_CHART = {'chart': {'result': [{
+    'timestamp': [utc('2024-01-08T00:00'), utc('2024-01-09T00:00'), utc('2024-01-10T00:00')],
+    'indicators': {'quote': [{'close': [30.0, 31.0, 32.0]}]}
+}]}}
+
+TRANSACTIONS = [
+    {'id': 'b1', 'symbol': '2330', 'type': 'BUY', 'quantity': 10, 'price': 500, 'date': '2024-01-08',
+     'market': 'TW', 'currency': 'TWD'},
+    {'id': 'b2', 'symbol': 'AAPL', 'type': 'BUY', 'quantity': 1, 'price': 100, 'date': '2024-01-09',
+     'market': 'US', 'currency': 'USD'},
+    {'id': 's1', 'symbol': '2330', 'type': 'SELL', 'quantity': 5, 'price': 530, 'date': '2024-01-10',
+     'market': 'TW', 'currency': 'TWD'},
+]
+
+
+def fake_history(symbol, interval, start, end=None):
+    bars = np.zeros(len(CLOSES[symbol]), dtype=BAR_DTYPE)
+    bars['ts'] = [utc(ts) for ts, _ in CLOSES[symbol]]
+    bars['close'] = [close for _, close in CLOSES[symbol]]
+    return bars
+
+
+@pytest.fixture
+def provider(tmp_path):
+    return FXProvider(data_dir=str(tmp_path / 'fx'), fetch_json=lambda url, params=None: USD_CHART)
+
+
+def test_daily_nav_with_fx(tmp_path, provider):
+    store = OHLCVStore(str(tmp_path / 'ohlcv'), fetch_history=fake_history)
+    nav = compute_daily_nav(TRANSACTIONS, start='2024-01-08', end='2024-01-10',
+                            store=store, provider=provider, refresh=True)
+
+    assert nav['dates'] == ['2024-01-08', '2024-01-09', '2024-01-10']
+    assert nav['refreshing'] == []
+    assert nav['totals']['marketValueTWD'] == [5100.0, 8331.0, 5914.0]
+    assert nav['totals']['totalCostTWD'] == [5000.0, 8100.0, 5700.0]
+    assert nav['totals']['unrealizedPnLTWD'] == [100.0, 231.0, 214.0]
+    assert nav['totals']['realizedPnLTWD'] == [0.0, 0.0, 150.0]
+    assert nav['byMarket']['US']['marketValueTWD'] == [0.0, 3131.0, 3264.0]
+    assert all(s['hasPrices'] for s in nav['symbols'])
+
+
+def test_weekends_are_skipped(tmp_path, provider):
+    store = OHLCVStore(str(tmp_path / 'ohlcv'), fetch_history=fake_history)
+    nav = compute_daily_nav(TRANSACTIONS, start='2024-01-05', end='2024-01-10',
+                            store=store, provider=provider, refresh=True)
+    assert nav['dates'] == ['2024-01-05', '2024-01-08', '2024-01-09', '2024-01-10']
+
+
+def test_missing_bars_are_filled_in_background(tmp_path, provider):
+    release = threading.Event()
+
+    def slow_history(symbol, interval, start, end=None):
+        release.wait(5)
+        return fake_history(symbol, interval, start, end)
+
+    store = OHLCVStore(str(tmp_path / 'ohlcv'), fetch_history=slow_history)
+    nav = compute_daily_nav(TRANSACTIONS, start='2024-01-08', end='2024-01-10', store=store, provider=provider)
+
+    # 請求本身不等待下載，沒有收盤價的股票以成本計價
+    assert sorted(nav['refreshing']) == ['2330.TW', 'AAPL']
+    assert nav['totals']['marketValueTWD'] == nav['totals']['totalCostTWD']
+
+    release.set()
+    deadline = time.monotonic() + 5
+    while store._pending and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    nav = compute_daily_nav(TRANSACTIONS, start='2024-01-08', end='2024-01-10', store=store, provider=provider)
+    assert nav['refreshing'] == []
+    assert nav['totals']['marketValueTWD'] == [5100.0, 8331.0, 5914.0]
+
+
+def test_end_before_start_rejected(provider):
+    with pytest.raises(ValueError):
+        compute_daily_nav(TRANSACTIONS, start='2024-01-10', end='2024-01-08', provider=provider)
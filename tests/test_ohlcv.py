@@ -0,0 +1,78 @@
+"""OHLCV 資料庫：日K的日期對應與缺口下載"""
+
+from datetime import datetime, timezone
+
+import numpy as np
+import pytest
+
+from market_data.ohlcv import BAR_DTYPE, OHLCVStore, bar_bounds
+
+
+def utc(text):
+    return int(datetime.fromisoformat(text).replace(tzinfo=timezone.utc).timestamp())
+
+
+# yfinance 日K時間為交易所當地午夜：台股 (UTC+8) 為前一天 16:00 UTC，美股 (UTC-5) 為當日 05:00 UTC
+DAILY_BARS = {
+    '2330.TW': ['2024-01-07T16:00', '2024-01-08T16:00', '2024-01-09T16:00', '2024-01-10T16:00'],
+    'AAPL': ['2024-01-08T05:00', '2024-01-09T05:00', '2024-01-10T05:00', '2024-01-11T05:00'],
+}
+
+
+def make_bars(timestamps):
+    bars = np.zeros(len(timestamps), dtype=BAR_DTYPE)
+    bars['ts'] = [utc(ts) for ts in timestamps]
+    bars['close'] = np.arange(1, len(timestamps) + 1)
+    return bars
+
+
+class FakeHistory:
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, symbol, interval, start, end=None):
+        self.calls.append((symbol, start, end))
+        bars = make_bars(DAILY_BARS[symbol])
+        keep = bars['ts'] >= start
+        if end is not None:
+            keep &= bars['ts'] < end
+        return bars[keep]
+
+
+@pytest.fixture
+def store(tmp_path):
+    return OHLCVStore(str(tmp_path), fetch_history=FakeHistory())
+
+
+@pytest.mark.parametrize('symbol', ['2330.TW', 'AAPL'])
+def test_daily_range_matches_trading_days(store, symbol):
+    bars = store.range(symbol, '1d', start='2024-01-09', end='2024-01-10', refresh=False)
+    assert len(bars) == 0
+
+    store.update(symbol, '1d', '2024-01-08')
+    bars = store.range(symbol, '1d', start='2024-01-09', end='2024-01-10', refresh=False)
+
+    # 兩端的交易日都包含在內，且不多取前後一天
+    assert list(bars['close']) == [2.0, 3.0]
+
+
+def test_first_day_bar_is_downloaded_for_utc_plus_market(store):
+    bars = store.range('2330.TW', '1d', start='2024-01-08')
+
+    assert bars['ts'][0] == utc('2024-01-07T16:00')
+    assert store._fetch_history.calls[0][1] == utc('2024-01-08T00:00') - 12 * 3600
+
+
+def test_intraday_bounds_are_not_shifted():
+    assert bar_bounds('2024-01-08', '2024-01-09', '5m') == (utc('2024-01-08T00:00'), utc('2024-01-09T00:00'))
+    assert bar_bounds(None, None, '1d') == (None, None)
+
+
+def test_backfill_fetches_only_missing_head(store):
+    store.update('AAPL', '1d', '2024-01-10')
+    store.update('AAPL', '1d', '2024-01-08')
+
+    symbol, start, end = store._fetch_history.calls[-1]
+    assert end == utc('2024-01-10T05:00')
+    assert start == utc('2024-01-08T00:00') - 12 * 3600
+    assert len(store.bars('AAPL')) == 4
@@ -0,0 +1,105 @@
+"""向量化 FIFO 與逐筆 FIFO 的比對"""
+
+import random
+from collections import deque
+
+import numpy as np
+import pytest
+
+from market_data.portfolio import TransactionTable, calculate_all_holdings, compute_fifo
+
+
+def naive_fifo(transactions):
+    """逐筆 FIFO（超賣部分忽略），回傳 {股票: (股數, 成本, 已實現成本, 已實現金額, 剩餘批次)}"""
+    result = {}
+    ordered = sorted(transactions, key=lambda t: (t['symbol'], t['date']))
+    for t in ordered:
+        quantity, cost, realized_cost, proceeds, lots = result.get(t['symbol'], (0.0, 0.0, 0.0, 0.0, deque()))
+        if t['type'] == 'BUY':
+            lots.append([t['quantity'], t['price'], t['id']])
+            quantity += t['quantity']
+            cost += t['quantity'] * t['price']
+        else:
+            remaining = min(t['quantity'], quantity)
+            while remaining > 1e-12 and lots:
+                matched = min(remaining, lots[0][0])
+                realized_cost += matched * lots[0][1]
+                proceeds += matched * t['price']
+                quantity -= matched
+                cost -= matched * lots[0][1]
+                lots[0][0] -= matched
+                remaining -= matched
+                if lots[0][0] <= 1e-12:
+                    lots.popleft()
+        result[t['symbol']] = (quantity, cost, realized_cost, proceeds, lots)
+    return result
+
+
+def random_transactions(rng, count, symbols):
+    """隨機交易：多個股票交錯、同日多筆，賣出數量可能超過持有數量"""
+    transactions = []
+    for i in range(count):
+        side = 'BUY' if rng.random() < 0.55 else 'SELL'
+        transactions.append({
+            'id': f't{i}',
+            'symbol': rng.choice(symbols),
+            'type': side,
+            'quantity': float(rng.choice([1, 5, 10, 100, 250, 1000]) * rng.randint(1, 3)),
+            'price': round(rng.uniform(5, 500), 2),
+            'date': f'2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}',
+            'currency': 'TWD',
+            'market': 'TW'
+        })
+    return transactions
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_vectorized_fifo_matches_naive(seed):
+    rng = random.Random(seed)
+    transactions = random_transactions(rng, rng.randint(1, 200), ['2330', '0050', 'AAPL', '0700'])
+
+    table = TransactionTable.from_records(transactions)
+    fifo = compute_fifo(table)
+    expected = naive_fifo(transactions)
+
+    assert list(table.symbols) == sorted(expected)
+    for code, symbol in enumerate(table.symbols):
+        quantity, cost, realized_cost, proceeds, lots = expected[symbol]
+        assert fifo['quantity'][code] == pytest.approx(quantity, abs=1e-6)
+        assert fifo['cost'][code] == pytest.approx(cost, abs=1e-6)
+        assert fifo['realized_cost'][code] == pytest.approx(realized_cost, abs=1e-6)
+        assert fifo['realized_proceeds'][code] == pytest.approx(proceeds, abs=1e-6)
+
+        open_lots = {
+            table.ids[i]: fifo['lot_remaining'][i]
+            for i in np.flatnonzero((table.codes == code) & (fifo['lot_remaining'] > 1e-9))
+        }
+        assert open_lots == pytest.approx({lot[2]: lot[0] for lot in lots if lot[0] > 1e-9})
+
+
+def test_oversell_is_not_offset_by_later_buys():
+    transactions = [
+        {'id': 'b1', 'symbol': '2330', 'type': 'BUY', 'quantity': 10, 'price': 100, 'date': '2024-01-01'},
+        {'id': 's1', 'symbol': '2330', 'type': 'SELL', 'quantity': 15, 'price': 120, 'date': '2024-01-02'},
+        {'id': 'b2', 'symbol': '2330', 'type': 'BUY', 'quantity': 5, 'price': 110, 'date': '2024-01-03'},
+        {'id': 'b3', 'symbol': '0050', 'type': 'BUY', 'quantity': 7, 'price': 50, 'date': '2024-01-02'},
+    ]
+    holdings = calculate_all_holdings(transactions, prices={'2330': 130})
+
+    assert holdings['2330']['totalQuantity'] == 5
+    assert holdings['2330']['totalCost'] == 550
+    assert holdings['2330']['realizedPnL'] == 200
+    assert holdings['2330']['unrealizedPnL'] == 100
+    assert [lot['transactionId'] for lot in holdings['2330']['availablePositions']] == ['b2']
+    assert holdings['0050']['totalQuantity'] == 7
+
+
+def test_closed_positions_only_with_include_closed():
+    transactions = [
+        {'id': 'b1', 'symbol': '7203', 'type': 'BUY', 'quantity': 100, 'price': 2000, 'date': '2024-01-01'},
+        {'id': 's1', 'symbol': '7203', 'type': 'SELL', 'quantity': 100, 'price': 2100, 'date': '2024-02-01'},
+    ]
+    assert calculate_all_holdings(transactions) == {}
+    closed = calculate_all_holdings(transactions, include_closed=True)['7203']
+    assert closed['totalQuantity'] == 0
+    assert closed['realizedPnL'] == 10000
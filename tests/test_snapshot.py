@@ -0,0 +1,55 @@
+"""啟動快照：只收錄熱門股票，第一次未命中時才載入"""
+
+import time
+
+import pytest
+
+from market_data import snapshot
+from market_data.quote_cache import TTLCache, cache_key
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = TTLCache(100, 60, max_stale=600)
+    monkeypatch.setattr(snapshot, 'quote_cache', cache)
+    monkeypatch.setattr(snapshot, '_state', {'loaded': False, 'stats': None})
+    return cache
+
+
+def fake_fetch(symbols):
+    return {s: {'symbol': s, 'currentPrice': 100.0} for s in symbols}
+
+
+def test_build_uses_configured_symbols_only():
+    built = snapshot.build_snapshot(fetch_quotes=fake_fetch)
+
+    assert sorted(built['quotes']) == sorted(snapshot.SNAPSHOT_SYMBOLS.split(','))
+    assert 'resolutions' not in built
+    assert list(snapshot.build_snapshot(['7203.t', ' ', '7203.T'], fetch_quotes=fake_fetch)['quotes']) == ['7203.T']
+
+
+def test_snapshot_is_loaded_on_first_miss(tmp_path, cache):
+    path = str(tmp_path / 'snapshot.json')
+    built = snapshot.build_snapshot(['0700.HK'], fetch_quotes=fake_fetch)
+    built['generated_at'] = time.time() - 5
+    snapshot.write_snapshot(built, path)
+
+    snapshot.defer_warm_start(path)
+    assert not snapshot._state['loaded']
+    assert cache.stats()['size'] == 0
+
+    quote = cache.get(cache_key('quote', '0700.HK'))
+    assert quote['currentPrice'] == 100.0
+    assert snapshot._state['stats']['quotes'] == 1
+    assert cache.stats()['misses'] == 0
+
+    # 之後的未命中不再讀取快照
+    assert cache.get(cache_key('quote', '7203.T')) is None
+    assert cache.stats()['misses'] == 1
+
+
+def test_missing_snapshot_is_ignored(tmp_path, cache):
+    snapshot.defer_warm_start(str(tmp_path / 'missing.json'))
+
+    assert cache.get(cache_key('quote', '0700.HK')) is None
+    assert snapshot._state['stats']['loaded'] is False
@@ -0,0 +1,85 @@
+"""持股估值：模擬報價與匯率下的台幣換算與總計"""
+
+import pytest
+
+from market_data import valuation
+from market_data.quote_cache import TTLCache
+
+QUOTES = {'AAPL': 200.0, '0700.HK': 300.0, '7203.T': 2500.0, 'USDTWD=X': 32.0, 'HKDTWD=X': 4.0}
+
+HOLDINGS = [
+    {'symbol': 'AAPL', 'market': 'US', 'currency': 'USD', 'totalQuantity': 10, 'totalCost': 1500,
+     'realizedPnL': 100},
+    {'symbol': '700', 'market': 'HK', 'currency': 'HKD', 'totalQuantity': 100, 'totalCost': 25000},
+    {'symbol': '7203', 'market': 'JP', 'currency': 'JPY', 'totalQuantity': 100, 'totalCost': 200000},
+    {'symbol': '2330', 'market': 'TW', 'currency': 'TWD', 'totalQuantity': 1000, 'totalCost': 500000,
+     'currentPrice': 600},
+    # 已出清：不查報價、不列入明細，已實現損益仍計入總計
+    {'symbol': '2317', 'market': 'TW', 'currency': 'TWD', 'totalQuantity': 0, 'totalCost': 0,
+     'realizedPnL': 20000},
+]
+
+
+class FakeFX:
+    def rate(self, currency, day=None):
+        return {'JPY': 0.2}.get(currency)
+
+
+@pytest.fixture
+def requested(monkeypatch):
+    requested = []
+
+    def fake_fetch_quotes(symbols):
+        requested.extend(symbols)
+        return {s: {'currentPrice': QUOTES[s]} if s in QUOTES else {'error': '查無資料'} for s in symbols}
+
+    monkeypatch.setattr(valuation, 'fetch_quotes', fake_fetch_quotes)
+    monkeypatch.setattr(valuation, 'quote_cache', TTLCache(100, 60))
+    monkeypatch.setattr(valuation, 'fx_provider', FakeFX())
+    return requested
+
+
+def test_values_holdings_in_twd(requested):
+    result = valuation.value_holdings(HOLDINGS)
+
+    assert sorted(requested) == ['0700.HK', '7203.T', 'AAPL', 'HKDTWD=X', 'JPYTWD=X', 'USDTWD=X']
+    assert result['rates'] == {'USD_TWD': 32.0, 'HKD_TWD': 4.0, 'JPY_TWD': 0.2}
+    assert result['rateSources'] == {'USD': 'live', 'HKD': 'live', 'JPY': 'history'}
+
+    rows = {row['symbol']: row for row in result['holdings']}
+    assert list(rows) == ['AAPL', '700', '7203', '2330']
+    assert rows['AAPL']['marketValueTWD'] == 64000
+    assert rows['AAPL']['unrealizedPnLTWD'] == 16000
+    assert rows['700']['marketValueTWD'] == 120000
+    assert rows['7203']['marketValueTWD'] == 50000
+    assert rows['2330']['priceSource'] == 'quote'
+    assert rows['2330']['marketValueTWD'] == 600000
+
+    totals = result['totals']
+    assert totals['marketValueTWD'] == 834000
+    assert totals['totalCostTWD'] == 48000 + 100000 + 40000 + 500000
+    assert totals['realizedPnLTWD'] == 3200 + 20000
+    assert result['byMarket']['TW']['realizedPnLTWD'] == 20000
+    assert result['byMarket']['TW']['marketValueTWD'] == 600000
+
+
+def test_rate_overrides_and_cost_fallback(requested):
+    holdings = [{'symbol': 'MSFT', 'market': 'US', 'currency': 'USD', 'totalQuantity': 2, 'totalCost': 600}]
+    result = valuation.value_holdings(holdings, rates={'USD_TWD': 30})
+
+    assert 'USDTWD=X' not in requested
+    assert result['rateSources']['USD'] == 'request'
+    row = result['holdings'][0]
+    assert row['priceSource'] == 'cost'
+    assert row['marketValueTWD'] == 18000
+    assert result['totals']['unrealizedPnLTWD'] == 0
+
+
+def test_only_closed_holdings(requested):
+    closed = [h for h in HOLDINGS if not h['totalQuantity']]
+    result = valuation.value_holdings(closed)
+
+    assert result['holdings'] == []
+    assert '2317.TW' not in requested
+    assert result['totals']['marketValueTWD'] == 0
+    assert result['totals']['realizedPnLTWD'] == 20000
@@ -0,0 +1,187 @@
+"""Yahoo 報價解析與 chart 補查（以錄製的 JSON 回應測試）"""
+
+import io
+import json
+import os
+import urllib.error
+from email.message import Message
+
+import pytest
+
+from market_data import yahoo_quotes
+from market_data.negative_cache import DELISTED, NOT_FOUND, NegativeCache
+from market_data.http_client import HTTPResponse
+from market_data.yahoo_quotes import YahooCrumb, parse_chart_response, parse_quote_response
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+
+def load(name):
+    with open(os.path.join(FIXTURES, name), encoding='utf-8') as f:
+        return json.load(f)
+
+
+def recorded_response(url, recorded):
+    headers = Message()
+    for name, value in recorded['headers']:
+        headers[name] = value
+    return HTTPResponse(url, recorded['status'], recorded['reason'], headers, recorded['body'].encode())
+
+
+class RecordedCrumb:
+    """依錄製的 fc.yahoo.com 與 getcrumb 回應回答；crumbs 為依序回傳的 crumb 回應名稱"""
+
+    def __init__(self, crumbs=('crumb',)):
+        self.recorded = load('yahoo_crumb.json')
+        self.crumbs = list(crumbs)
+        self.calls = []
+
+    def __call__(self, url, params=None, headers=None):
+        self.calls.append((url, headers))
+        if url.endswith('/v1/test/getcrumb'):
+            assert headers['Cookie'].startswith('A3=d=AQABBKmLcWcC')
+            name = self.crumbs.pop(0) if len(self.crumbs) > 1 else self.crumbs[0]
+            return recorded_response(url, self.recorded[name])
+        return recorded_response(url, self.recorded['cookie'])
+
+
+class RecordedYahoo:
+    """
+    依 URL 回傳錄製的回應；charts 為 {代號: 檔名}，未列出的代號回應 404
+    multi-quote 只接受 accepted_crumbs 中的 crumb，否則回應 401
+    """
+
+    def __init__(self, quote='v7_quote.json', charts=None, accepted_crumbs=('k3yY6mP.Qf1',)):
+        self.quote = quote
+        self.charts = charts or {}
+        self.accepted_crumbs = accepted_crumbs
+        self.calls = []
+        self.quote_params = []
+
+    def __call__(self, url, params=None, headers=None):
+        self.calls.append(url)
+        if '/v7/finance/quote' in url:
+            self.quote_params.append((params, headers))
+            if params.get('crumb') not in self.accepted_crumbs or 'A3=' not in headers.get('Cookie', ''):
+                body = b'{"finance":{"error":{"code":"Unauthorized","description":"Invalid Crumb"}}}'
+                raise urllib.error.HTTPError(url, 401, 'Unauthorized', {}, io.BytesIO(body))
+            return load(self.quote)
+        symbol = url.rsplit('/', 1)[-1]
+        if symbol not in self.charts:
+            body = json.dumps(load('v8_chart_not_found.json')).encode()
+            raise urllib.error.HTTPError(url, 404, 'Not Found', {}, io.BytesIO(body))
+        return load(self.charts[symbol])
+
+
+@pytest.fixture(autouse=True)
+def isolated_state(monkeypatch):
+    monkeypatch.setattr(yahoo_quotes, 'negative_cache', NegativeCache(':memory:'))
+    monkeypatch.setattr(yahoo_quotes, '_multi_quote_state', {'disabled_until': 0})
+    monkeypatch.setattr(yahoo_quotes, 'yahoo_crumb', YahooCrumb(get=RecordedCrumb()))
+
+
+def test_parse_quote_response_skips_items_without_price():
+    quotes = parse_quote_response(load('v7_quote.json'))
+
+    assert sorted(quotes) == ['2330.TW', 'AAPL']
+    tsmc = quotes['2330.TW']
+    assert tsmc['currentPrice'] == 1085.0
+    assert tsmc['previousClose'] == 1070.0
+    assert tsmc['change'] == 15.0
+    assert tsmc['changePercent'] == 1.4
+    assert (tsmc['high'], tsmc['low'], tsmc['open'], tsmc['volume']) == (1090.0, 1075.0, 1080.0, 21804325)
+
+
+def test_parse_chart_response():
+    quote = parse_chart_response(load('v8_chart_0700.HK.json'), '0700.HK')
+
+    assert quote['symbol'] == '0700.HK'
+    assert quote['currentPrice'] == 417.2
+    assert quote['previousClose'] == 414.0
+    assert quote['changePercent'] == 0.77
+    assert parse_chart_response(load('v8_chart_not_found.json'), 'XXXX')['error']
+
+
+def test_fetch_quotes_falls_back_to_chart():
+    upstream = RecordedYahoo(charts={'0700.HK': 'v8_chart_0700.HK.json'})
+    results = yahoo_quotes.fetch_quotes(['2330.TW', 'AAPL', '0700.HK'], fetch_json=upstream)
+
+    assert results['2330.TW']['currentPrice'] == 1085.0
+    assert results['AAPL']['currentPrice'] == 255.27
+    assert results['0700.HK']['currentPrice'] == 417.2
+    # multi-quote 一次，只有遺漏的股票走 chart
+    assert sum('/v7/' in url for url in upstream.calls) == 1
+    assert [url for url in upstream.calls if '/v8/' in url] == [
+        f'{yahoo_quotes.YAHOO_QUERY_BASE}/v8/finance/chart/0700.HK'
+    ]
+
+
+def test_fetch_quotes_chunks_multi_quote():
+    upstream = RecordedYahoo(charts={'0700.HK': 'v8_chart_0700.HK.json'})
+    yahoo_quotes.fetch_quotes(['2330.TW', 'AAPL', '0700.HK'], fetch_json=upstream, chunk_size=2)
+    assert sum('/v7/' in url for url in upstream.calls) == 2
+
+
+def test_not_found_and_delisted_are_cached():
+    upstream = RecordedYahoo(quote='v8_chart_not_found.json', charts={'2498.TW': 'v8_chart_delisted.json'})
+    results = yahoo_quotes.fetch_quotes(['9999.TW', '2498.TW'], fetch_json=upstream)
+
+    assert results['9999.TW']['reason'] == NOT_FOUND
+    assert results['2498.TW']['reason'] == DELISTED
+    assert not results['9999.TW']['retryable']
+
+    # 第二次查詢直接由負向快取回答，不再呼叫上游
+    upstream.calls.clear()
+    again = yahoo_quotes.fetch_quotes(['9999.TW', '2498.TW'], fetch_json=upstream)
+    assert upstream.calls == []
+    assert again['2498.TW']['error']
+
+
+def test_multi_quote_sends_cookie_and_crumb():
+    upstream = RecordedYahoo()
+    yahoo_quotes.fetch_quotes(['2330.TW', 'AAPL'], fetch_json=upstream, chunk_size=1)
+    yahoo_quotes.fetch_quotes(['2330.TW'], fetch_json=upstream)
+
+    # crumb 只取得一次，之後的請求共用
+    assert [url for url, _ in yahoo_quotes.yahoo_crumb._get.calls] == [
+        yahoo_quotes.YAHOO_COOKIE_URL, f'{yahoo_quotes.YAHOO_QUERY_BASE}/v1/test/getcrumb'
+    ]
+    assert len(upstream.quote_params) == 3
+    for params, headers in upstream.quote_params:
+        assert params['crumb'] == 'k3yY6mP.Qf1'
+        assert headers['Cookie'] == 'A3=d=AQABBKmLcWcCEH6Ov1eNdqN0b4n8Rz2w5fIFEgEBAQHdcmd7Z9wR0iMA_eMAAA&S=AQAAAjdS7d1uDJtVc0rWbHWpqWQ'
+    assert not any('/v8/' in url for url in upstream.calls)
+
+
+def test_expired_crumb_is_refreshed_on_401(monkeypatch):
+    crumb = RecordedCrumb(crumbs=('crumb', 'crumb_refreshed'))
+    monkeypatch.setattr(yahoo_quotes, 'yahoo_crumb', YahooCrumb(get=crumb))
+    upstream = RecordedYahoo(accepted_crumbs=('Zx9Tq2LwB7e',))
+    results = yahoo_quotes.fetch_quotes(['2330.TW', 'AAPL'], fetch_json=upstream)
+
+    assert results['AAPL']['currentPrice'] == 255.27
+    assert [params['crumb'] for params, _ in upstream.quote_params] == ['k3yY6mP.Qf1', 'Zx9Tq2LwB7e']
+    assert not any('/v8/' in url for url in upstream.calls)
+
+
+def test_missing_cookie_falls_back_to_chart(monkeypatch):
+    def no_cookie(url, params=None, headers=None):
+        return HTTPResponse(url, 404, 'Not Found', Message(), b'')
+
+    monkeypatch.setattr(yahoo_quotes, 'yahoo_crumb', YahooCrumb(get=no_cookie))
+    upstream = RecordedYahoo(charts={'0700.HK': 'v8_chart_0700.HK.json'})
+    results = yahoo_quotes.fetch_quotes(['0700.HK'], fetch_json=upstream)
+
+    assert results['0700.HK']['currentPrice'] == 417.2
+    assert upstream.quote_params == []
+
+
+def test_rejected_multi_quote_is_disabled():
+    upstream = RecordedYahoo(charts={'AAPL': 'v8_chart_0700.HK.json'}, accepted_crumbs=())
+    yahoo_quotes.fetch_quotes(['AAPL'], fetch_json=upstream)
+    # 被拒後重新取得 crumb 再試一次
+    assert len(upstream.quote_params) == 2
+    upstream.calls.clear()
+    yahoo_quotes.fetch_quotes(['AAPL'], fetch_json=upstream)
+
+    assert all('/v8/' in url for url in upstream.calls)
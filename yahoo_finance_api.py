@@ -4,13 +4,34 @@ Yahoo Finance API 服務
 為港股和日股提供股票資訊和價格查詢
 """
 
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request, stream_with_context
 from flask_cors import CORS
 import yfinance as yf
+import json
 import logging
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime
 import traceback
 
+from market_data.governor import classify_error, governor
+from market_data.ledger import PortfolioLedger
+from market_data.nav import compute_daily_nav
+from market_data.negative_cache import (
+    DELISTED, ERROR_MESSAGES, FORMAT_INVALID, NOT_FOUND, is_missing_text, listing_reason, negative_cache,
+    negative_result
+)
+from market_data.ohlcv import REFRESH_INTERVALS, bars_to_records, ohlcv_store
+from market_data.portfolio import calculate_all_holdings, summarize_holdings
+from market_data.prefetch import PREFETCH_ENABLED, PrefetchScheduler
+from market_data.quote_cache import cache_key, quote_cache
+from market_data.search import SEARCH_DEFAULT_LIMIT, search_symbols
+from market_data.sessions import market_of_symbol
+from market_data.symbols import classify
+from market_data.valuation import to_yahoo_symbol, value_holdings
+
 # 設定日誌
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -18,98 +39,228 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__)
 CORS(app)  # 允許跨域請求
 
-def format_stock_data(ticker_obj, symbol, market):
-    """格式化股票資料為統一格式"""
+# 批次更新並行設定（可用環境變數或請求參數 max_concurrency 調整）
+BATCH_MAX_CONCURRENCY = int(os.environ.get('BATCH_MAX_CONCURRENCY', '8'))
+BATCH_CONCURRENCY_LIMIT = 32  # 並行數硬上限，避免觸發Yahoo限流
+
+# 增量持股帳本（依投資組合ID保存於記憶體）
+portfolio_ledgers = {}
+portfolio_ledgers_lock = threading.Lock()
+
+# 查詢計畫：各模式需要的欄位群組，以及依優先順序嘗試的上游來源
+# price 只需價格、metadata 只需名稱等基本資料、full 兩者皆需
+FETCH_PLANS = {
+    'price': {'fields': ('price',), 'sources': ('fast_info', 'info', 'history')},
+    'metadata': {'fields': ('metadata',), 'sources': ('info',)},
+    'full': {'fields': ('metadata', 'price'), 'sources': ('info', 'fast_info', 'history')}
+}
+
+# 查詢計畫統計：實際呼叫與省下的上游來源數
+fetch_plan_stats = {'requests': 0, 'sources_used': 0, 'sources_skipped': 0}
+fetch_plan_lock = threading.Lock()
+
+def format_stock_data(ticker_obj, symbol, market, fields='full', swr=False):
+    """
+    格式化股票資料為統一格式
+    TTL內直接回傳快取；相同股票的並行請求合併為一次 yfinance 查詢
+    swr=True 時，剛過期的快取先回傳（標記 stale）並在背景重新查詢
+    """
+    lookup = quote_cache.get_or_fetch_swr if swr else quote_cache.get_or_fetch
+    result = lookup(
+        cache_key(f'yfinance-{fields}', symbol),
+        lambda: fetch_stock_data(ticker_obj, symbol, market, fields)
+    )
+    result['market'] = market
+    return result
+
+def load_info_source(ticker_obj, result, needed):
+    """從 ticker.info 填入基本資料，有 currentPrice 時一併填入價格"""
+    info = ticker_obj.info or {}
+    filled = set()
+    
+    if 'metadata' in needed:
+        result.update({
+            'name': info.get('longName') or info.get('shortName', '未知'),
+            'currency': info.get('currency', 'USD'),
+            'exchange': info.get('exchange', '未知'),
+            'industry': info.get('industry', '未知'),
+            'sector': info.get('sector', '未知')
+        })
+        filled.add('metadata')
+    
+    if 'price' in needed and info.get('currentPrice'):
+        current_price = info.get('currentPrice')
+        previous_close = info.get('previousClose', current_price)
+        result.update({
+            'currentPrice': current_price,
+            'previousClose': previous_close,
+            'open': info.get('open', current_price),
+            'dayHigh': info.get('dayHigh', current_price),
+            'dayLow': info.get('dayLow', current_price),
+            'change': current_price - previous_close,
+            'changePercent': ((current_price - previous_close) / previous_close * 100) if previous_close else 0
+        })
+        filled.add('price')
+    
+    return filled
+
+def load_fast_info_source(ticker_obj, result, needed):
+    """從 ticker.fast_info 填入價格"""
+    fast_info = ticker_obj.fast_info
+    if not (hasattr(fast_info, 'lastPrice') and fast_info.lastPrice):
+        return set()
+    
+    result.update({
+        'currentPrice': fast_info.lastPrice,
+        'previousClose': fast_info.previousClose,
+        'open': fast_info.open,
+        'dayHigh': fast_info.dayHigh,
+        'dayLow': fast_info.dayLow,
+        'change': fast_info.lastPrice - fast_info.previousClose if fast_info.previousClose else 0,
+        'changePercent': ((fast_info.lastPrice - fast_info.previousClose) / fast_info.previousClose * 100) if fast_info.previousClose else 0
+    })
+    return {'price'}
+
+def load_history_source(ticker_obj, result, needed):
+    """最後手段：從最近1天的歷史資料填入價格"""
+    history = ticker_obj.history(period="1d")
+    if history.empty:
+        return set()
+    
+    latest = history.iloc[-1]
+    result.update({
+        'currentPrice': latest['Close'],
+        'previousClose': latest['Open'],
+        'open': latest['Open'],
+        'dayHigh': latest['High'],
+        'dayLow': latest['Low'],
+        'volume': int(latest['Volume']),
+        'change': latest['Close'] - latest['Open'],
+        'changePercent': ((latest['Close'] - latest['Open']) / latest['Open'] * 100) if latest['Open'] else 0
+    })
+    return {'price'}
+
+SOURCE_LOADERS = {
+    'info': load_info_source,
+    'fast_info': load_fast_info_source,
+    'history': load_history_source
+}
+
+def fetch_stock_data(ticker_obj, symbol, market, fields='full'):
+    """
+    依查詢計畫從 yfinance 獲取股票資料
+    依序嘗試計畫中的來源，所需欄位都填滿即停止，不再呼叫其餘來源
+    """
     try:
-        # 獲取基本資訊
-        info = ticker_obj.info
-        fast_info = ticker_obj.fast_info
-        
-        # 獲取歷史資料 (最近1天)
-        history = ticker_obj.history(period="1d")
+        plan = FETCH_PLANS.get(fields)
+        if plan is None:
+            raise ValueError(f"無效的查詢模式: {fields}")
         
-        # 基本資料
         result = {
             'symbol': symbol,
             'market': market,
-            'name': info.get('longName') or info.get('shortName', '未知'),
-            'currency': info.get('currency', 'USD'),
-            'exchange': info.get('exchange', '未知'),
-            'industry': info.get('industry', '未知'),
-            'sector': info.get('sector', '未知'),
             'timestamp': int(datetime.now().timestamp() * 1000)
         }
         
-        # 價格資料
-        if hasattr(fast_info, 'lastPrice') and fast_info.lastPrice:
-            result.update({
-                'currentPrice': fast_info.lastPrice,
-                'previousClose': fast_info.previousClose,
-                'open': fast_info.open,
-                'dayHigh': fast_info.dayHigh,
-                'dayLow': fast_info.dayLow,
-                'change': fast_info.lastPrice - fast_info.previousClose if fast_info.previousClose else 0,
-                'changePercent': ((fast_info.lastPrice - fast_info.previousClose) / fast_info.previousClose * 100) if fast_info.previousClose else 0
-            })
-        elif info.get('currentPrice'):
-            current_price = info.get('currentPrice')
-            previous_close = info.get('previousClose', current_price)
-            result.update({
-                'currentPrice': current_price,
-                'previousClose': previous_close,
-                'open': info.get('open', current_price),
-                'dayHigh': info.get('dayHigh', current_price),
-                'dayLow': info.get('dayLow', current_price),
-                'change': current_price - previous_close,
-                'changePercent': ((current_price - previous_close) / previous_close * 100) if previous_close else 0
-            })
-        elif not history.empty:
-            # 使用歷史資料
-            latest = history.iloc[-1]
-            result.update({
-                'currentPrice': latest['Close'],
-                'previousClose': latest['Open'],
-                'open': latest['Open'],
-                'dayHigh': latest['High'],
-                'dayLow': latest['Low'],
-                'volume': int(latest['Volume']),
-                'change': latest['Close'] - latest['Open'],
-                'changePercent': ((latest['Close'] - latest['Open']) / latest['Open'] * 100) if latest['Open'] else 0
-            })
-        else:
+        needed = set(plan['fields'])
+        sources_used = []
+        for source in plan['sources']:
+            if not needed:
+                break
+            # 經上游流量控制呼叫（限速、斷路器、限流時退避重試）
+            needed -= governor.call(
+                f'yfinance/{source}',
+                lambda: SOURCE_LOADERS[source](ticker_obj, result, needed)
+            )
+            sources_used.append(source)
+        
+        if 'price' in needed:
             raise ValueError("無法獲取價格資料")
         
+        skipped = len(plan['sources']) - len(sources_used)
+        result['fetchPlan'] = {
+            'fields': fields,
+            'sources': sources_used,
+            'skipped': skipped
+        }
+        with fetch_plan_lock:
+            fetch_plan_stats['requests'] += 1
+            fetch_plan_stats['sources_used'] += len(sources_used)
+            fetch_plan_stats['sources_skipped'] += skipped
+        
         return result
         
     except Exception as e:
         logger.error(f"格式化股票資料失敗 ({symbol}): {e}")
+        # yfinance 明確回報查無資料時寫入負向快取（404 無法分辨下市，視為查無此代號）
+        if classify_error(e) == 'client' and is_missing_text(e):
+            negative_cache.record(symbol, NOT_FOUND)
         raise
 
+def prefetch_prices(symbols):
+    """
+    預取排程的更新函數：重新查詢價格，更新實際請求會讀取的快取鍵（不論快取是否仍有效）
+    price 直接寫入；含價格的其他查詢模式（批次更新預設的 full）沿用快取中的基本資料、換上新價格，
+    不另外查詢基本資料
+    """
+    def refresh(symbol):
+        market = market_of_symbol(symbol)
+        try:
+            result = fetch_stock_data(yf.Ticker(symbol), symbol, market, 'price')
+            quote_cache.set(cache_key('yfinance-price', symbol), result)
+            for fields, plan in FETCH_PLANS.items():
+                if fields == 'price' or 'price' not in plan['fields']:
+                    continue
+                key = cache_key(f'yfinance-{fields}', symbol)
+                cached = quote_cache.peek(key)
+                if cached is not None:
+                    cached.update({k: v for k, v in result.items() if k != 'fetchPlan'})
+                    quote_cache.set(key, cached)
+        except Exception as e:
+            logger.warning(f"預取失敗 ({symbol}): {e}")
+    
+    with ThreadPoolExecutor(max_workers=min(BATCH_MAX_CONCURRENCY, len(symbols))) as executor:
+        list(executor.map(refresh, symbols))
+
+def held_yahoo_symbols():
+    """所有持股帳本中持有的股票（Yahoo 代號）"""
+    with portfolio_ledgers_lock:
+        ledgers = list(portfolio_ledgers.values())
+    symbols = set()
+    for ledger in ledgers:
+        for holding in ledger.holdings().values():
+            symbols.add(to_yahoo_symbol(holding['symbol'], holding.get('market')))
+    return symbols
+
+# 交易時段預取排程（處理第一個請求時啟動，每個行程一個）
+prefetch_scheduler = PrefetchScheduler(prefetch_prices, held_symbols=held_yahoo_symbols)
+
+@app.before_request
+def start_prefetch_scheduler():
+    """
+    在實際處理請求的行程啟動預取排程：不論 debug reloader、關閉 debug 或 gunicorn 等 WSGI 伺服器，
+    每個 worker 行程各啟動一次（已啟動時直接返回）
+    """
+    if PREFETCH_ENABLED:
+        prefetch_scheduler.start()
+
 @app.route('/api/yahoo-finance/stock-info/<symbol>')
 def get_stock_info(symbol):
     """獲取股票基本資訊"""
     try:
         logger.info(f"查詢股票資訊: {symbol}")
         
-        # 判斷市場
-        if symbol.endswith('.HK'):
-            market = 'HK'
-            clean_symbol = symbol
-        elif symbol.endswith('.T'):
-            market = 'JP'
-            clean_symbol = symbol
-        else:
-            # 自動添加後綴
-            if len(symbol) == 4 and symbol.isdigit():
-                # 港股格式
-                market = 'HK'
-                clean_symbol = f"{symbol}.HK"
-            elif len(symbol) == 4 and symbol.isdigit():
-                # 日股格式 (需要更精確的判斷邏輯)
-                market = 'JP'
-                clean_symbol = f"{symbol}.T"
-            else:
-                return jsonify({'error': '無效的股票代號格式'}), 400
+        # 判斷市場（無法判斷市場的4位數字預設為港股）
+        info = classify(symbol, default_market='HK')
+        if info.market not in ('HK', 'JP'):
+            return jsonify({'error': ERROR_MESSAGES[FORMAT_INVALID], 'reason': FORMAT_INVALID}), 400
+        market = info.market
+        clean_symbol = info.symbol
+        
+        # 確認查無資料的代號直接回傳，不建立 Ticker 查詢
+        negative = negative_cache.get(clean_symbol)
+        if negative is not None:
+            return jsonify(negative_result(clean_symbol, negative)), 404
         
         # 創建 yfinance Ticker 物件
         ticker = yf.Ticker(clean_symbol)
@@ -131,29 +282,26 @@ def get_stock_price(symbol):
     try:
         logger.info(f"查詢股票價格: {symbol}")
         
-        # 判斷市場並標準化代號
-        if symbol.endswith('.HK'):
-            market = 'HK'
-            clean_symbol = symbol
-        elif symbol.endswith('.T'):
-            market = 'JP'
-            clean_symbol = symbol
-        else:
-            # 根據長度和格式判斷
-            if len(symbol) == 4 and symbol.isdigit():
-                # 預設為港股
-                market = 'HK'
-                clean_symbol = f"{symbol}.HK"
-            else:
-                return jsonify({'error': '無效的股票代號格式'}), 400
+        # 判斷市場並標準化代號（無法判斷市場的4位數字預設為港股）
+        info = classify(symbol, default_market='HK')
+        if info.market not in ('HK', 'JP'):
+            return jsonify({'error': ERROR_MESSAGES[FORMAT_INVALID], 'reason': FORMAT_INVALID}), 400
+        market = info.market
+        clean_symbol = info.symbol
+        
+        # 確認查無資料的代號直接回傳，不建立 Ticker 查詢
+        negative = negative_cache.get(clean_symbol)
+        if negative is not None:
+            return jsonify(negative_result(clean_symbol, negative)), 404
         
         # 創建 yfinance Ticker 物件
         ticker = yf.Ticker(clean_symbol)
         
-        # 格式化資料
-        result = format_stock_data(ticker, clean_symbol, market)
+        # 格式化資料（只需價格欄位）
+        result = format_stock_data(ticker, clean_symbol, market, fields='price', swr=True)
+        prefetch_scheduler.track(clean_symbol)
         
-        logger.info(f"成功獲取股票價格: {clean_symbol} - {result.get('currentPrice')}")
+        logger.info(f"成功獲取股票價格: {clean_symbol} - {result.get('currentPrice')}{' (stale)' if result.get('stale') else ''}")
         return jsonify(result)
         
     except Exception as e:
@@ -161,58 +309,125 @@ def get_stock_price(symbol):
         logger.error(f"{error_msg}\n{traceback.format_exc()}")
         return jsonify({'error': error_msg}), 500
 
+@app.route('/api/yahoo-finance/history/<symbol>')
+def get_stock_history(symbol):
+    """
+    獲取歷史K線（本地資料庫，只下載缺少的區段）
+    參數：interval（預設 1d）、start、end（YYYY-MM-DD）、market（HK 或 JP，代號無後綴時使用）
+    """
+    try:
+        interval = request.args.get('interval', '1d')
+        if interval not in REFRESH_INTERVALS:
+            return jsonify({'error': '無效的 interval 參數'}), 400
+
+        # 標準化股票代號
+        clean_symbol = classify(symbol, market=request.args.get('market'), default_market='HK').symbol
+
+        try:
+            bars = ohlcv_store.range(
+                clean_symbol, interval,
+                start=request.args.get('start') or None,
+                end=request.args.get('end') or None
+            )
+        except ValueError:
+            return jsonify({'error': '無效的日期格式'}), 400
+
+        logger.info(f"查詢歷史K線: {clean_symbol} {interval} - {len(bars)} 根")
+        return jsonify({
+            'symbol': clean_symbol,
+            'interval': interval,
+            'bars': bars_to_records(bars),
+            'count': len(bars),
+            'timestamp': int(datetime.now().timestamp() * 1000)
+        })
+
+    except Exception as e:
+        error_msg = f"獲取歷史K線失敗: {str(e)}"
+        logger.error(f"{error_msg}\n{traceback.format_exc()}")
+        return jsonify({'error': error_msg}), 500
+
+def update_single_stock(stock_info, fields='full'):
+    """批次更新中的單一股票查詢，回傳 (是否成功, 結果或錯誤資訊)"""
+    started = time.perf_counter()
+    symbol = stock_info.get('symbol')
+    try:
+        market = stock_info.get('market', 'HK')
+        
+        if not symbol:
+            return False, {
+                'symbol': '未知',
+                'error': '缺少股票代號',
+                'latency_ms': round((time.perf_counter() - started) * 1000, 1)
+            }
+        
+        # 標準化股票代號
+        clean_symbol = classify(symbol, market=market).symbol
+        
+        # 獲取股票資料
+        ticker = yf.Ticker(clean_symbol)
+        result = format_stock_data(ticker, clean_symbol, market, fields)
+        if 'price' in FETCH_PLANS[fields]['fields']:
+            prefetch_scheduler.track(clean_symbol)
+        
+        # 添加原始股票資訊
+        result.update({
+            'originalSymbol': symbol,
+            'id': stock_info.get('id'),
+            'success': True,
+            'latency_ms': round((time.perf_counter() - started) * 1000, 1)
+        })
+        return True, result
+        
+    except Exception as e:
+        logger.error(f"批次更新失敗 ({symbol}): {e}")
+        return False, {
+            'symbol': symbol or '未知',
+            'error': str(e),
+            'success': False,
+            'latency_ms': round((time.perf_counter() - started) * 1000, 1)
+        }
+
+def parse_batch_options(data):
+    """解析批次更新參數，回傳 (股票清單, 並行數, 查詢模式)；參數無效時拋出 ValueError"""
+    if not data or 'stocks' not in data:
+        raise ValueError('請提供股票清單')
+    
+    max_concurrency = data.get('max_concurrency', BATCH_MAX_CONCURRENCY)
+    try:
+        max_concurrency = max(1, min(int(max_concurrency), BATCH_CONCURRENCY_LIMIT))
+    except (TypeError, ValueError):
+        raise ValueError('無效的 max_concurrency 參數')
+    
+    # 查詢模式：full（預設）、price 或 metadata
+    fields = data.get('fields', 'full')
+    if fields not in FETCH_PLANS:
+        raise ValueError('無效的 fields 參數')
+    
+    return data['stocks'], max_concurrency, fields
+
 @app.route('/api/yahoo-finance/batch-update', methods=['POST'])
 def batch_update():
     """批次更新多個股票"""
     try:
-        data = request.get_json()
-        if not data or 'stocks' not in data:
-            return jsonify({'error': '請提供股票清單'}), 400
+        try:
+            stocks, max_concurrency, fields = parse_batch_options(request.get_json())
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
-        stocks = data['stocks']
         results = []
         errors = []
         
-        logger.info(f"批次更新 {len(stocks)} 個股票")
+        logger.info(f"批次更新 {len(stocks)} 個股票 (並行數: {max_concurrency})")
         
-        for stock_info in stocks:
-            try:
-                symbol = stock_info.get('symbol')
-                market = stock_info.get('market', 'HK')
-                
-                if not symbol:
-                    errors.append({'symbol': '未知', 'error': '缺少股票代號'})
-                    continue
-                
-                # 標準化股票代號
-                if market == 'HK' and not symbol.endswith('.HK'):
-                    clean_symbol = f"{symbol}.HK"
-                elif market == 'JP' and not symbol.endswith('.T'):
-                    clean_symbol = f"{symbol}.T"
-                else:
-                    clean_symbol = symbol
-                
-                # 獲取股票資料
-                ticker = yf.Ticker(clean_symbol)
-                result = format_stock_data(ticker, clean_symbol, market)
-                
-                # 添加原始股票資訊
-                result.update({
-                    'originalSymbol': symbol,
-                    'id': stock_info.get('id'),
-                    'success': True
-                })
-                
-                results.append(result)
-                
-            except Exception as e:
-                error_info = {
-                    'symbol': stock_info.get('symbol', '未知'),
-                    'error': str(e),
-                    'success': False
-                }
-                errors.append(error_info)
-                logger.error(f"批次更新失敗 ({stock_info.get('symbol')}): {e}")
+        if stocks:
+            workers = min(max_concurrency, len(stocks))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                # map 保留輸入順序，回應與原本的逐一處理一致
+                for success, payload in executor.map(lambda stock: update_single_stock(stock, fields), stocks):
+                    if success:
+                        results.append(payload)
+                    else:
+                        errors.append(payload)
         
         response = {
             'results': results,
@@ -231,15 +446,324 @@ def batch_update():
         logger.error(f"{error_msg}\n{traceback.format_exc()}")
         return jsonify({'error': error_msg}), 500
 
+def iter_batch_updates(stocks, max_concurrency, fields):
+    """
+    依完成順序逐一產生批次更新結果 (是否成功, 結果或錯誤資訊)
+    同時進行中的查詢不超過 max_concurrency，已產生的結果不再保留，記憶體用量與批次大小無關
+    """
+    stock_iter = iter(stocks)
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        pending = set()
+        for stock in stock_iter:
+            pending.add(executor.submit(update_single_stock, stock, fields))
+            if len(pending) >= max_concurrency:
+                break
+        
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+                for next_stock in stock_iter:
+                    pending.add(executor.submit(update_single_stock, next_stock, fields))
+                    break
+
+def format_stream_record(record_type, payload, stream_format):
+    """將一筆紀錄格式化為 NDJSON 行或 Server-Sent Event"""
+    body = json.dumps(dict(payload, type=record_type), ensure_ascii=False)
+    if stream_format == 'sse':
+        return f"event: {record_type}\ndata: {body}\n\n"
+    return f"{body}\n"
+
+@app.route('/api/yahoo-finance/batch-update/stream', methods=['POST'])
+def batch_update_stream():
+    """
+    串流版批次更新
+    每個股票完成即輸出一筆紀錄（NDJSON 或 SSE，由 ?format= 指定），最後輸出總結紀錄
+    """
+    try:
+        stocks, max_concurrency, fields = parse_batch_options(request.get_json())
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    stream_format = request.args.get('format', 'ndjson')
+    if stream_format not in ('ndjson', 'sse'):
+        return jsonify({'error': '無效的 format 參數'}), 400
+    
+    logger.info(f"串流批次更新 {len(stocks)} 個股票 (並行數: {max_concurrency})")
+    
+    def generate():
+        success_count = 0
+        error_count = 0
+        try:
+            for success, payload in iter_batch_updates(stocks, max_concurrency, fields):
+                if success:
+                    success_count += 1
+                    yield format_stream_record('result', payload, stream_format)
+                else:
+                    error_count += 1
+                    yield format_stream_record('error', payload, stream_format)
+        except Exception as e:
+            logger.error(f"串流批次更新失敗: {e}\n{traceback.format_exc()}")
+            yield format_stream_record('error', {'error': f"批次更新失敗: {str(e)}"}, stream_format)
+        
+        yield format_stream_record('summary', {
+            'total': len(stocks),
+            'success_count': success_count,
+            'error_count': error_count,
+            'timestamp': int(datetime.now().timestamp() * 1000)
+        }, stream_format)
+        logger.info(f"串流批次更新完成: {success_count}/{len(stocks)} 成功")
+    
+    mimetype = 'text/event-stream' if stream_format == 'sse' else 'application/x-ndjson'
+    return Response(
+        stream_with_context(generate()),
+        mimetype=mimetype,
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/api/portfolio/holdings', methods=['POST'])
+def portfolio_holdings():
+    """
+    計算所有持股（FIFO）與損益
+    請求：{transactions: [...], prices: {symbol: 現價}, include_closed: false}
+    """
+    try:
+        data = request.get_json()
+        if not data or 'transactions' not in data:
+            return jsonify({'error': '請提供交易記錄'}), 400
+        
+        transactions = data['transactions']
+        holdings = calculate_all_holdings(
+            transactions,
+            prices=data.get('prices'),
+            include_closed=bool(data.get('include_closed', False))
+        )
+        
+        logger.info(f"持股計算完成: {len(transactions)} 筆交易, {len(holdings)} 檔股票")
+        return jsonify({
+            'holdings': holdings,
+            'summary': summarize_holdings(holdings),
+            'transaction_count': len(transactions),
+            'timestamp': int(datetime.now().timestamp() * 1000)
+        })
+        
+    except Exception as e:
+        error_msg = f"持股計算失敗: {str(e)}"
+        logger.error(f"{error_msg}\n{traceback.format_exc()}")
+        return jsonify({'error': error_msg}), 500
+
+@app.route('/api/portfolio/valuation', methods=['POST'])
+def portfolio_valuation():
+    """
+    持股台幣估值（取代前端逐筆 convertToTWD）
+    請求：{holdings: [...]} 或 {transactions: [...]}，可選 prices: {symbol: 現價}、rates: {USD_TWD, HKD_TWD, JPY_TWD}
+    未提供的現價與匯率以一次批次查詢取得
+    """
+    try:
+        data = request.get_json()
+        if not data or ('holdings' not in data and 'transactions' not in data):
+            return jsonify({'error': '請提供持股或交易記錄'}), 400
+
+        if 'holdings' in data:
+            holdings = data['holdings']
+            if isinstance(holdings, dict):
+                holdings = list(holdings.values())
+        else:
+            holdings = list(calculate_all_holdings(data['transactions']).values())
+
+        prices = {str(k).upper(): v for k, v in (data.get('prices') or {}).items()}
+        if prices:
+            holdings = [
+                dict(h, currentPrice=prices[str(h.get('symbol', '')).upper()])
+                if prices.get(str(h.get('symbol', '')).upper()) else h
+                for h in holdings
+            ]
+
+        valuation = value_holdings(holdings, rates=data.get('rates'))
+        valuation['timestamp'] = int(datetime.now().timestamp() * 1000)
+
+        logger.info(f"持股估值完成: {len(valuation['holdings'])} 檔股票, 匯率來源 {valuation['rateSources']}")
+        return jsonify(valuation)
+
+    except Exception as e:
+        error_msg = f"持股估值失敗: {str(e)}"
+        logger.error(f"{error_msg}\n{traceback.format_exc()}")
+        return jsonify({'error': error_msg}), 500
+
+def build_nav_response(transactions, options):
+    """依請求參數計算每日淨值序列並加上時間戳記"""
+    result = compute_daily_nav(
+        transactions,
+        start=options.get('start') or None,
+        end=options.get('end') or None,
+        weekdays_only=str(options.get('weekdays_only', 'true')).lower() != 'false',
+        refresh=str(options.get('refresh', 'false')).lower() == 'true'
+    )
+    result['timestamp'] = int(datetime.now().timestamp() * 1000)
+    return result
+
+@app.route('/api/portfolio/nav', methods=['POST'])
+def portfolio_nav():
+    """
+    每日淨值序列（台幣）：市值、成本、未實現與已實現損益，整體與各市場
+    請求：{transactions: [...], start, end, weekdays_only: true, refresh: false}
+    預設只讀本地K線，缺少的收盤價在背景補齊（回應的 refreshing 列出補齊中的股票）；
+    refresh: true 時先並行下載補齊再計算
+    """
+    try:
+        data = request.get_json()
+        if not data or 'transactions' not in data:
+            return jsonify({'error': '請提供交易記錄'}), 400
+
+        started = time.perf_counter()
+        try:
+            result = build_nav_response(data['transactions'], data)
+        except ValueError as e:
+            return jsonify({'error': f'無效的日期參數: {str(e)}'}), 400
+
+        logger.info(
+            f"淨值序列計算完成: {len(data['transactions'])} 筆交易, {len(result['dates'])} 天, "
+            f"{(time.perf_counter() - started) * 1000:.0f}ms"
+        )
+        return jsonify(result)
+
+    except Exception as e:
+        error_msg = f"淨值序列計算失敗: {str(e)}"
+        logger.error(f"{error_msg}\n{traceback.format_exc()}")
+        return jsonify({'error': error_msg}), 500
+
+@app.route('/api/portfolio/<portfolio_id>/nav')
+def get_portfolio_nav(portfolio_id):
+    """以增量持股帳本的交易記錄計算每日淨值序列（參數同 POST /api/portfolio/nav）"""
+    with portfolio_ledgers_lock:
+        ledger = portfolio_ledgers.get(portfolio_id)
+    if ledger is None:
+        return jsonify({'error': f'找不到持股帳本: {portfolio_id}'}), 404
+
+    try:
+        return jsonify(build_nav_response(ledger.transactions(), request.args))
+    except ValueError as e:
+        return jsonify({'error': f'無效的日期參數: {str(e)}'}), 400
+    except Exception as e:
+        error_msg = f"淨值序列計算失敗: {str(e)}"
+        logger.error(f"{error_msg}\n{traceback.format_exc()}")
+        return jsonify({'error': error_msg}), 500
+
+@app.route('/api/portfolio/<portfolio_id>/ledger', methods=['POST'])
+def load_portfolio_ledger(portfolio_id):
+    """以完整交易記錄建立（或取代）增量持股帳本"""
+    try:
+        data = request.get_json()
+        if not data or 'transactions' not in data:
+            return jsonify({'error': '請提供交易記錄'}), 400
+        
+        ledger = PortfolioLedger(data['transactions'])
+        with portfolio_ledgers_lock:
+            portfolio_ledgers[portfolio_id] = ledger
+        
+        holdings = ledger.holdings(prices=data.get('prices'))
+        logger.info(f"建立持股帳本 {portfolio_id}: {len(data['transactions'])} 筆交易")
+        return jsonify({
+            'holdings': holdings,
+            'summary': summarize_holdings(holdings),
+            'timestamp': int(datetime.now().timestamp() * 1000)
+        })
+        
+    except Exception as e:
+        error_msg = f"建立持股帳本失敗: {str(e)}"
+        logger.error(f"{error_msg}\n{traceback.format_exc()}")
+        return jsonify({'error': error_msg}), 500
+
+@app.route('/api/portfolio/<portfolio_id>/events', methods=['POST'])
+def apply_portfolio_events(portfolio_id):
+    """
+    套用交易事件（buy、sell、edit、delete），只重算受影響的股票
+    請求：{events: [...], prices: {...}, verify: false}；verify 為 true 時與全量重算比對
+    """
+    try:
+        data = request.get_json()
+        if not data or 'events' not in data:
+            return jsonify({'error': '請提供交易事件'}), 400
+        
+        with portfolio_ledgers_lock:
+            ledger = portfolio_ledgers.get(portfolio_id)
+        if ledger is None:
+            return jsonify({'error': f'找不到持股帳本: {portfolio_id}'}), 404
+        
+        affected = set()
+        for index, event in enumerate(data['events']):
+            try:
+                affected.update(ledger.apply(event))
+            except ValueError as e:
+                # 先前的事件已套用，回報失敗的事件位置
+                return jsonify({
+                    'error': str(e),
+                    'failed_index': index,
+                    'holdings': ledger.holdings(sorted(affected), data.get('prices'), include_closed=True)
+                }), 400
+        
+        response = {
+            'affected': sorted(affected),
+            'holdings': ledger.holdings(sorted(affected), data.get('prices'), include_closed=True),
+            'timestamp': int(datetime.now().timestamp() * 1000)
+        }
+        if data.get('verify'):
+            mismatches = ledger.verify()
+            response['verification'] = {'ok': not mismatches, 'mismatches': mismatches}
+            if mismatches:
+                logger.warning(f"持股帳本 {portfolio_id} 驗證不一致: {mismatches}")
+        
+        return jsonify(response)
+        
+    except Exception as e:
+        error_msg = f"套用交易事件失敗: {str(e)}"
+        logger.error(f"{error_msg}\n{traceback.format_exc()}")
+        return jsonify({'error': error_msg}), 500
+
+@app.route('/api/portfolio/<portfolio_id>/holdings')
+def get_portfolio_holdings(portfolio_id):
+    """取得增量持股帳本目前的持股"""
+    with portfolio_ledgers_lock:
+        ledger = portfolio_ledgers.get(portfolio_id)
+    if ledger is None:
+        return jsonify({'error': f'找不到持股帳本: {portfolio_id}'}), 404
+    
+    holdings = ledger.holdings()
+    return jsonify({
+        'holdings': holdings,
+        'summary': summarize_holdings(holdings),
+        'timestamp': int(datetime.now().timestamp() * 1000)
+    })
+
 @app.route('/api/yahoo-finance/health')
 def health_check():
     """健康檢查端點"""
     return jsonify({
         'status': 'healthy',
         'service': 'Yahoo Finance API',
+        'fetch_plan': fetch_plan_stats,
+        'prefetch': prefetch_scheduler.status(),
+        'quote_cache': quote_cache.stats(),
+        'negative_cache': negative_cache.stats(),
+        'upstream': governor.status(),
         'timestamp': int(datetime.now().timestamp() * 1000)
     })
 
+@app.route('/api/yahoo-finance/search')
+def search_stock_symbols():
+    """
+    股票代號搜尋（自動完成）
+    參數：q（代號或名稱片段）、limit（預設 10）、market（HK、JP、TW，可省略）
+    """
+    result = search_symbols(
+        request.args.get('q', ''),
+        request.args.get('limit', SEARCH_DEFAULT_LIMIT),
+        request.args.get('market')
+    )
+    if result.get('error'):
+        return jsonify(result), 400
+    return jsonify(result)
+
 @app.route('/api/yahoo-finance/test/<symbol>')
 def test_symbol(symbol):
     """測試股票代號"""
@@ -255,19 +779,33 @@ def test_symbol(symbol):
             test_symbols = [symbol]
         
         results = []
+        negatives = negative_cache.get_many(test_symbols)
+        reasons = [entry['reason'] for entry in negatives.values()]
         
         for test_symbol in test_symbols:
+            # 確認查無資料的格式不再建立 Ticker 查詢
+            if test_symbol.upper() in negatives:
+                continue
             try:
                 ticker = yf.Ticker(test_symbol)
-                info = ticker.info
+                info = governor.call('yfinance/info', lambda: ticker.info)
                 
                 if info and info.get('longName'):
                     market = 'HK' if test_symbol.endswith('.HK') else 'JP'
                     result = format_stock_data(ticker, test_symbol, market)
                     results.append(result)
+                else:
+                    # 查無資料為 NOT_FOUND；代號仍在但沒有價格與交易時間才記為已下市
+                    reason = listing_reason(info if info and (info.get('shortName') or info.get('quoteType')) else None)
+                    if reason is not None:
+                        negative_cache.record(test_symbol, reason)
+                        reasons.append(reason)
                     
             except Exception as e:
                 logger.warning(f"測試 {test_symbol} 失敗: {e}")
+                if classify_error(e) == 'client':
+                    negative_cache.record(test_symbol, NOT_FOUND)
+                    reasons.append(NOT_FOUND)
                 continue
         
         if results:
@@ -279,6 +817,7 @@ def test_symbol(symbol):
         else:
             return jsonify({
                 'found': False,
+                'reason': DELISTED if DELISTED in reasons else NOT_FOUND,
                 'message': f'找不到股票代號 {symbol} 的資料'
             }), 404
             